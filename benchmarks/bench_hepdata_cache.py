@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import timeit
+
+import numpy as np
+
+from couplingscan.hepdata import load_hepdata
+
+# Compares loading a HEPData table from its JSON with loading it again from
+# the .couplingscan_cache made by the first load, on the CMS dijet limits
+# shipped with the tests. The cached load is memory-mapped, so the scans
+# and limits built from it are checked against those from the JSON first.
+# Run from the top directory with: python benchmarks/bench_hepdata_cache.py
+
+source = os.path.join("test", "dijet_hepdata", "hepdata_gqplot_cms36ifb.json")
+
+def built_from(table) :
+    # What the job file driver builds from a table of dijet limits.
+    # The table only has mediator masses, so the DM mass is set afterwards.
+    scan = table.model_scan('axial', gq=0.25, gdm=1.0, gl=0.0, mdm="x0")
+    scan.mdm = np.full_like(scan.mmed, 1.0)
+    limit = table.dijet_coupling_limit(mdm=1.0, gdm=1.0, gl=0.0, coupling='axial')
+    return scan, limit
+
+def best_time(function, repeat) :
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+def main() :
+    with tempfile.TemporaryDirectory() as directory :
+        path = os.path.join(directory, os.path.basename(source))
+        shutil.copy(source, path)
+        parsed = built_from(load_hepdata(path))
+        cached = built_from(load_hepdata(path))
+
+        # Make sure the cached load gives the same arrays before timing it.
+        for first, second in zip(parsed, cached) :
+            for attr in ["mmed", "mdm", "gq_limits"] :
+                if not hasattr(first, attr) : continue
+                a, b = getattr(first, attr), getattr(second, attr)
+                assert type(a) is type(b) and a.shape == b.shape and np.array_equal(a, b), attr
+        scan, limit = parsed
+        assert np.array_equal(limit.extract_exclusion_depths(scan), cached[1].extract_exclusion_depths(cached[0]), equal_nan=True)
+
+        parse = best_time(lambda : load_hepdata(path, cache=False), repeat=5)
+        load = best_time(lambda : load_hepdata(path), repeat=5)
+        print("{0:>12} {1:>12} {2:>10}".format("parse [s]", "cached [s]", "speedup"))
+        print("{0:>12.4g} {1:>12.4g} {2:>10.1f}".format(parse, load, parse/load))
+
+if __name__ == "__main__" :
+    main()
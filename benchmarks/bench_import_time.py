@@ -0,0 +1,61 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# Start-up cost of the package: each case runs in a fresh interpreter,
+# so nothing is already imported or loaded.
+# Width-only work should not pay for scipy.integrate or a PDF grid;
+# the LHAPDF case shows what the first hadron-level call adds.
+# Run from the top directory with: python benchmarks/bench_import_time.py
+
+cases = {
+    # The floor: everything below imports numpy.
+    "import numpy" : "import numpy",
+    "import couplingscan.scan" : "import couplingscan.scan",
+    "import couplingscan.rescaler" : "import couplingscan.rescaler",
+    "widths" : "from couplingscan.scan import DMVectorModelScan\n"
+        "DMVectorModelScan(mmed=1000., mdm=100., gq=0.25, gdm=1.0, gl=0.01).mediator_total_width()",
+}
+
+# Only run when lhapdfwrap is available.
+lhapdf_cases = {
+    "first hadronic integral" : "from couplingscan.scan import DMVectorModelScan\n"
+        "DMVectorModelScan(mmed=1000., mdm=100., gq=0.25, gdm=1.0, gl=0.01).hadron_level_xsec_monox_relative(engine='batch')",
+}
+
+# Times the statement inside the child, leaving out interpreter start-up.
+_timer = """
+import time
+start = time.perf_counter()
+{0}
+print(time.perf_counter() - start)
+"""
+
+def time_in_fresh_process(statement) :
+    output = subprocess.run([sys.executable, "-c", _timer.format(statement)],
+        capture_output=True, text=True, check=True).stdout
+    return float(output.split()[-1])
+
+def main() :
+    parser = argparse.ArgumentParser(description="Time importing couplingscan and its first calls in fresh processes.")
+    parser.add_argument("--repeat", type=int, default=5, help="Processes per case; the best is kept")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    from couplingscan.pdf import hasLHAPDF
+    to_run = dict(cases, **lhapdf_cases) if hasLHAPDF else cases
+
+    results = {}
+    for name, statement in to_run.items() :
+        results[name] = min(time_in_fresh_process(statement) for i in range(args.repeat))
+        print("{0:<35} {1:>10.4g} s".format(name, results[name]))
+    if not hasLHAPDF :
+        print("{0:<35} skipped: needs LHAPDF".format(list(lhapdf_cases)[0]))
+
+    if args.output :
+        with open(args.output, "w") as output_file :
+            json.dump(results, output_file, indent=2)
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,67 @@
+import timeit
+
+import numpy as np
+import scipy.integrate as integrate
+
+from couplingscan.integration import parton_integrals_vectorised, parton_integrands
+
+# Checks the vectorised parton-level integrals against adaptive quad, from
+# wide resonances down to very narrow ones, where most of the integral sits
+# within a few widths of the peak and the rest on its shoulders.
+# Then times both on a grid of mass points.
+# Run from the top directory with: python benchmarks/bench_resonance_quadrature.py
+
+ECM = 13000.**2
+relative_widths = [0.3, 0.03, 1e-3, 5e-5, 1e-5, 1e-7]
+masses = [(2000., 100.), (500., 1.), (3000., 10.), (2000., 1200.), (12000., 50.)]
+
+def adaptive_integral(integrand, M, mDM, gamma) :
+    # quad split at the peak and at 1, 10, 100, ... widths either side of it,
+    # so that no piece hides a feature from it. Within 10**4 widths of the peak
+    # each piece is integrated in arctan((s - M**2)/(M gamma)), which flattens
+    # the Breit-Wigner, and further out in log(s).
+    smin = max(4.*mDM**2, 1e-10*ECM)
+    breaks = [M**2 + sign*M*gamma*10.**j for sign in (-1, 1) for j in range(9)] + [M**2]
+    edges = [smin] + sorted(b for b in breaks if smin < b < ECM) + [ECM]
+    in_log = lambda u : integrand(np.exp(u), gamma, M, mDM)*np.exp(u)
+    in_theta = lambda theta : integrand(M**2 + M*gamma*np.tan(theta), gamma, M, mDM)*M*gamma/np.cos(theta)**2
+    total = 0.
+    for a, b in zip(edges[:-1], edges[1:]) :
+        if max(abs(a - M**2), abs(b - M**2)) <= 1e4*M*gamma :
+            function, limits = in_theta, np.arctan((np.array([a, b]) - M**2)/(M*gamma))
+        else :
+            function, limits = in_log, np.log([a, b])
+        total += integrate.quad(function, *limits, epsabs=0, epsrel=1e-12, limit=4000)[0]
+    return total
+
+def check_accuracy() :
+    print("{0:>30} {1:>8} {2:>7} {3:>8} {4:>10} {5:>10}".format("integrand", "mmed", "mdm", "width", "error", "estimate"))
+    for name, integrand in parton_integrands.items() :
+        for M, mDM in masses :
+            for width in relative_widths :
+                reference = adaptive_integral(integrand, M, mDM, width*M)
+                value, estimate = parton_integrals_vectorised(integrand, M, mDM, width*M, ECM)
+                error, estimate = abs(value[0]/reference - 1.), estimate[0]/reference
+                print("{0:>30} {1:>8g} {2:>7g} {3:>8g} {4:>10.2e} {5:>10.2e}".format(name, M, mDM, width, error, estimate))
+                # Both the integral and its error estimate have to be good:
+                # the estimate is what callers use to decide whether to trust it.
+                assert error < 1e-8, (name, M, mDM, width, error)
+                assert error < max(10.*estimate, 1e-10), (name, M, mDM, width, error, estimate)
+
+def check_timing(npoints=200) :
+    rng = np.random.default_rng(0)
+    M = rng.uniform(100., 5000., npoints)
+    mDM = rng.uniform(1., 1000., npoints)
+    gamma = 10.**rng.uniform(-5., -1., npoints)*M
+    integrand = parton_integrands['integrand_parton_vector']
+    adaptive = timeit.timeit(lambda : [adaptive_integral(integrand, *point) for point in zip(M, mDM, gamma)], number=1)
+    vectorised = min(timeit.repeat(lambda : parton_integrals_vectorised(integrand, M, mDM, gamma, ECM), number=1, repeat=5))
+    print("{0:>10} {1:>12} {2:>12} {3:>10}".format("points", "quad [s]", "vector [s]", "speedup"))
+    print("{0:>10} {1:>12.4g} {2:>12.4g} {3:>10.1f}".format(npoints, adaptive, vectorised, adaptive/vectorised))
+
+def main() :
+    check_accuracy()
+    check_timing()
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,44 @@
+import math
+import timeit
+
+import numpy as np
+
+from couplingscan.interpolation import interpolate_in_width
+
+# Compares the vectorised width interpolation used by pick_appropriate_limit
+# against the per-point loop it replaced, for six width curves
+# as in the dilepton limits.
+# Run from the top directory with: python benchmarks/bench_width_interpolation.py
+
+def loop_interpolation(test_widths, limit_widths, limit_sets) :
+    # The previous implementation.
+    appropriate_limits = []
+    for width, limits in zip(test_widths,limit_sets.transpose()) :
+        appropriate_observed = np.interp([width], limit_widths, limits,left=limits[0],right=math.nan)
+        appropriate_limits.append(appropriate_observed[0])
+    return np.array(appropriate_limits)
+
+def make_inputs(npoints, nwidths=6, seed=0) :
+    rng = np.random.default_rng(seed)
+    limit_widths = np.linspace(0.0, 0.1, nwidths)
+    limit_sets = rng.uniform(0.1, 10., (nwidths, npoints))
+    # Some widths beyond the largest curve, to exercise the NaN branch.
+    test_widths = rng.uniform(0.0, 0.12, npoints)
+    return test_widths, limit_widths, limit_sets
+
+def best_time(function, args, repeat) :
+    number = 1
+    return min(timeit.repeat(lambda : function(*args), number=number, repeat=repeat))/number
+
+def main() :
+    print("{0:>10} {1:>12} {2:>12} {3:>10}".format("points", "loop [s]", "vector [s]", "speedup"))
+    for npoints in [10**4, 10**5, 10**6] :
+        args = make_inputs(npoints)
+        # Make sure both give the same answer before timing them.
+        assert np.allclose(loop_interpolation(*args), interpolate_in_width(*args), equal_nan=True)
+        loop = best_time(loop_interpolation, args, repeat=1 if npoints > 10**5 else 3)
+        vector = best_time(interpolate_in_width, args, repeat=5)
+        print("{0:>10} {1:>12.4g} {2:>12.4g} {3:>10.1f}".format(npoints, loop, vector, loop/vector))
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import warnings
+
+import numpy as np
+
+from couplingscan.scan import *
+from couplingscan.rescaler import Rescaler
+from couplingscan.limitparsers import CouplingLimit_Dijet, CrossSectionLimit_Dilepton
+from couplingscan.tables import HadronicTable
+from couplingscan import pdf
+
+# Benchmarks for the widths, each Rescaler.rescale_by_ method and the limit parsers,
+# on mass grids of increasing size. Inputs are synthetic but shaped like the
+# real ones, so no HEPData files are needed.
+# Run from the top directory:
+#   python benchmarks/run_benchmarks.py --output results.json
+#   python benchmarks/run_benchmarks.py --compare results.json
+# Cases needing LHAPDF are skipped when it is not available.
+
+# name : (setup function, needs LHAPDF, largest size worth running)
+benchmarks = {}
+
+def benchmark(name, requires_lhapdf=False, max_size=10**6) :
+    '''
+    Registers a benchmark. The decorated function takes the number of mass points,
+    does any setup, and returns the callable to be timed.
+    It is called afresh before every timing, so cached results never carry over.
+    '''
+    def register(setup) :
+        benchmarks[name] = (setup, requires_lhapdf, max_size)
+        return setup
+    return register
+
+def mass_grid(npoints) :
+    '''Roughly square grid of npoints (mmed, mdm) points, with mdm below mmed/2 and above it.'''
+    nx = max(1, int(round(np.sqrt(npoints))))
+    ny = int(np.ceil(npoints/nx))
+    mmed, mdm = np.meshgrid(np.linspace(50., 5000., nx), np.linspace(1., 2000., ny))
+    return mmed.ravel()[:npoints], mdm.ravel()[:npoints]
+
+def quietly(function, *args, **kwargs) :
+    # The rescalers and limit parsers explain their inputs on stdout.
+    with contextlib.redirect_stdout(io.StringIO()) :
+        return function(*args, **kwargs)
+
+for model, scan_class in model_scans.items() :
+    def width_setup(npoints, scan_class=scan_class) :
+        mmed, mdm = mass_grid(npoints)
+        scan = scan_class(mmed=mmed, mdm=mdm, gq=0.25, gdm=1.0, gl=0.01)
+        return scan.mediator_total_width
+    benchmark("width_{0}".format(model))(width_setup)
+
+def make_rescaler(npoints, width_curves=(0.01, 0.03, 0.05, 0.1)) :
+    mmed, mdm = mass_grid(npoints)
+    reference = DMAxialModelScan(mmed=mmed, mdm=mdm, gq=0.25, gdm=1.0, gl=0.01)
+    depths = {width : np.linspace(0.5, 2., npoints)*(1. + width) for width in width_curves}
+    return quietly(Rescaler, reference, depths)
+
+def rescale_setup(method, **options) :
+    def setup(npoints) :
+        rescaler = make_rescaler(npoints)
+        return lambda : quietly(getattr(rescaler, "rescale_by_" + method), 0.1, 1.0, 0.01, model='vector', **options)
+    return setup
+
+benchmark("rescale_br_quarks")(rescale_setup("br_quarks"))
+benchmark("rescale_br_leptons")(rescale_setup("br_leptons"))
+benchmark("rescale_parton_level_xsec_monox_vectorised", max_size=10**5)(rescale_setup("parton_level_xsec_monox", vectorised=True))
+benchmark("rescale_parton_level_xsec_monox", requires_lhapdf=True, max_size=10**3)(rescale_setup("parton_level_xsec_monox"))
+benchmark("rescale_hadronic_xsec_monox_batch", requires_lhapdf=True, max_size=10**3)(rescale_setup("hadronic_xsec_monox", engine='batch', n_workers=None))
+# The luminosity table is built on the first call, then reused from memory.
+benchmark("rescale_hadronic_xsec_monox_luminosity", requires_lhapdf=True, max_size=10**5)(rescale_setup("hadronic_xsec_monox", engine='luminosity'))
+
+@benchmark("rescale_propagator")
+def propagator_setup(npoints) :
+    # Only valid within a model.
+    rescaler = make_rescaler(npoints)
+    return lambda : quietly(rescaler.rescale_by_propagator, 0.1, 1.0, 0.01, model='axial')
+
+@benchmark("rescale_coupling_grid_propagator", max_size=10**5)
+def coupling_grid_setup(npoints) :
+    # Same, for a 10 x 10 grid of target couplings.
+    rescaler = make_rescaler(npoints)
+    couplings = np.linspace(0.05, 1., 10)
+    return lambda : quietly(rescaler.rescale_by_propagator, couplings, couplings, 0.01, model='axial')
+
+def synthetic_table() :
+    # A smooth stand-in for the integrals: interpolation costs the same whatever the values.
+    mmed, mdm, ratio = np.geomspace(10., 6000., 60), np.geomspace(1., 3000., 50), np.geomspace(1e-4, 1., 20)
+    grid_mmed, grid_mdm, grid_ratio = np.meshgrid(mmed, mdm, ratio, indexing='ij')
+    log_integrals = -4.*np.log(grid_mmed) - np.log(grid_ratio) - grid_mdm/grid_mmed
+    return HadronicTable(mmed=mmed, mdm=mdm, width_ratio=ratio,
+        log_integrals={'vector' : log_integrals, 'axial' : log_integrals - 0.1},
+        pdfset=pdf.default_pdfset(), ECM=13000.**2)
+
+@benchmark("rescale_hadronic_table")
+def table_setup(npoints) :
+    rescaler = make_rescaler(npoints)
+    table = synthetic_table()
+    return lambda : quietly(rescaler.rescale_by_hadronic_table, table, 0.1, 1.0, 0.01, model='vector')
+
+@benchmark("dijet_coupling_limit")
+def dijet_setup(npoints) :
+    limit_mmed = np.linspace(500., 4000., 60)
+    limit = CouplingLimit_Dijet(mmed=limit_mmed, gq_limits=0.05 + 0.2*limit_mmed/4000.,
+        mdm=10000., gdm=0.0, gl=0.0, coupling='vector')
+    mmed, mdm = mass_grid(npoints)
+    scan = DMVectorModelScan(mmed=mmed, mdm=mdm, gq=0.25, gdm=1.0, gl=0.0)
+    return lambda : limit.extract_exclusion_depths(scan)
+
+# 100 vector and axial scenarios in one call.
+@benchmark("dijet_coupling_limit_batch_100", max_size=10**5)
+def dijet_batch_setup(npoints) :
+    limit_mmed = np.linspace(500., 4000., 60)
+    limit = CouplingLimit_Dijet(mmed=limit_mmed, gq_limits=0.05 + 0.2*limit_mmed/4000.,
+        mdm=10000., gdm=0.0, gl=0.0, coupling='vector')
+    mmed, mdm = mass_grid(npoints)
+    scenarios = [(model, gq, 1.0, gl) for model in ('vector', 'axial') for gq in np.geomspace(0.01, 1., 10)
+        for gl in (0.0, 0.01, 0.05, 0.1, 0.2)]
+    return lambda : limit.extract_exclusion_depths_batch(mmed, mdm, scenarios)
+
+def dilepton_limit() :
+    limit_mmed = np.linspace(250., 6000., 120)
+    xsec_limits = {width : 1e-3*np.exp(-limit_mmed/800.)*(1. + 10.*width) for width in (0.0, 0.01, 0.03, 0.06, 0.08, 0.1)}
+    theory_mmed = np.linspace(200., 6000., 50)
+    return quietly(CrossSectionLimit_Dilepton, mmed_limit=limit_mmed, xsec_limit=xsec_limits,
+        mmed_theory=theory_mmed, xsec_theory=2e-3*np.exp(-theory_mmed/700.),
+        mdm=2.5, gq=0.1, gdm=1.0, gl=0.01, coupling='vector')
+
+@benchmark("dilepton_xsec_limit")
+def dilepton_setup(npoints) :
+    limit = dilepton_limit()
+    mmed, mdm = mass_grid(npoints)
+    scan = DMVectorModelScan(mmed=mmed, mdm=mdm, gq=0.1, gdm=1.0, gl=0.01)
+    def run() :
+        depths = limit.extract_exclusion_depths(scan)
+        return limit.select_depths(scan, depths)
+    return run
+
+# 100 coupling scenarios in one call; the output alone is 100 x npoints x 6 depths.
+@benchmark("dilepton_xsec_limit_batch_100", max_size=10**5)
+def dilepton_batch_setup(npoints) :
+    limit = dilepton_limit()
+    mmed, mdm = mass_grid(npoints)
+    scan = DMVectorModelScan(mmed=mmed, mdm=mdm, gq=1.0, gdm=1.0, gl=1.0)
+    return lambda : limit.extract_exclusion_depths_batch(scan, np.geomspace(0.01, 0.5, 10), 1.0,
+        np.geomspace(0.001, 0.1, 10), grid=True, select=True)
+
+def time_case(setup, npoints, repeat) :
+    '''Best of repeat timings, each with a fresh setup.'''
+    times = []
+    for i in range(repeat) :
+        function = setup(npoints)
+        times.append(timeit.timeit(function, number=1))
+    return min(times)
+
+def metadata() :
+    try :
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError :
+        commit = ""
+    return {
+        "time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit" : commit,
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "platform" : platform.platform(),
+        "cpu_count" : os.cpu_count(),
+        "lhapdf" : hasLHAPDF,
+    }
+
+def run(names, sizes, repeat) :
+    results = {}
+    for name in names :
+        setup, requires_lhapdf, max_size = benchmarks[name]
+        if requires_lhapdf and not hasLHAPDF :
+            print("{0:<45} skipped: needs LHAPDF".format(name))
+            continue
+        results[name] = {}
+        for npoints in sizes :
+            if npoints > max_size : continue
+            seconds = time_case(setup, npoints, repeat)
+            results[name][str(npoints)] = seconds
+            print("{0:<45} {1:>8} {2:>12.4g} s".format(name, npoints, seconds))
+    return results
+
+def compare(results, baseline, threshold) :
+    '''
+    Prints the ratio of new to baseline times for every case run in both,
+    and returns the cases more than threshold times slower.
+    '''
+    regressions = []
+    print("\n{0:<45} {1:>8} {2:>10}".format("Compared to baseline", "points", "ratio"))
+    for name, timings in results.items() :
+        for npoints, seconds in timings.items() :
+            if npoints not in baseline.get(name, {}) : continue
+            ratio = seconds/baseline[name][npoints]
+            flag = "  <-- slower" if ratio > threshold else ""
+            print("{0:<45} {1:>8} {2:>10.2f}{3}".format(name, npoints, ratio, flag))
+            if ratio > threshold : regressions.append((name, npoints, ratio))
+    return regressions
+
+def main() :
+    parser = argparse.ArgumentParser(description="Time couplingscan widths, rescalings and limit parsers.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10**2, 10**3, 10**4, 10**5, 10**6], help="Numbers of mass points")
+    parser.add_argument("--only", nargs="+", default=None, choices=sorted(benchmarks), metavar="NAME", help="Benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timings per case; the best is kept")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    # Points outside the physical region give harmless divide-by-zero warnings.
+    warnings.simplefilter("ignore", RuntimeWarning)
+
+    results = run(args.only if args.only else list(benchmarks), args.sizes, args.repeat)
+
+    if args.output :
+        with open(args.output, "w") as output_file :
+            json.dump({"metadata" : metadata(), "results" : results}, output_file, indent=2)
+
+    if args.compare :
+        with open(args.compare) as baseline_file :
+            baseline = json.load(baseline_file)["results"]
+        if compare(results, baseline, args.threshold) :
+            sys.exit(1)
+
+if __name__ == "__main__" :
+    main()
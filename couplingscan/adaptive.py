@@ -0,0 +1,208 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from couplingscan.scan import model_scans
+from couplingscan.rescaler import Rescaler
+from couplingscan.profiling import profiled
+from couplingscan.contours import grid_contours
+
+# Adaptive scanning of the (mmed, mdm) plane for exclusion contours.
+# Only the depth = 1 contour is usually wanted, and on a dense grid most
+# points are far from it. Here the plane starts as a coarse grid of cells,
+# and only cells whose corners straddle the threshold (or, optionally,
+# change quickly) are split into four, level by level. All the new points
+# of a level are evaluated in one call, so expensive depth functions such as
+# the hadron-level rescaling still see large batches.
+#
+# Points live on the lattice of the finest level, so the result is a
+# dense grid in which only the evaluated points hold depths.
+
+@dataclass
+class AdaptiveScan :
+    '''
+    Result of refine_exclusion.
+    depths has one entry per node of the finest lattice, on the axes
+    mmed_axis and mdm_axis, and is NaN wherever no point was evaluated
+    (check evaluated to tell these apart from NaN depths).
+    boundary_cells holds the (i, j) lattice indices of the lower corner of each
+    finest-level cell whose corners straddle the threshold: the cells
+    the contour passes through.
+    '''
+    mmed_axis: np.ndarray
+    mdm_axis: np.ndarray
+    depths: np.ndarray
+    evaluated: np.ndarray
+    boundary_cells: np.ndarray
+    threshold: float = 1.
+
+    @property
+    def n_evaluations(self) :
+        return int(np.count_nonzero(self.evaluated))
+
+    @property
+    def cell_size(self) :
+        '''Size of the finest cells, (dmmed, dmdm): the precision of the contour.'''
+        return (self.mmed_axis[1] - self.mmed_axis[0], self.mdm_axis[1] - self.mdm_axis[0])
+
+    def points(self) :
+        '''mmed, mdm and depth of every evaluated point.'''
+        i, j = np.nonzero(self.evaluated)
+        return self.mmed_axis[i], self.mdm_axis[j], self.depths[i, j]
+
+    def contour_points(self) :
+        '''
+        Points where the depth crosses the threshold, found by linear
+        interpolation along the edges of the boundary cells.
+        Returns arrays of mmed and mdm, one entry per crossing edge.
+        '''
+        i, j = self.boundary_cells.T
+        # Each edge as its two end points; edges shared by two cells appear once.
+        edges = np.unique(np.concatenate([
+            np.stack([i, j, i+1, j], axis=1), np.stack([i, j, i, j+1], axis=1),
+            np.stack([i+1, j, i+1, j+1], axis=1), np.stack([i, j+1, i+1, j+1], axis=1)]), axis=0)
+        i1, j1, i2, j2 = edges.T
+        d1, d2 = self.depths[i1, j1], self.depths[i2, j2]
+        crossing = (np.minimum(d1, d2) < self.threshold) & (np.maximum(d1, d2) >= self.threshold)
+        fraction = (self.threshold - d1[crossing])/(d2[crossing] - d1[crossing])
+        mmed = self.mmed_axis[i1[crossing]] + fraction*(self.mmed_axis[i2[crossing]] - self.mmed_axis[i1[crossing]])
+        mdm = self.mdm_axis[j1[crossing]] + fraction*(self.mdm_axis[j2[crossing]] - self.mdm_axis[j1[crossing]])
+        return mmed, mdm
+
+    def contours(self) :
+        '''
+        The contour as joined lines of (mmed, mdm) vertices, from marching
+        squares on the evaluated part of the lattice (see couplingscan.contours).
+        '''
+        # Unevaluated points are NaN, so only cells the scan refined take part.
+        return grid_contours(self.mmed_axis, self.mdm_axis, self.depths, self.threshold)
+
+def _corner_depths(depths, i, j, step) :
+    return np.stack([depths[i, j], depths[i+step, j], depths[i, j+step], depths[i+step, j+step]])
+
+def _needs_refinement(corners, threshold, max_log_change=None, refine_invalid=False) :
+    # Cells whose corners straddle the threshold, plus those where the depth
+    # changes by more than a factor exp(max_log_change) across the cell,
+    # and optionally those only partly inside the region with valid depths.
+    valid = np.isfinite(corners)
+    # Cells with no valid corners get low > high, and are never split for crossing or changing.
+    low = np.min(np.where(valid, corners, np.inf), axis=0)
+    high = np.max(np.where(valid, corners, -np.inf), axis=0)
+    refine = (low < threshold) & (high >= threshold)
+    with np.errstate(invalid='ignore', divide='ignore') :
+        if max_log_change is not None :
+            refine |= (low <= high) & (np.log(high/low) > max_log_change)
+    if refine_invalid :
+        refine |= valid.any(axis=0) & ~valid.all(axis=0)
+    return refine
+
+def _with_neighbours(i, j, step, marked, shape) :
+    # Also mark cells sharing an edge with a marked cell at the same level,
+    # so that a contour entering and leaving a cell through the same coarse
+    # edge, which leaves that cell's corners all on one side, is still followed.
+    keys = set(np.ravel_multi_index((i[marked], j[marked]), shape).tolist())
+    extended = marked.copy()
+    for di, dj in [(step, 0), (-step, 0), (0, step), (0, -step)] :
+        ni, nj = i + di, j + dj
+        inside = (ni >= 0) & (nj >= 0) & (ni < shape[0]-1) & (nj < shape[1]-1)
+        neighbour = np.zeros(len(i), dtype=bool)
+        neighbour[inside] = np.isin(np.ravel_multi_index((ni[inside], nj[inside]), shape), list(keys))
+        extended |= neighbour
+    return extended
+
+@profiled
+def refine_exclusion(depth_function, mmed_range, mdm_range, initial_shape=(9,9), levels=4, threshold=1., max_log_change=None,
+    refine_invalid=False, neighbours=True) :
+    '''
+    Scans the rectangle mmed_range x mdm_range adaptively for the contour
+    where the exclusion depth equals threshold.
+    depth_function(mmed, mdm) takes 1D arrays of mass points and returns
+    their depths (see limit_depths and rescaled_depths).
+    The scan starts on an initial_shape grid of points and splits the cells
+    crossing the threshold levels times, so the contour is found to within
+    a cell of a grid with (n - 1)*2**levels + 1 points per axis, while
+    evaluating only a fraction of them.
+    max_log_change also splits cells where the depth changes by more than
+    that (natural) log across the cell, which helps catch small islands
+    a coarse grid would step over. refine_invalid also splits cells on
+    the edge of the region where the depths are not NaN.
+    With neighbours=True, the neighbours of every cell being split are split
+    too. This costs a few times more evaluations but follows contours that
+    wiggle within a coarse cell; without it such stretches can be missed.
+    '''
+    nx0, ny0 = initial_shape
+    if nx0 < 2 or ny0 < 2 :
+        print("Error: the initial grid needs at least 2 points along each axis!")
+        exit(1)
+    scale = 2**levels
+    shape = ((nx0-1)*scale + 1, (ny0-1)*scale + 1)
+    mmed_axis = np.linspace(mmed_range[0], mmed_range[1], shape[0])
+    mdm_axis = np.linspace(mdm_range[0], mdm_range[1], shape[1])
+    depths = np.full(shape, np.nan)
+    evaluated = np.zeros(shape, dtype=bool)
+
+    def evaluate(i, j) :
+        # Everything not yet evaluated, in one call.
+        flat = np.unique(np.ravel_multi_index((i, j), shape))
+        flat = flat[~evaluated.flat[flat]]
+        if not len(flat) : return
+        i, j = np.unravel_index(flat, shape)
+        depths[i, j] = np.asarray(depth_function(mmed_axis[i], mdm_axis[j]), dtype=float).reshape(-1)
+        evaluated[i, j] = True
+
+    # Lower corners of the cells at the current level, in lattice units of step.
+    step = scale
+    i, j = [index.ravel() for index in np.meshgrid(np.arange(nx0)*step, np.arange(ny0)*step, indexing='ij')]
+    evaluate(i, j)
+    i, j = [index.ravel() for index in np.meshgrid(np.arange(nx0-1)*step, np.arange(ny0-1)*step, indexing='ij')]
+
+    for level in range(levels) :
+        refine = _needs_refinement(_corner_depths(depths, i, j, step), threshold, max_log_change, refine_invalid)
+        if neighbours : refine = _with_neighbours(i, j, step, refine, shape)
+        i, j = i[refine], j[refine]
+        half = step//2
+        # Edge midpoints and centre of each cell being split.
+        evaluate(np.concatenate([i+half, i, i+half, i+step, i+half]), np.concatenate([j, j+half, j+half, j+half, j+step]))
+        i, j = np.concatenate([i, i+half, i, i+half]), np.concatenate([j, j, j+half, j+half])
+        step = half
+
+    boundary = _needs_refinement(_corner_depths(depths, i, j, step), threshold)
+    return AdaptiveScan(mmed_axis=mmed_axis, mdm_axis=mdm_axis, depths=depths, evaluated=evaluated,
+        boundary_cells=np.stack([i[boundary], j[boundary]], axis=1), threshold=threshold)
+
+def limit_depths(limit, model, gq, gdm, gl, **settings) :
+    '''
+    Depth function for refine_exclusion from a limit parser: the depths
+    limit.extract_exclusion_depths gives for a scan of the model with these
+    couplings. Where the limit has one curve per width, the one for
+    each point's width is used. Other keyword arguments go to the scan.
+    '''
+    def depths(mmed, mdm) :
+        scan = model_scans[model](mmed=mmed, mdm=mdm, gq=gq, gdm=gdm, gl=gl, **settings)
+        result = limit.extract_exclusion_depths(scan)
+        return limit.select_depths(scan, result) if type(result) is dict else result
+    return depths
+
+def rescaled_depths(reference_depths, reference_model, reference_couplings, method, target_couplings,
+    model=None, max_intrinsic_width=0.1, **options) :
+    '''
+    Depth function for refine_exclusion that rescales the depths of a reference
+    scenario to a single target scenario with a Rescaler.
+    reference_depths(mmed, mdm) gives the reference depths (or a {width : depths} dict),
+    for example from limit_depths; reference_couplings and target_couplings are (gq, gdm, gl).
+    method is a Rescaler.rescale_by_ method without the prefix, and the
+    remaining arguments are passed to it.
+    '''
+    if method not in Rescaler._method_groups :
+        print("Error: unknown method",method,"! Choose from",list(Rescaler._method_groups.keys()))
+        exit(1)
+    gq, gdm, gl = reference_couplings
+    # The table is the one positional argument that comes before the couplings.
+    leading = [options.pop("table")] if method == 'hadronic_table' else []
+
+    def depths(mmed, mdm) :
+        reference = model_scans[reference_model](mmed=mmed, mdm=mdm, gq=gq, gdm=gdm, gl=gl)
+        rescaler = Rescaler(reference, reference_depths(mmed, mdm), max_intrinsic_width)
+        result = getattr(rescaler, "rescale_by_" + method)(*leading, *target_couplings, model=model, **options)
+        return list(result.values())[0]
+    return depths
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+# Persistent store for hadron-level integrals.
+# The integrals kept here never include couplings: the cross section
+# for any (gq, gdm) is gq**2 * gdm**2 times the stored value, so one entry
+# serves every coupling scenario with the same total width.
+
+def default_cache_directory() :
+    '''
+    Directory used when none is given: $COUPLINGSCAN_CACHE_DIR if set,
+    otherwise ~/.cache/couplingscan.
+    '''
+    if os.environ.get("COUPLINGSCAN_CACHE_DIR") :
+        return os.environ["COUPLINGSCAN_CACHE_DIR"]
+    return os.path.join(os.path.expanduser("~"), ".cache", "couplingscan")
+
+def _canonical(value) :
+    # Widths in particular come out of sums whose last bits depend on
+    # evaluation order, so key on 12 significant digits rather than exact floats.
+    return "{0:.12g}".format(float(value))
+
+class IntegralCache :
+    '''
+    Content-addressed SQLite cache of integrals keyed by
+    (model, PDF setup, ECM, mmed, mdm, gamma).
+    Safe to share between processes: SQLite serialises the writers,
+    and readers never see a half-written batch.
+    Holds at most max_entries integrals; beyond that the least recently
+    used ones are evicted.
+    '''
+
+    _filename = "integrals.sqlite"
+
+    def __init__(self, directory=None, max_entries=1000000, timeout=60.) :
+        self.directory = directory if directory else default_cache_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, self._filename)
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+        with self._connect() as connection :
+            connection.execute("""CREATE TABLE IF NOT EXISTS integrals (
+                key TEXT PRIMARY KEY, value REAL NOT NULL, last_used REAL NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS integrals_last_used ON integrals (last_used)")
+
+    def _connect(self) :
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        # Write-ahead logging lets readers carry on while another process writes.
+        connection.execute("PRAGMA journal_mode=WAL")
+        return _ClosingConnection(connection)
+
+    def make_keys(self, model, pdf, ECM, mmed, mdm, gamma) :
+        '''One hash per mass point, combining all of the inputs the integral depends on.'''
+        prefix = "{0}|{1}|{2}|".format(model, pdf, _canonical(ECM))
+        return [hashlib.sha1((prefix + "|".join([_canonical(m), _canonical(d), _canonical(g)])).encode()).hexdigest()
+            for m, d, g in zip(mmed, mdm, gamma)]
+
+    def lookup(self, model, pdf, ECM, mmed, mdm, gamma) :
+        '''
+        Returns an array of cached integrals for the given points,
+        with NaN wherever nothing has been stored yet.
+        '''
+        keys = self.make_keys(model, pdf, ECM, mmed, mdm, gamma)
+        found = {}
+        with self._connect() as connection :
+            # Stay well inside SQLite's limit on bound parameters.
+            for i in range(0, len(keys), 500) :
+                batch = keys[i:i+500]
+                query = "SELECT key, value FROM integrals WHERE key IN ({0})".format(",".join("?"*len(batch)))
+                found.update(connection.execute(query, batch).fetchall())
+            if found :
+                connection.executemany("UPDATE integrals SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in found])
+
+        values = np.array([found.get(key, np.nan) for key in keys], dtype=float)
+        nfound = int(np.count_nonzero(~np.isnan(values)))
+        self.hits += nfound
+        self.misses += len(keys) - nfound
+        return values
+
+    def store(self, model, pdf, ECM, mmed, mdm, gamma, values) :
+        '''Adds newly computed integrals, then evicts old ones if over the size limit.'''
+        keys = self.make_keys(model, pdf, ECM, mmed, mdm, gamma)
+        now = time.time()
+        with self._connect() as connection :
+            connection.executemany("INSERT OR REPLACE INTO integrals (key, value, last_used) VALUES (?, ?, ?)",
+                [(key, float(value), now) for key, value in zip(keys, values) if np.isfinite(value)])
+            excess = connection.execute("SELECT COUNT(*) FROM integrals").fetchone()[0] - self.max_entries
+            if excess > 0 :
+                connection.execute("""DELETE FROM integrals WHERE key IN
+                    (SELECT key FROM integrals ORDER BY last_used LIMIT ?)""", (excess,))
+
+    def clear(self) :
+        with self._connect() as connection :
+            connection.execute("DELETE FROM integrals")
+
+    def __len__(self) :
+        with self._connect() as connection :
+            return connection.execute("SELECT COUNT(*) FROM integrals").fetchone()[0]
+
+    def stats(self) :
+        return {"hits" : self.hits, "misses" : self.misses, "entries" : len(self), "path" : self.path}
+
+# sqlite3 connections used as context managers commit or roll back,
+# but do not close. This one does both.
+class _ClosingConnection :
+
+    def __init__(self, connection) :
+        self.connection = connection
+
+    def __enter__(self) :
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        try :
+            if exc_type is None : self.connection.commit()
+            else : self.connection.rollback()
+        finally :
+            self.connection.close()
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from couplingscan.scan import model_scans
+from couplingscan.rescaler import Rescaler
+from couplingscan.cache import IntegralCache
+from couplingscan.tables import HadronicTable
+from couplingscan.hepdata import load_hepdata, parse_relative_width
+
+# YAML job files are optional: JSON always works.
+try :
+    import yaml
+except ImportError :
+    yaml = None
+
+# Batch driver: runs reinterpretations described in a job file,
+# so that many scenario conversions can be fanned out over a pool of
+# processes without writing a script for each one.
+#
+# A job file (JSON, or YAML if PyYAML is installed) looks like:
+#
+# output_dir: results              # optional, relative to the job file
+# defaults:                        # optional, merged into every job
+#   method: propagator
+# jobs:
+#   monophoton_A1:
+#     limit:
+#       file: monophoton_hepdata/hepdata_AV_gq0p25_gchi1p0.json
+#       mmed: x1                   # columns of the HEPData "values",
+#       mdm: x0                    # or lists of numbers
+#       depths: y0                 # or {width : column} for several widths, or
+#                                  # {qualifier: RELATIVE WIDTH} to take them from the table
+#     reference: {model: axial, gq: 0.25, gdm: 1.0, gl: 0.0}
+#                                  # may also set sqrt_s (GeV), pdfset, pdf_member, flavours
+#     max_intrinsic_width: 100.0   # optional
+#     method: propagator           # a Rescaler.rescale_by_ method without the prefix
+#     options: {}                  # extra arguments for that method
+#     targets:
+#       A2: {model: axial, gq: 0.1, gdm: 1.0, gl: 0.1}
+#
+# Each target is written to <output_dir>/<job>_<target>.npz holding the
+# RescaleResult arrays (gq, gdm, gl, depths, mmed, mdm), and a summary of
+# all jobs goes to <output_dir>/summary.json.
+
+# Optional reference keys passed on to the scans.
+_scan_settings = ["pdfset", "pdf_member", "flavours"]
+
+def load_job_file(path) :
+    with open(path) as job_file :
+        if path.endswith((".yaml", ".yml")) :
+            if yaml is None :
+                print("Error: reading YAML job files needs PyYAML. Install it, or write the jobs as JSON.")
+                exit(1)
+            return yaml.safe_load(job_file)
+        return json.load(job_file)
+
+def load_limit(limit, base_directory) :
+    '''
+    Reads the mass points and exclusion depths of a job's input limit.
+    Returns mmed, mdm and either one array of depths or a {width : depths} dict.
+    '''
+    table = None
+    if "file" in limit :
+        table = load_hepdata(os.path.join(base_directory, limit["file"]))
+
+    def get(entry) :
+        # Columns of the file, or numbers given directly.
+        if isinstance(entry, str) :
+            if table is None :
+                print("Error: limit column",entry,"given without a file to read it from!")
+                exit(1)
+            return table.column(entry)
+        return np.array(entry, dtype=float)
+
+    depths = limit["depths"]
+    if isinstance(depths, dict) and "qualifier" in depths :
+        # One y column per width, labelled by a qualifier such as RELATIVE WIDTH.
+        if table is None :
+            print("Error: limit depths by qualifier given without a file to read them from!")
+            exit(1)
+        depths = table.y_by_qualifier(depths["qualifier"], convert=parse_relative_width)
+    elif isinstance(depths, dict) :
+        depths = {float(width) : get(column) for width, column in depths.items()}
+    else :
+        depths = get(depths)
+    return get(limit["mmed"]), get(limit["mdm"]), depths
+
+def method_options(options, base_directory) :
+    # Turn the file-friendly forms of the options into the objects the Rescaler expects.
+    options = dict(options)
+    if options.get("cache") is True :
+        options["cache"] = IntegralCache()
+    elif isinstance(options.get("cache"), str) :
+        options["cache"] = IntegralCache(os.path.join(base_directory, options["cache"]))
+    if isinstance(options.get("table"), str) :
+        options["table"] = HadronicTable.load(os.path.join(base_directory, options["table"]))
+    return options
+
+def run_job(name, job, base_directory, output_dir) :
+    '''
+    Runs every target of one job, writes their results,
+    and returns a summary of what was done.
+    '''
+    start = time.time()
+    mmed, mdm, depths = load_limit(job["limit"], base_directory)
+
+    reference = job["reference"]
+    if reference["model"] not in model_scans :
+        print("Error: unknown reference model",reference["model"],"! Choose from",list(model_scans.keys()))
+        exit(1)
+    # Targets are integrated with the same ECM, PDF and flavours as the reference.
+    settings = {key : reference[key] for key in _scan_settings if key in reference}
+    if "sqrt_s" in reference : settings["ECM"] = float(reference["sqrt_s"])**2
+    reference_scan = model_scans[reference["model"]](mmed=mmed, mdm=mdm,
+        gq=reference["gq"], gdm=reference["gdm"], gl=reference["gl"], **settings)
+    rescaler = Rescaler(reference_scan, depths, job.get("max_intrinsic_width", 0.1))
+
+    method = job["method"]
+    if method not in Rescaler._method_groups :
+        print("Error: unknown method",method,"! Choose from",list(Rescaler._method_groups.keys()))
+        exit(1)
+    options = method_options(job.get("options", {}), base_directory)
+    # The table is the one positional argument that comes before the couplings.
+    leading = [options.pop("table")] if method == 'hadronic_table' else []
+
+    outputs = {}
+    for target_name, target in job["targets"].items() :
+        result = getattr(rescaler, "rescale_by_" + method)(*leading, target["gq"], target["gdm"], target["gl"],
+            model=target.get("model"), **options)
+        path = os.path.join(output_dir, "{0}_{1}.npz".format(name, target_name))
+        np.savez(path, gq=result.gq, gdm=result.gdm, gl=result.gl, depths=result.depths, mmed=result.mmed, mdm=result.mdm)
+        outputs[target_name] = path
+
+    return {"status" : "done", "outputs" : outputs, "seconds" : time.time() - start}
+
+def _run_job_safely(name, job, base_directory, output_dir) :
+    # Input errors end in exit(1) throughout the package. In a batch,
+    # record them against the job and carry on with the others.
+    try :
+        return name, run_job(name, job, base_directory, output_dir)
+    except SystemExit :
+        return name, {"status" : "failed", "error" : "stopped on an input error; see the message printed above"}
+    except Exception as error :
+        return name, {"status" : "failed", "error" : "{0}: {1}".format(type(error).__name__, error)}
+
+def main() :
+    parser = argparse.ArgumentParser(description="Run the reinterpretations described in a JSON or YAML job file.")
+    parser.add_argument("jobs", help="Job file")
+    parser.add_argument("--workers", type=int, default=1, help="Jobs to run at once, each in its own process (0: one per core)")
+    parser.add_argument("--output-dir", default=None, help="Where to write results (default: output_dir from the job file, else results/ next to it)")
+    parser.add_argument("--only", nargs="+", default=None, metavar="JOB", help="Run only these jobs")
+    args = parser.parse_args()
+
+    spec = load_job_file(args.jobs)
+    base_directory = os.path.dirname(os.path.abspath(args.jobs))
+    output_dir = args.output_dir if args.output_dir else os.path.join(base_directory, spec.get("output_dir", "results"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = {}
+    for name, job in spec["jobs"].items() :
+        if args.only and name not in args.only : continue
+        jobs[name] = dict(spec.get("defaults", {}), **job)
+
+    if args.workers == 1 :
+        summary = dict(_run_job_safely(name, job, base_directory, output_dir) for name, job in jobs.items())
+    else :
+        # Workers start once and run many jobs each, so imports
+        # and LHAPDF setup are not repeated per job.
+        with ProcessPoolExecutor(max_workers=args.workers if args.workers else None) as pool :
+            futures = [pool.submit(_run_job_safely, name, job, base_directory, output_dir) for name, job in jobs.items()]
+            summary = dict(future.result() for future in futures)
+
+    with open(os.path.join(output_dir, "summary.json"), "w") as summary_file :
+        json.dump(summary, summary_file, indent=2)
+
+    failed = [name for name, result in summary.items() if result["status"] != "done"]
+    print("Ran",len(summary),"jobs;",len(failed),"failed.")
+    for name in failed :
+        print("  ",name,":",summary[name]["error"])
+    if failed : exit(1)
+
+if __name__ == "__main__" :
+    main()
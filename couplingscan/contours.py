@@ -0,0 +1,194 @@
+import numpy as np
+
+# Iso-depth contours (usually the depth = 1 exclusion line) as vertex arrays,
+# without a plotting library.
+# Regular grids use marching squares and scattered points use marching
+# triangles on a Delaunay triangulation. Either way each cell crossed by
+# the contour gives a segment between two of its edges, and segments
+# meeting on an edge are joined into lines. Cells with a NaN corner give
+# nothing, so lines stop at the edge of NaN regions.
+# Many depth sets on the same points (e.g. one per coupling combination)
+# are handled at once: every leading axis of the depths is a separate set.
+
+# Marching squares. Corners are numbered bottom-left (bit 0), bottom-right (1),
+# top-right (2) and top-left (3), with bottom/top along x and left/right along y;
+# edges are bottom (0), right (1), top (2) and left (3).
+# For each case (which corners are at or above the level), the pairs of
+# edges joined by segments. Cases 5 and 10 are saddles: entries 16 + case
+# are used instead when the centre of the cell is at or above the level.
+_square_segments = np.full((32, 2, 2), -1)
+for _case, _pairs in {
+        1 : [(3,0)], 2 : [(0,1)], 3 : [(3,1)], 4 : [(1,2)], 5 : [(3,0),(1,2)], 6 : [(0,2)], 7 : [(3,2)],
+        8 : [(2,3)], 9 : [(0,2)], 10 : [(0,1),(2,3)], 11 : [(1,2)], 12 : [(1,3)], 13 : [(0,1)], 14 : [(3,0)],
+        16 + 5 : [(0,1),(2,3)], 16 + 10 : [(3,0),(1,2)]}.items() :
+    _square_segments[_case, :len(_pairs)] = _pairs
+
+# Marching triangles. Edges are (v0,v1) (0), (v1,v2) (1) and (v2,v0) (2);
+# each case has at most one segment.
+_triangle_segments = np.array([[-1,-1], [0,2], [0,1], [1,2], [1,2], [0,1], [0,2], [-1,-1]])
+
+def join_segments(segments) :
+    '''
+    Joins segments, given as pairs of edge ids, into lines:
+    lists of edge ids in order, where closed lines end with their first id again.
+    Each edge is shared by at most two segments.
+    '''
+    neighbours = {}
+    for index, (a, b) in enumerate(segments) :
+        neighbours.setdefault(a, []).append(index)
+        neighbours.setdefault(b, []).append(index)
+
+    used = np.zeros(len(segments), dtype=bool)
+    lines = []
+    # Open lines start from an edge used once; what is left after them are loops.
+    starts = [edge for edge, indices in neighbours.items() if len(indices) == 1] + [a for a, b in segments]
+    for start in starts :
+        free = [index for index in neighbours[start] if not used[index]]
+        if not free : continue
+        line = [start]
+        edge, index = start, free[0]
+        while True :
+            used[index] = True
+            a, b = segments[index]
+            edge = b if a == edge else a
+            line.append(edge)
+            free = [other for other in neighbours[edge] if not used[other]]
+            if not free : break
+            index = free[0]
+        lines.append(line)
+    return lines
+
+def _lines_from_segments(batch, segments, edge_points, n_sets) :
+    # Splits segments by set, joins them, and looks up the vertices.
+    # edge_points(set index, edge ids) gives an (n, 2) array of crossing points.
+    result = []
+    for b in range(n_sets) :
+        these = segments[batch == b]
+        lines = join_segments([tuple(pair) for pair in these.tolist()])
+        result.append([edge_points(b, np.array(line)) for line in lines])
+    return result
+
+def grid_contours(x_axis, y_axis, z, level=1.) :
+    '''
+    Contours of z at level on a regular grid, by marching squares.
+    z has shape (..., len(x_axis), len(y_axis)), where any leading axes
+    index separate sets of values.
+    Returns a list of (n, 2) arrays of (x, y) vertices, one per line
+    (closed lines repeat their first vertex at the end), or for several
+    sets a list of such lists, in C order over the leading axes.
+    '''
+    x_axis, y_axis = np.asarray(x_axis, dtype=float), np.asarray(y_axis, dtype=float)
+    z = np.asarray(z, dtype=float)
+    nx, ny = len(x_axis), len(y_axis)
+    if z.shape[-2:] != (nx, ny) :
+        print("Error: values of shape",z.shape,"do not match a grid of",nx,"x",ny,"points!")
+        exit(1)
+    leading = z.shape[:-2]
+    z = z.reshape((-1, nx, ny))
+    n_sets = len(z)
+
+    # Case of every cell in every set at once.
+    above = z >= level
+    corners = np.stack([z[:,:-1,:-1], z[:,1:,:-1], z[:,1:,1:], z[:,:-1,1:]])
+    case = (above[:,:-1,:-1].astype(int) | (above[:,1:,:-1] << 1) | (above[:,1:,1:] << 2) | (above[:,:-1,1:] << 3))
+    saddle = (case == 5) | (case == 10)
+    case = np.where(saddle & (corners.mean(axis=0) >= level), case + 16, case)
+    case = np.where(np.isnan(corners).any(axis=0), 0, case)
+
+    # Edge ids: those along x, (i, j) to (i+1, j), first, then those along y.
+    n_along_x = (nx - 1)*ny
+    b, i, j = np.nonzero((case != 0) & (case != 15))
+    cell_edges = np.stack([i*ny + j, n_along_x + (i+1)*(ny-1) + j, i*ny + j + 1, n_along_x + i*(ny-1) + j], axis=-1)
+    pairs = _square_segments[case[b, i, j]]
+    segments, batch = [], []
+    for k in range(2) :
+        present = pairs[:, k, 0] >= 0
+        segments.append(np.take_along_axis(cell_edges[present], pairs[present, k], axis=1))
+        batch.append(b[present])
+    segments, batch = np.concatenate(segments), np.concatenate(batch)
+
+    def edge_points(set_index, edges) :
+        along_x = edges < n_along_x
+        i1 = np.where(along_x, edges // ny, (edges - n_along_x) // (ny - 1))
+        j1 = np.where(along_x, edges % ny, (edges - n_along_x) % (ny - 1))
+        i2, j2 = np.where(along_x, i1 + 1, i1), np.where(along_x, j1, j1 + 1)
+        z1, z2 = z[set_index, i1, j1], z[set_index, i2, j2]
+        fraction = (level - z1)/(z2 - z1)
+        return np.stack([x_axis[i1] + fraction*(x_axis[i2] - x_axis[i1]), y_axis[j1] + fraction*(y_axis[j2] - y_axis[j1])], axis=1)
+
+    result = _lines_from_segments(batch, segments, edge_points, n_sets)
+    return result[0] if not leading else result
+
+def scattered_contours(x, y, z, level=1.) :
+    '''
+    Contours of z at level for values at scattered points (x, y),
+    by marching triangles on their Delaunay triangulation.
+    z has shape (..., len(x)), where any leading axes index separate sets of values.
+    Returns the same as grid_contours.
+    '''
+    # Only needed here, and slow to import.
+    from scipy.spatial import Delaunay
+
+    x, y = np.asarray(x, dtype=float).ravel(), np.asarray(y, dtype=float).ravel()
+    z = np.asarray(z, dtype=float)
+    leading = z.shape[:-1]
+    z = z.reshape((-1, len(x)))
+    n_sets = len(z)
+
+    # Triangulate in units of each axis' range, so that very different
+    # scales on the two axes do not give long thin triangles.
+    finite = np.isfinite(x) & np.isfinite(y)
+    scale = lambda values : (values - values[finite].min())/max(np.ptp(values[finite]), 1e-300)
+    triangles = Delaunay(np.stack([scale(x), scale(y)], axis=1)[finite]).simplices
+    triangles = np.nonzero(finite)[0][triangles]
+
+    # Edge ids shared between neighbouring triangles.
+    edges = np.sort(np.stack([triangles[:,[0,1]], triangles[:,[1,2]], triangles[:,[2,0]]], axis=1), axis=2)
+    unique_edges, triangle_edges = np.unique(edges.reshape(-1, 2), axis=0, return_inverse=True)
+    triangle_edges = triangle_edges.reshape(-1, 3)
+
+    values = z[:, triangles]
+    case = (values[...,0] >= level).astype(int) | ((values[...,1] >= level) << 1) | ((values[...,2] >= level) << 2)
+    case = np.where(np.isnan(values).any(axis=-1), 0, case)
+    b, t = np.nonzero((case != 0) & (case != 7))
+    segments = np.take_along_axis(triangle_edges[t], _triangle_segments[case[b, t]], axis=1)
+
+    def edge_points(set_index, edge_ids) :
+        v1, v2 = unique_edges[edge_ids, 0], unique_edges[edge_ids, 1]
+        z1, z2 = z[set_index, v1], z[set_index, v2]
+        fraction = (level - z1)/(z2 - z1)
+        return np.stack([x[v1] + fraction*(x[v2] - x[v1]), y[v1] + fraction*(y[v2] - y[v1])], axis=1)
+
+    result = _lines_from_segments(b, segments, edge_points, n_sets)
+    return result[0] if not leading else result
+
+def as_grid(x, y) :
+    '''
+    If the points (x, y) are exactly the nodes of a regular grid (in any order),
+    returns its axes and the (i, j) grid index of each point; otherwise None.
+    '''
+    x, y = np.asarray(x, dtype=float).ravel(), np.asarray(y, dtype=float).ravel()
+    x_axis, i = np.unique(x, return_inverse=True)
+    y_axis, j = np.unique(y, return_inverse=True)
+    if len(x_axis) < 2 or len(y_axis) < 2 or len(x_axis)*len(y_axis) != len(x) : return None
+    if len(np.unique(i*len(y_axis) + j)) != len(x) : return None
+    return x_axis, y_axis, i, j
+
+def contours(mmed, mdm, depths, level=1.) :
+    '''
+    Contours of depths at level (by default the exclusion line) for a scan at
+    the mass points (mmed, mdm), such as the reference scan of a Rescaler.
+    depths has shape (..., len(mmed)), where any leading axes index separate
+    sets of values, e.g. RescaleResult.depths for every coupling combination.
+    Points that form a complete regular grid use marching squares;
+    anything else is triangulated.
+    Returns the same as grid_contours.
+    '''
+    depths = np.asarray(depths, dtype=float)
+    grid = as_grid(mmed, mdm)
+    if grid is None :
+        return scattered_contours(mmed, mdm, depths, level)
+    x_axis, y_axis, i, j = grid
+    on_grid = np.full(depths.shape[:-1] + (len(x_axis), len(y_axis)), np.nan)
+    on_grid[..., i, j] = depths
+    return grid_contours(x_axis, y_axis, on_grid, level)
@@ -0,0 +1,173 @@
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from couplingscan.scan import model_scans
+from couplingscan.limitparsers import CouplingLimit_Dijet, CrossSectionLimit_Dilepton
+
+# Reading HEPData tables (the JSON export of a single table) into arrays.
+# Parsing the JSON is slow for large published grids, so the parsed arrays
+# are cached as .npy files next to the source, keyed by a hash of its contents,
+# and later loads just memory-map those.
+
+_cache_directory_name = ".couplingscan_cache"
+
+def parse_value(entry) :
+    '''
+    Numerical value of one table entry: its value if it has one,
+    otherwise the centre of its bin. NaN for anything non-numerical, such as "-".
+    '''
+    try :
+        if "value" in entry :
+            return float(entry["value"])
+        return 0.5*(float(entry["low"]) + float(entry["high"]))
+    except (KeyError, TypeError, ValueError) :
+        return np.nan
+
+def parse_relative_width(value) :
+    '''
+    A relative width qualifier as a fraction: "0.5 %" gives 0.005.
+    Values without a percent sign are taken to be fractions already.
+    '''
+    value = str(value).strip()
+    if value.endswith("%") :
+        return float(value[:-1])/100.
+    return float(value)
+
+def _expand_spans(entries, ncolumns) :
+    # Headers and qualifiers list one entry per block of colspan columns;
+    # repeat each so there is one per column.
+    expanded = []
+    for entry in entries :
+        expanded += [entry.get("value", entry.get("name"))] * int(entry.get("colspan", 1))
+    return (expanded + [None]*ncolumns)[:ncolumns]
+
+@dataclass
+class HEPDataTable :
+    '''
+    The numbers of a HEPData table: x holds one row per independent variable
+    and y one row per dependent variable (column group), each with one entry
+    per table row. Headers and qualifiers are given per column, so for
+    example qualifiers["RELATIVE WIDTH"][2] is the width of y column 2.
+    Columns are referred to as "x0", "x1", "y0", ... as in the JSON.
+    '''
+    x: np.ndarray
+    y: np.ndarray
+    x_headers: list = field(default_factory=list)
+    y_headers: list = field(default_factory=list)
+    qualifiers: dict = field(default_factory=dict)
+    name: str = ""
+
+    def column(self, key) :
+        '''A column by name, e.g. "x1" or "y0".'''
+        axis, index = key[0], int(key[1:])
+        if axis not in ("x", "y") :
+            print("Error: HEPData columns are named x0, x1, ... or y0, y1, ..., not",key)
+            exit(1)
+        # A plain array even when the table is memory-mapped from the cache,
+        # so the scans and limits built from it see the same type either way.
+        return np.asarray(getattr(self, axis)[index], dtype=float)
+
+    def y_by_qualifier(self, qualifier, convert=None) :
+        '''
+        The y columns as a dict keyed by the value of the given qualifier,
+        optionally passed through convert first.
+        '''
+        if qualifier not in self.qualifiers :
+            print("Error: this table has no",qualifier,"qualifier. It has:",list(self.qualifiers.keys()))
+            exit(1)
+        values = self.qualifiers[qualifier]
+        return {(convert(value) if convert else value) : np.asarray(self.y[i], dtype=float) for i, value in enumerate(values)}
+
+    def relative_widths(self) :
+        '''
+        The y columns keyed by their RELATIVE WIDTH qualifier as a fraction:
+        the form the dilepton limits and the Rescaler take for width-dependent limits.
+        '''
+        return self.y_by_qualifier("RELATIVE WIDTH", convert=parse_relative_width)
+
+    def model_scan(self, model, gq, gdm, gl, mmed="x0", mdm="x1", **settings) :
+        '''
+        A scan of the given model ('vector', 'axial', ...) over the mass points
+        in the named columns, e.g. for a published grid of limits.
+        Other keyword arguments (ECM, pdfset, ...) are passed to the scan.
+        '''
+        if model not in model_scans :
+            print("Error: unknown model",model,"! Choose from",list(model_scans.keys()))
+            exit(1)
+        return model_scans[model](mmed=self.column(mmed), mdm=self.column(mdm), gq=gq, gdm=gdm, gl=gl, **settings)
+
+    def dilepton_limit(self, mmed_theory, xsec_theory, mdm, gq, gdm, gl, coupling, mmed="x0") :
+        '''
+        A CrossSectionLimit_Dilepton from a table of cross section limits,
+        one y column per relative width.
+        '''
+        return CrossSectionLimit_Dilepton(mmed_limit=self.column(mmed), xsec_limit=self.relative_widths(),
+            mmed_theory=np.asarray(mmed_theory, dtype=float), xsec_theory=np.asarray(xsec_theory, dtype=float),
+            mdm=mdm, gq=gq, gdm=gdm, gl=gl, coupling=coupling)
+
+    def dijet_coupling_limit(self, mdm, gdm, gl, coupling, mmed="x0", gq_limits="y0") :
+        '''A CouplingLimit_Dijet from a table of limits on gq.'''
+        return CouplingLimit_Dijet(mmed=self.column(mmed), gq_limits=self.column(gq_limits),
+            mdm=mdm, gdm=gdm, gl=gl, coupling=coupling)
+
+def parse_hepdata(data) :
+    '''HEPDataTable from the already-decoded JSON of a table.'''
+    values = data["values"]
+    nx = len(values[0]["x"]) if values else int(data.get("x_count", 0))
+    ny = len(values[0]["y"]) if values else 0
+    x = np.array([[parse_value(row["x"][i]) for row in values] for i in range(nx)], dtype=float).reshape(nx, len(values))
+    y = np.array([[parse_value(row["y"][i]) for row in values] for i in range(ny)], dtype=float).reshape(ny, len(values))
+
+    # The first headers describe the x columns, the rest the y columns.
+    headers = _expand_spans(data.get("headers", []), nx + ny)
+    x_headers, y_headers = headers[:nx], headers[nx:]
+    qualifiers = {name : _expand_spans(entries, ny) for name, entries in data.get("qualifiers", {}).items()}
+
+    return HEPDataTable(x=x, y=y, x_headers=x_headers, y_headers=y_headers,
+        qualifiers=qualifiers, name=data.get("name", ""))
+
+def _cache_path(path, digest) :
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), _cache_directory_name)
+    return os.path.join(directory, "{0}-{1}".format(os.path.basename(path), digest[:16]))
+
+def load_hepdata(path, cache=True) :
+    '''
+    Reads a HEPData table from its JSON file.
+    With cache=True, the parsed arrays are kept in a .couplingscan_cache
+    directory next to the file, under a name including the SHA-256 of the
+    file's contents, so editing the file invalidates them. Later loads
+    memory-map the cached arrays (read-only) instead of parsing the JSON.
+    If the directory cannot be written, the table is just parsed each time.
+    '''
+    with open(path, "rb") as source :
+        raw = source.read()
+    if not cache :
+        return parse_hepdata(json.loads(raw))
+
+    cached = _cache_path(path, hashlib.sha256(raw).hexdigest())
+    meta_file = os.path.join(cached, "meta.json")
+    if os.path.exists(meta_file) :
+        with open(meta_file) as meta :
+            metadata = json.load(meta)
+        return HEPDataTable(x=np.load(os.path.join(cached, "x.npy"), mmap_mode='r'),
+            y=np.load(os.path.join(cached, "y.npy"), mmap_mode='r'), **metadata)
+
+    table = parse_hepdata(json.loads(raw))
+    try :
+        os.makedirs(cached, exist_ok=True)
+        np.save(os.path.join(cached, "x.npy"), table.x)
+        np.save(os.path.join(cached, "y.npy"), table.y)
+        # Written last and moved into place in one step, so a half-written
+        # entry is never picked up, even by another process.
+        temporary = "{0}.{1}".format(meta_file, os.getpid())
+        with open(temporary, "w") as meta :
+            json.dump({"x_headers" : table.x_headers, "y_headers" : table.y_headers,
+                "qualifiers" : table.qualifiers, "name" : table.name}, meta)
+        os.replace(temporary, meta_file)
+    except OSError :
+        pass
+    return table
@@ -0,0 +1,242 @@
+import math
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from couplingscan import pdf, profiling
+
+# Numerical integration of the (relative) monojet cross sections.
+# These are kept outside of the scan classes so that they can be
+# shipped to worker processes without pickling a full scan
+# (or the LHAPDF handler that it holds).
+
+# Integration limits and options for x1, x2 space.
+# ECM comes first so that functools.partial can fix it
+# and leave the call signature nquad expects.
+
+def hadronic_opts_x1(ECM, x2, pid, gamma, M, mDM) :
+    # Make it check the various points in S
+    # that allow the integral to converge correctly.
+    points_list = [M**2/(x2 * ECM)]
+    # Don't both returning ridge location if we're off-shell
+    if (M < 2.*mDM) :
+        return {}
+    else :
+        return {'points' : points_list}
+
+def hadronic_opts_x2(ECM, pid, gamma, M, mDM) :
+    # Nothing special.
+    return {}
+
+def hadronic_limit_x1(ECM, x2, pid, gamma, M, mDM) :
+    # Lower limit is actually a curve
+    # Upper limit is 1
+    lower_lim = (4.*mDM**2)/(x2 * ECM)
+    return [lower_lim, 1]
+
+def hadronic_limit_x2(ECM, pid, gamma, M, mDM) :
+    # This is from its smallest value when x1 is largest
+    # and goes up to 1.
+    lower_lim = (4.*mDM**2)/ECM
+    return [lower_lim, 1]
+
+def hadronic_integral(integrand, ECM, pids, gamma, M, mDM) :
+    '''
+    Hadron-level integral for a single mass point,
+    summed over the requested quark flavours.
+    Each entry of pids is passed to the integrand as its pid argument:
+    a single PDG id, or a list of them for the _flavours integrands,
+    which sum the flavours themselves.
+    Couplings are not included.
+    '''
+    # scipy.integrate is slow to import, so only load it once something is integrated.
+    import scipy.integrate as integrate
+
+    limits = [partial(hadronic_limit_x1, ECM), partial(hadronic_limit_x2, ECM)]
+    opts = [partial(hadronic_opts_x1, ECM), partial(hadronic_opts_x2, ECM)]
+    if profiling.is_active() :
+        return _profiled_hadronic_integral(integrand, limits, opts, pids, gamma, M, mDM)
+    xsec = 0
+    for q_pid in pids :
+        integral = integrate.nquad(integrand, limits, args=(q_pid, gamma, M, mDM), opts=opts)
+        xsec = xsec + integral[0]
+    return xsec
+
+def _profiled_hadronic_integral(integrand, limits, opts, pids, gamma, M, mDM) :
+    # As hadronic_integral, but also counting integrand evaluations
+    # and points where quad reports hitting its subdivision limit
+    # (or another accuracy problem) somewhere in the nested integration.
+    import scipy.integrate as integrate
+
+    integrand = profiling.counting(integrand, "hadronic.integrand_evaluations")
+    xsec = 0
+    with warnings.catch_warnings(record=True) as caught :
+        warnings.simplefilter("always", integrate.IntegrationWarning)
+        for q_pid in pids :
+            integral = integrate.nquad(integrand, limits, args=(q_pid, gamma, M, mDM), opts=opts)
+            xsec = xsec + integral[0]
+    profiling.count("hadronic.points")
+    if any(issubclass(warning.category, integrate.IntegrationWarning) for warning in caught) :
+        profiling.count("hadronic.points_hit_limit")
+    # Pass on the warnings as they would have appeared without profiling.
+    for warning in caught :
+        warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+    return xsec
+
+def hadronic_integrals(integrand, mmed, mdm, gamma, ECM, pids) :
+    '''
+    Serial loop over mass points of hadronic_integral.
+    '''
+    return np.array([hadronic_integral(integrand, ECM, pids, gamma_i, mmed_i, mdm_i)
+        for mmed_i, mdm_i, gamma_i in zip(mmed, mdm, gamma)], dtype=float)
+
+# Each worker process holds its own integrand handler,
+# created once when the worker starts.
+_worker_wrapper = None
+
+def _init_worker(pdfset, member, ECM) :
+    global _worker_wrapper
+    _worker_wrapper = pdf.get_handler(pdfset, member, ECM)
+
+def _integrate_chunk(integrand_name, ECM, pids, profile, chunk) :
+    mmed, mdm, gamma = chunk
+    integrand = getattr(_worker_wrapper, integrand_name)
+    if not profile :
+        return hadronic_integrals(integrand, mmed, mdm, gamma, ECM, pids), {}
+    # Profile the chunk here and send the counters back to the parent.
+    with profiling.profile() as chunk_profile :
+        integrals = hadronic_integrals(integrand, mmed, mdm, gamma, ECM, pids)
+    return integrals, chunk_profile.counters
+
+def hadronic_integrals_parallel(integrand_name, mmed, mdm, gamma, ECM, pids, pdfset, member=0, n_workers=None, chunk_size=None) :
+    '''
+    Same as hadronic_integrals, but dispatches chunks of mass points
+    to a pool of worker processes.
+    integrand_name is the name of the IntegrandHandler method to integrate.
+    n_workers defaults to the number of available cores; chunk_size
+    defaults to giving each worker about four chunks, which keeps
+    the load balanced when some points converge more slowly than others.
+    '''
+    if not n_workers : n_workers = os.cpu_count()
+    npoints = len(mmed)
+    if not chunk_size : chunk_size = max(1, math.ceil(npoints/(4*n_workers)))
+
+    chunks = [(mmed[i:i+chunk_size], mdm[i:i+chunk_size], gamma[i:i+chunk_size])
+        for i in range(0, npoints, chunk_size)]
+    if not chunks : return np.array([], dtype=float)
+
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(chunks)), initializer=_init_worker, initargs=(pdfset, member, ECM)) as pool :
+        results = list(pool.map(partial(_integrate_chunk, integrand_name, ECM, pids, profiling.is_active()), chunks))
+
+    for integrals, counters in results :
+        for name, n in counters.items() :
+            profiling.count(name, n)
+    return np.concatenate([integrals for integrals, counters in results])
+
+# Vectorised parton-level integrals.
+# Adaptive quadrature has to run one point at a time, but a fixed
+# Gauss-Legendre rule can do every point at once if each point's integral
+# is first mapped onto a variable in which its integrand is smooth.
+
+def parton_integrand_vector(s, gamma, M, mDM) :
+    '''NumPy version of IntegrandHandler.integrand_parton_vector.'''
+    with np.errstate(invalid='ignore', divide='ignore') :
+        value = np.sqrt(s - 4.*mDM**2) * (s + 2.*mDM**2) / (np.sqrt(s) * (gamma**2 * M**2 + (M**2 - s)**2))
+    return np.where(s < 4.*mDM**2, 0., value)
+
+def parton_integrand_axialvector(s, gamma, M, mDM) :
+    '''NumPy version of IntegrandHandler.integrand_parton_axialvector.'''
+    with np.errstate(invalid='ignore', divide='ignore') :
+        value = (s - 4.*mDM**2)**1.5 / (np.sqrt(s) * (gamma**2 * M**2 + (M**2 - s)**2))
+    return np.where(s < 4.*mDM**2, 0., value)
+
+# NumPy integrands by the name of their IntegrandHandler equivalent.
+parton_integrands = {
+    'integrand_parton_vector' : parton_integrand_vector,
+    'integrand_parton_axialvector' : parton_integrand_axialvector,
+}
+
+def resonance_quadrature(smin, smax, M, gamma, n_nodes=64) :
+    '''
+    Quadrature nodes and weights in s for integrals from smin to smax of
+    functions with a Breit-Wigner peak at M**2 of width M*gamma.
+    Returns two arrays of shape (n_points, 5*n_nodes).
+    The range is split into five segments, each with its own variable:
+      smin to M**2/2            log(s)
+      M**2/2 to the resonance   log(M**2 - s)
+      resonance, M**2 +- 10 M gamma (at most M**2/2 either side)
+                                theta = arctan((s - M**2)/(M gamma))
+      resonance to 2 M**2       log(s - M**2)
+      2 M**2 to smax            log(s)
+    theta flattens the peak, and the Breit-Wigner falls off as a power of
+    s - M**2 on its shoulders, so in log|s - M**2| it is smooth however narrow
+    the width. Far from the peak, log(s) suits the falling PDFs and phase space.
+    Segments outside [smin, smax] get no weight. The segment starting at smin
+    is stretched towards it to absorb the sqrt(s - 4 mDM**2) threshold behaviour.
+    '''
+    smin, smax, M, gamma = [np.asarray(x, dtype=float)[:,None] for x in np.broadcast_arrays(smin, smax, M, gamma)]
+    x, w = np.polynomial.legendre.leggauss(n_nodes)
+    # Map the Gauss-Legendre rule onto [0, 1].
+    t, wt = 0.5*(x + 1.), 0.5*w
+
+    # Segment boundaries in s, in increasing order.
+    half_width = np.minimum(10.*M*gamma, 0.5*M**2)
+    edges = [np.clip(edge, smin, smax) for edge in
+        (smin, 0.5*M**2, M**2 - half_width, M**2 + half_width, 2.*M**2, smax)]
+
+    # Each variable as (u(s), s(u), ds/du), with u increasing or decreasing with s.
+    variables = [
+        (np.log, np.exp, np.exp),
+        (lambda s : np.log(M**2 - s), lambda u : M**2 - np.exp(u), lambda u : -np.exp(u)),
+        (lambda s : np.arctan((s - M**2)/(M*gamma)), lambda u : M**2 + M*gamma*np.tan(u), lambda u : M*gamma/np.cos(u)**2),
+        (lambda s : np.log(s - M**2), lambda u : M**2 + np.exp(u), np.exp),
+        (np.log, np.exp, np.exp),
+    ]
+
+    nodes, weights = [], []
+    for a, b, (to_u, from_u, jacobian) in zip(edges[:-1], edges[1:], variables) :
+        used = b > a
+        # Empty segments can fall where their variable is not defined
+        # (e.g. log(M**2 - s) above M**2): integrate those over [smin, smin] in s instead.
+        with np.errstate(invalid='ignore', divide='ignore') :
+            ua, ub = np.where(used, to_u(a), smin), np.where(used, to_u(b), smin)
+        # Quadratic stretch t -> t**2 clusters nodes at the smin end.
+        stretch = used & (a <= smin)
+        u = ua + (ub - ua)*np.where(stretch, t**2, t)
+        du = (ub - ua)*np.where(stretch, 2.*t, 1.)*wt
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore') :
+            nodes.append(np.where(used, from_u(u), smin))
+            weights.append(np.where(used, du*jacobian(u), 0.))
+
+    return np.concatenate(nodes, axis=1), np.concatenate(weights, axis=1)
+
+def parton_integrals_vectorised(integrand, mmed, mdm, gamma, ECM, n_nodes=64, block_size=8192) :
+    '''
+    Parton-level integrals from 4 mDM**2 to ECM for all points at once
+    (in blocks of block_size points, to bound the memory used by the nodes).
+    Also returns an error estimate per point: the difference from the same
+    rule with half as many nodes. Against adaptive quad at a relative
+    tolerance of 1e-12 (see benchmarks/bench_resonance_quadrature.py), the
+    default n_nodes agrees to about 1e-12 relative for widths down to 1e-5 of
+    the mediator mass, and to about 1e-10 at 1e-7.
+    '''
+    mmed, mdm, gamma = [np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(mmed, mdm, gamma)]
+    # The integrand vanishes as s -> 0, so no need to go all the way down.
+    smin = np.maximum(4.*mdm**2, 1e-10*ECM)
+
+    def integrate_with(n, block) :
+        s, w = resonance_quadrature(smin[block], ECM, mmed[block], gamma[block], n)
+        profiling.count("parton_vectorised.integrand_evaluations", s.size)
+        return np.sum(w * integrand(s, gamma[block,None], mmed[block,None], mdm[block,None]), axis=1)
+
+    profiling.count("parton_vectorised.points", len(mmed))
+    xsecs = np.empty(mmed.shape)
+    errors = np.empty(mmed.shape)
+    for start in range(0, len(mmed), block_size) :
+        block = slice(start, start+block_size)
+        xsecs[block] = integrate_with(n_nodes, block)
+        errors[block] = np.abs(xsecs[block] - integrate_with(n_nodes//2, block))
+    return xsecs, errors
@@ -0,0 +1,44 @@
+import numpy as np
+
+# Interpolation of limits between the widths they were given for.
+# Shared by the Rescaler and the cross section limit parsers.
+
+def interpolate_in_width(test_widths, limit_widths, limit_sets) :
+    '''
+    Linear interpolation, point by point, between limits given for several
+    intrinsic width to mass ratios.
+    limit_sets has one row per entry of limit_widths and one column per mass point;
+    test_widths has one width per mass point along its last axis, and may have
+    leading axes (e.g. one row per coupling combination).
+    If a test width is smaller than the smallest provided, the limit for the
+    smallest is used. If it is larger than the largest provided, no limit can
+    be set and the result is NaN, as it is for NaN widths.
+    All points are done at once: searchsorted finds each width's bracketing
+    pair of limits, which are then gathered for the point's mass column.
+    '''
+    limit_widths = np.asarray(limit_widths, dtype=float)
+    order = np.argsort(limit_widths)
+    xp = limit_widths[order]
+    fp = np.asarray(limit_sets, dtype=float)[order]
+    x = np.asarray(test_widths, dtype=float)
+    columns = np.arange(fp.shape[1])
+
+    if len(xp) == 1 :
+        result = np.broadcast_to(fp[0], x.shape).copy()
+    else :
+        upper = np.clip(np.searchsorted(xp, x, side='right'), 1, len(xp)-1)
+        lower = upper - 1
+        lower_limits = fp[lower, columns]
+        upper_limits = fp[upper, columns]
+        with np.errstate(invalid='ignore') :
+            t = (x - xp[lower])/(xp[upper] - xp[lower])
+            result = lower_limits + t*(upper_limits - lower_limits)
+        # Exactly on a tabulated width, don't let infinities in the
+        # other limit turn it into a NaN.
+        result = np.where(t == 0., lower_limits, result)
+        result = np.where(t == 1., upper_limits, result)
+        result = np.where(x <= xp[0], fp[0, columns], result)
+
+    # Covers NaN widths as well as widths that are too large.
+    result[~(x <= xp[-1])] = np.nan
+    return result
@@ -1,9 +1,11 @@
 from dataclasses import dataclass
 import numpy as np
 import abc
-import math
 
 from couplingscan.scan import *
+from couplingscan.interpolation import interpolate_in_width
+from couplingscan.results import unique_in_order
+from couplingscan.profiling import profiled
 
 @dataclass
 class CouplingLimit_Dijet(abc.ABC) :
@@ -23,7 +25,7 @@ class CouplingLimit_Dijet(abc.ABC) :
             attrval = getattr(self,attr)
             if isinstance(attrval,list) :
                 setattr(self,attr,np.array(attrval,dtype=float))
-            elif type(attrval) is not np.ndarray :
+            elif not isinstance(attrval,np.ndarray) :
                 setattr(self,attr,np.array([attrval],dtype=float))
             else :
                 setattr(self,attr,attrval.astype(float))
@@ -46,38 +48,26 @@ class CouplingLimit_Dijet(abc.ABC) :
             print("This is only defined for axial or vector couplings!")
             exit(1)
 
-    # This is dijet at a hadron collider: quarks in, quarks out.
-    def extract_exclusion_depths(self,scan) :
-
-        # Limit scenario is the one in which our input limit (and this class) is defined.
-        # Scan scenario is the one we're going towards.
-
-        # Extract full cross sections for target scan scenario.
-        xsec_scan = scan.mediator_partial_width_quarks()**2/scan.mediator_total_width()
+    # Everything in the exclusion depth that depends only on the mediator mass:
+    # the limit on gq interpolated to mmed, squared, times the cross section in
+    # the world of the input plot. Depths are this over the target cross section.
+    def plot_world_terms(self, mmed) :
 
         # Create scan in world of input plot.
         # Need a placeholder gq around which we interpret: pick 1.
-        if self.coupling == 'axial' :
-            plot_world = DMAxialModelScan(
-                mmed=scan.mmed,
-                mdm=self.mdm,
-                gq=1.0,
-                gdm=self.gdm,
-                gl=self.gl,
-            )
-        else :
-            plot_world = DMVectorModelScan(
-                mmed=scan.mmed,
-                mdm=self.mdm,
-                gq=1.0,
-                gdm=self.gdm,
-                gl=self.gl,
-            )
+        plot_model = DMAxialModelScan if self.coupling == 'axial' else DMVectorModelScan
+        plot_world = plot_model(
+            mmed=mmed,
+            mdm=self.mdm,
+            gq=1.0,
+            gdm=self.gdm,
+            gl=self.gl,
+        )
 
         # Interpolate input gq limit curve to get all the mass points we need
         # Any points in grid that are actually above or below analysis mmed
         # values should never be excluded, so we give them a very large value        
-        interpolated_limit_gq = np.interp(scan.mmed, self.mmed, self.gq_limits,left=10.,right=10.)
+        interpolated_limit_gq = np.interp(mmed, self.mmed, self.gq_limits,left=10.,right=10.)
 
         # This math comes from the CMS original versions of the calculation, and works well, 
         # but is limited to cases where gdm=0 and gl=0.
@@ -86,10 +76,53 @@ class CouplingLimit_Dijet(abc.ABC) :
 
         # This should be more general.
         xsec_plot_world = plot_world.mediator_partial_width_quarks()**2/plot_world.mediator_total_width()
-        exclusion_depth = (xsec_plot_world/xsec_scan) * interpolated_limit_gq**2
+        return xsec_plot_world * interpolated_limit_gq**2
+
+    # This is dijet at a hadron collider: quarks in, quarks out.
+    @profiled
+    def extract_exclusion_depths(self,scan) :
+
+        # Limit scenario is the one in which our input limit (and this class) is defined.
+        # Scan scenario is the one we're going towards.
+
+        # Extract full cross sections for target scan scenario.
+        xsec_scan = scan.mediator_partial_width_quarks()**2/scan.mediator_total_width()
+
+        exclusion_depth = on_distinct_values(self.plot_world_terms, scan.mmed)/xsec_scan
 
         return exclusion_depth
 
+    @profiled
+    def extract_exclusion_depths_batch(self, mmed, mdm, scenarios) :
+        '''
+        Exclusion depths for many target scenarios on one set of mass points.
+        scenarios is a list of (model, gq, gdm, gl), where model is a key of
+        model_scans such as 'vector' or 'axial'.
+        The interpolated limit and the plot-world widths are computed once for
+        each distinct mediator mass, and the target widths once per model, with
+        one row of couplings per scenario.
+        Returns an array of shape (n_scenarios, n_mass), one row per scenario
+        in the order given, equal to extract_exclusion_depths for each.
+        '''
+        mmed, mdm = [np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(mmed, mdm)]
+        for model, *couplings in scenarios :
+            if model not in model_scans :
+                print("Unrecognized target model",model,"! Choose from:",list(model_scans.keys()))
+                exit(1)
+
+        plot_world_terms = on_distinct_values(self.plot_world_terms, mmed)
+
+        exclusion_depths = np.empty((len(scenarios), len(mmed)))
+        for model in dict.fromkeys(scenario[0] for scenario in scenarios) :
+            rows = [i for i, scenario in enumerate(scenarios) if scenario[0] == model]
+            columns = np.array([scenarios[i][1:] for i in rows], dtype=float).T.reshape(3, -1, 1)
+            # Unit couplings: only the kinematic factors of the prototype are used.
+            prototype = model_scans[model](mmed=mmed, mdm=mdm, gq=1.0, gdm=1.0, gl=1.0)
+            partial_widths = prototype.width_basis().partial_widths(*columns)
+            xsec_scan = partial_widths["quarks"]**2/sum(partial_widths.values())
+            exclusion_depths[rows] = plot_world_terms/xsec_scan
+        return exclusion_depths
+
 # Class for scaling theory cross section and looking
 # at ratio with respect to observed limit line.
 @dataclass
@@ -133,7 +166,7 @@ class CrossSectionLimit1D(abc.ABC):
         # they had better all be single-valued. Make sure they're floats.
         for attr in ["mdm", "gq", "gdm", "gl"] :
             attrval = getattr(self,attr)
-            if isinstance(attrval,list) or type(attrval) is np.ndarray :
+            if isinstance(attrval,(list,np.ndarray)) :
                 if len(attrval) > 1 :
                     print("This needs to match an input plot that is one-dimensional and has just one theory line.")
                     print("You have not provided single values for one of mdm, gq, gdm, or gl.")
@@ -149,19 +182,56 @@ class CrossSectionLimit1D(abc.ABC):
     def get_approx_xsec(self, scan) :
         pass
 
+    # The same cross section from partial widths (a dict by channel, as from
+    # WidthBasis.partial_widths) and total widths, for many scenarios at once.
+    @abc.abstractmethod
+    def approx_xsec_from_widths(self, partial_widths, total_width) :
+        pass
+
     # limit_sets are the ones to select from
     # test_widths are the widths for which you need limit values
+    @profiled
     def pick_appropriate_limit(self, test_widths, limit_widths, limit_sets) :
         # Linear interpolate between observed limits at points of interest.
         # If smaller width than smallest provided, use smallest provided.
         # If larger than largest provided, no limit can be set.
-        appropriate_limits = []
-        for width, limits in zip(test_widths,limit_sets.transpose()) :
-            appropriate_observed = np.interp([width], limit_widths, limits,left=limits[0],right=math.nan)
-            appropriate_limits.append(appropriate_observed[0])
-        return np.array(appropriate_limits)        
+        return interpolate_in_width(test_widths, limit_widths, limit_sets)
+
+    # Theory cross sections at the given mediator masses in the world of the
+    # input xsec limit plot: its model and couplings.
+    def plot_world_scan(self, mmed) :
+        plot_model = DMAxialModelScan if self.coupling == 'axial' else DMVectorModelScan
+        return plot_model(
+            mmed=mmed,
+            mdm=self.mdm,
+            gq=self.gq,
+            gdm=self.gdm,
+            gl=self.gl,
+        )
+
+    # Interpolate theory curve and observed limit curves at the requested granularity.
+    # Want interpolation to be log, not linear (that is, linear in y log axis plot).
+    # Returns the theory curve and one row of limits per width.
+    def interpolated_curves(self, mmed) :
+        interp_xsec_theory = np.exp(np.interp(mmed, self.mmed_theory, np.log(self.xsec_theory),left=np.nan,right=np.nan))
+        # The limits may have multiple width curves.
+        interp_limit = lambda mylist : np.exp(np.interp(mmed, self.mmed_limit, np.log(mylist),left=np.nan,right=np.nan))
+        interp_xsec_limits = np.array([interp_limit(i) for i in self.xsec_limits])
+        return interp_xsec_theory, interp_xsec_limits
+
+    # Everything in the exclusion depths that depends only on the mediator mass:
+    # the interpolated theory curve, one row of limits per width, and the theory
+    # cross section in the world of the input plot. Mass grids repeat each mmed
+    # many times, so these are computed once per distinct value.
+    def mass_terms(self, mmed) :
+        def terms(mmed) :
+            interp_xsec_theory, interp_xsec_limits = self.interpolated_curves(mmed)
+            return {"theory" : interp_xsec_theory, "limits" : interp_xsec_limits,
+                "plot_world" : self.get_approx_xsec(self.plot_world_scan(mmed))}
+        return on_distinct_values(terms, mmed)
 
     # This will call the inheriting methods where the cross sections differ.
+    @profiled
     def extract_exclusion_depths(self, scan) :
 
         # Here we have a cross section and a (set of) observed limit(s).
@@ -174,31 +244,11 @@ class CrossSectionLimit1D(abc.ABC):
         # Extract full cross sections for scan scenario.
         xsec_scan = self.get_approx_xsec(scan)
 
-        # Interpolate theory curve and observed limit curves at the requested granularity.
-        # Want interpolation to be log, not linear (that is, linear in y log axis plot).
-        interp_xsec_theory = np.exp(np.interp(scan.mmed, self.mmed_theory, np.log(self.xsec_theory),left=np.nan,right=np.nan))
-        # The limits may have multiple width curves.
-        interp_limit = lambda mylist : np.exp(np.interp(scan.mmed, self.mmed_limit, np.log(mylist),left=np.nan,right=np.nan))
-        interp_xsec_limits = np.array([interp_limit(i) for i in self.xsec_limits])
-
-        # Get equivalent theory cross sections at the desired mass points in the world of the input xsec limit plot.
-        if self.coupling == 'axial' :
-            plot_world = DMAxialModelScan(
-                mmed=scan.mmed,
-                mdm=self.mdm,
-                gq=self.gq,
-                gdm=self.gdm,
-                gl=self.gl,
-            )
-        else :
-            plot_world = DMVectorModelScan(
-                mmed=scan.mmed,
-                mdm=self.mdm,
-                gq=self.gq,
-                gdm=self.gdm,
-                gl=self.gl,
-            )
-        xsec_plot_world = self.get_approx_xsec(plot_world)
+        # Interpolated curves, and equivalent theory cross sections at the desired
+        # mass points in the world of the input xsec limit plot.
+        mass_terms = self.mass_terms(scan.mmed)
+        interp_xsec_theory, interp_xsec_limits = mass_terms["theory"], mass_terms["limits"]
+        xsec_plot_world = mass_terms["plot_world"]
 
         # Scale theory curve to the equivalent values for the scenario of interest.
         scaled_theory = interp_xsec_theory*(xsec_scan/xsec_plot_world)
@@ -217,8 +267,51 @@ class CrossSectionLimit1D(abc.ABC):
             return {k : v for k, v in zip(self.widths,exclusion_depths)}
         else : return exclusion_depths[0]
 
+    @profiled
+    def extract_exclusion_depths_batch(self, scan, target_gq, target_gdm, target_gl, grid=False, select=False) :
+        '''
+        Exclusion depths for many coupling scenarios of the model of scan, at its
+        mass points (the scan's own couplings are not used), in one pass.
+        target_gq, target_gdm and target_gl hold one value per scenario, or with
+        grid=True the values along each axis, every combination being taken in
+        the order of Rescaler.create_target_arrays (gq slowest, gl fastest).
+        The theory and limit curves and the plot-world cross sections only depend
+        on the mediator mass, so they are computed once for all scenarios
+        (and once per distinct mmed).
+        Returns an array of shape (n_scenarios, n_mass, n_widths), with widths in
+        the order of self.widths. With select=True, instead returns the
+        (n_scenarios, n_mass) depths for each point's own width, as select_depths does.
+        '''
+        couplings = [np.atleast_1d(np.asarray(g, dtype=float)) for g in (target_gq, target_gdm, target_gl)]
+        if grid :
+            couplings = [g.ravel() for g in np.meshgrid(*[unique_in_order(g) for g in couplings], indexing='ij')]
+        else :
+            couplings = [g.ravel() for g in np.broadcast_arrays(*couplings)]
+
+        # Same cross sections as get_approx_xsec, but with one row per scenario.
+        partial_widths = scan.width_basis().partial_widths(*[g.reshape(-1,1) for g in couplings])
+        total_width = sum(partial_widths.values())
+        xsec_scan = self.approx_xsec_from_widths(partial_widths, total_width)
+
+        mass_terms = self.mass_terms(scan.mmed)
+        interp_xsec_limits = mass_terms["limits"]
+        scaled_theory = mass_terms["theory"]*(xsec_scan/mass_terms["plot_world"])
+
+        # Scenarios and masses first, widths last.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            exclusion_depths = np.where((scaled_theory > 0)[...,None],
+                interp_xsec_limits.T[None,:,:]/scaled_theory[...,None], np.nan)
+        if not select : return exclusion_depths
+
+        # Every (scenario, mass) pair is a column of limits to pick from by width.
+        n_scenarios, n_mass, n_widths = exclusion_depths.shape
+        use_limits = self.pick_appropriate_limit((total_width/scan.mmed).ravel(), self.widths,
+            exclusion_depths.reshape(-1, n_widths).T)
+        return use_limits.reshape(n_scenarios, n_mass)
+
     # If we are not planning on using a rescaler
     # and instead really want the appropriate depths per width for a given scan:
+    @profiled
     def select_depths(self,scan,depths) :
         
         widths_scan = scan.mediator_total_width()/scan.mmed
@@ -227,23 +320,7 @@ class CrossSectionLimit1D(abc.ABC):
         return use_limits
 
     def get_rhs_couplinglimit(self) :
-        if self.coupling == 'axial' :
-            plot_world = DMAxialModelScan(
-                mmed=self.mmed,
-                mdm=self.mdm,
-                gq=self.gq,
-                gdm=self.gdm,
-                gl=self.gl,
-            )
-        else :
-            plot_world = DMVectorModelScan(
-                mmed=self.mmed,
-                mdm=self.mdm,
-                gq=self.gq,
-                gdm=self.gdm,
-                gl=self.gl,
-            )
-        xsec_plot_world = self.get_approx_xsec(plot_world)        
+        xsec_plot_world = self.get_approx_xsec(self.plot_world_scan(self.mmed))        
         rhs_couplinglimit = xsec_plot_world*(self.xsec_limit/self.xsec_theory)
         return rhs_couplinglimit      
 
@@ -282,6 +359,9 @@ class CrossSectionLimit_Dijet(CrossSectionLimit1D) :
     def get_approx_xsec(self, scan) :
         return scan.mediator_partial_width_quarks()**2/scan.mediator_total_width()      
 
+    def approx_xsec_from_widths(self, partial_widths, total_width) :
+        return partial_widths["quarks"]**2/total_width
+
 # For dilepton, different visible final state
 # but also include explicit support for varying widths
 # since the resolutions are so different.
@@ -305,4 +385,7 @@ class CrossSectionLimit_Dilepton(CrossSectionLimit1D) :
 
     # This is dilepton at hadron colliders: quarks in, leptons out.
     def get_approx_xsec(self, scan) :
-        return scan.mediator_partial_width_quarks()*scan.mediator_partial_width_leptons()/scan.mediator_total_width()  
\ No newline at end of file
+        return scan.mediator_partial_width_quarks()*scan.mediator_partial_width_leptons()/scan.mediator_total_width()  
+
+    def approx_xsec_from_widths(self, partial_widths, total_width) :
+        return partial_widths["quarks"]*partial_widths["leptons"]/total_width
\ No newline at end of file
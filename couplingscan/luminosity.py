@@ -0,0 +1,165 @@
+from dataclasses import dataclass
+import hashlib
+import os
+import warnings
+
+import numpy as np
+
+from couplingscan import pdf, profiling
+from couplingscan.cache import default_cache_directory
+from couplingscan.integration import resonance_quadrature
+
+# Tabulated parton luminosities for the hadron-level integrals.
+# Changing variables from (x1, x2) to (tau = x1 x2, y) splits the
+# hadronic integral into
+#   1e8 * int dtau sigmahat(tau S) L(tau),
+# where the q qbar luminosity L(tau) depends only on the PDF set, ECM and
+# flavours, and not on the mediator or DM at all. So L is computed once on
+# a fine grid, kept on disk, and every mass point then costs one 1D integral
+# of the parton-level integrand against it, with no PDF calls.
+
+# The grid is uniform in logit(tau) = log(tau/(1 - tau)), which is fine
+# both at small tau, where L rises steeply, and as tau -> 1, where it vanishes.
+_tau_range = (1e-10, 1. - 1e-8)
+_n_tau = 4001
+
+# Estimated relative error of a hadronic integral above which
+# DMModelScan.hadron_level_integrals warns about it. Linear interpolation
+# in the table limits the integrals to about 1e-6 to 1e-5 anyway.
+luminosity_tolerance = 1e-4
+
+def _logit(tau) :
+    with np.errstate(divide='ignore') :
+        return np.log(tau) - np.log1p(-tau)
+
+@dataclass
+class LuminosityTable :
+    '''
+    log L(tau) on a grid uniform in logit(tau), for one PDF set and member
+    (pdfset holds their label), ECM and list of flavours.
+    L is interpolated linearly in log, and is zero outside the grid.
+    '''
+    logit_tau: np.ndarray
+    log_luminosity: np.ndarray
+    pdfset: str
+    ECM: float
+    flavours: tuple
+    # Largest relative error seen when interpolating the table
+    # against itself (see validation_error).
+    validation_error: float = np.nan
+
+    def luminosity(self, tau) :
+        tau = np.asarray(tau, dtype=float)
+        values = np.exp(np.interp(_logit(tau), self.logit_tau, self.log_luminosity))
+        return np.where((tau >= _tau_range[0]) & (tau <= _tau_range[1]), values, 0.)
+
+    def hadronic_integrals(self, integrand, mmed, mdm, gamma, n_nodes=64, block_size=8192) :
+        '''
+        Hadron-level integrals (without couplings) for all points at once,
+        from the NumPy parton-level integrand (see integration.parton_integrands),
+        on the same resonance-adapted Gauss-Legendre rule as parton_integrals_vectorised.
+        Same normalisation as the IntegrandHandler integrals.
+        Also returns an error estimate per point: the difference from the same
+        rule with half as many nodes. It covers the quadrature only, not the
+        interpolation of the table (see validation_error).
+        '''
+        mmed, mdm, gamma = [np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(mmed, mdm, gamma)]
+        # Below the bottom of the grid the luminosity is zero anyway.
+        smin = np.maximum(4.*mdm**2, _tau_range[0]*self.ECM)
+
+        def integrate_with(n, block) :
+            s, w = resonance_quadrature(smin[block], self.ECM, mmed[block], gamma[block], n)
+            profiling.count("luminosity.integrand_evaluations", s.size)
+            weights = w * self.luminosity(s/self.ECM)/self.ECM
+            return 1e8*np.sum(weights * integrand(s, gamma[block,None], mmed[block,None], mdm[block,None]), axis=1)
+
+        profiling.count("luminosity.points", len(mmed))
+        integrals = np.empty(mmed.shape)
+        errors = np.empty(mmed.shape)
+        for start in range(0, len(mmed), block_size) :
+            block = slice(start, start+block_size)
+            integrals[block] = integrate_with(n_nodes, block)
+            errors[block] = np.abs(integrals[block] - integrate_with(n_nodes//2, block))
+        return integrals, errors
+
+    def save(self, path) :
+        # Written to a temporary file and moved into place, so that
+        # another process never loads a half-written table.
+        temporary = "{0}.{1}.npz".format(path, os.getpid())
+        np.savez(temporary, logit_tau=self.logit_tau, log_luminosity=self.log_luminosity,
+            pdfset=np.array(self.pdfset), ECM=np.array(self.ECM), flavours=np.array(self.flavours),
+            validation_error=np.array(self.validation_error))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path) :
+        with np.load(path) as data :
+            return cls(logit_tau=data["logit_tau"], log_luminosity=data["log_luminosity"],
+                pdfset=str(data["pdfset"]), ECM=float(data["ECM"]),
+                flavours=tuple(int(pid) for pid in data["flavours"]),
+                validation_error=float(data["validation_error"]))
+
+def validation_error(table) :
+    '''
+    Interpolates from every other grid node to the nodes left out.
+    Linear interpolation error scales with the square of the spacing,
+    so the largest relative difference is divided by four to estimate
+    the error of the full table.
+    '''
+    coarse = np.exp(np.interp(table.logit_tau[1::2], table.logit_tau[::2], table.log_luminosity[::2]))
+    truth = np.exp(table.log_luminosity[1::2])
+    with np.errstate(divide='ignore', invalid='ignore') :
+        relative = np.abs(coarse - truth)/truth
+    return np.nanmax(relative[truth > 0])/4.
+
+def build_luminosity_table(pdfset, member, ECM, flavours, n_tau=_n_tau, nthreads=1, rel_tol=1e-8) :
+    '''
+    Computes L(tau) with lhapdfwrap at n_tau points,
+    using nthreads threads (0: one per core).
+    '''
+    logit_tau = np.linspace(_logit(_tau_range[0]), _logit(_tau_range[1]), n_tau)
+    tau = 1./(1. + np.exp(-logit_tau))
+    values, converged = pdf.get_handler(pdfset, member, ECM).parton_luminosity(tau, list(flavours), nthreads=nthreads, rel_tol=rel_tol)
+    if not converged.all() :
+        import scipy.integrate as integrate
+        warnings.warn("The parton luminosity at {0} of {1} values of tau ran out of subdivisions before reaching rel_tol={2:g}.".format(
+            np.count_nonzero(~converged), len(converged), rel_tol), integrate.IntegrationWarning)
+    # The luminosity can underflow to zero close to tau = 1.
+    log_luminosity = np.log(np.maximum(values, np.finfo(float).tiny))
+    table = LuminosityTable(logit_tau=logit_tau, log_luminosity=log_luminosity,
+        pdfset=pdf.pdf_label(pdfset, member), ECM=float(ECM), flavours=tuple(flavours))
+    table.validation_error = validation_error(table)
+    return table
+
+# (label, ECM, flavours) : LuminosityTable, for tables already used in this process.
+_tables = {}
+
+def _table_path(directory, label, ECM, flavours) :
+    key = "{0}:{1:.12g}:{2}:{3}".format(label, ECM, list(flavours), _n_tau)
+    return os.path.join(directory, "luminosity-{0}.npz".format(hashlib.sha256(key.encode()).hexdigest()[:16]))
+
+def get_luminosity_table(pdfset, member, ECM, flavours, directory=None, nthreads=0) :
+    '''
+    The luminosity table for this PDF set, member, ECM and flavours.
+    Tables are kept in memory for the rest of the process and on disk in
+    a luminosity directory under the integral cache directory (see
+    cache.default_cache_directory), so each is only computed once.
+    Only computing one needs LHAPDF.
+    '''
+    label = pdf.pdf_label(pdfset, member)
+    key = (label, float(ECM), tuple(flavours))
+    if key in _tables : return _tables[key]
+
+    directory = directory if directory else os.path.join(default_cache_directory(), "luminosity")
+    path = _table_path(directory, label, ECM, flavours)
+    if os.path.exists(path) :
+        table = LuminosityTable.load(path)
+    else :
+        table = build_luminosity_table(pdfset, member, ECM, flavours, nthreads=nthreads)
+        try :
+            os.makedirs(directory, exist_ok=True)
+            table.save(path)
+        except OSError :
+            pass
+    _tables[key] = table
+    return table
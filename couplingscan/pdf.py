@@ -0,0 +1,54 @@
+import importlib.util
+
+# LHAPDF integrand handlers, created on first use and shared within a process.
+# Loading a PDF set reads its whole grid from disk, so nothing is loaded
+# at import time: widths, branching ratios and propagator rescaling never
+# need one, and worker processes only load the sets they actually integrate.
+
+# Check if lhapdf was available at compile time,
+# without importing the module.
+hasLHAPDF = importlib.util.find_spec('lhapdfwrap') is not None
+
+# Set and member used by scans unless configured otherwise.
+_default = {"pdfset" : "NNPDF30_nlo_as_0118", "member" : 0}
+
+# (pdfset, member, ECM) : IntegrandHandler
+_handlers = {}
+
+def set_default_pdf(pdfset, member=0) :
+    '''
+    Sets the PDF set (by LHAPDF name) and member used from now on
+    by scans in this process. Handlers already loaded are kept.
+    '''
+    _default["pdfset"] = pdfset
+    _default["member"] = int(member)
+
+def default_pdfset() :
+    return _default["pdfset"]
+
+def default_member() :
+    return _default["member"]
+
+def pdf_label(pdfset, member=0) :
+    '''
+    Name identifying a set and member, in LHAPDF's "set/member" form.
+    Member 0 is just the set name, as it always has been in caches and tables.
+    '''
+    return pdfset if member == 0 else "{0}/{1}".format(pdfset, member)
+
+def get_handler(pdfset, member, ECM) :
+    '''
+    The IntegrandHandler for this set, member and squared centre-of-mass
+    energy, loading the PDF the first time it is asked for in this process.
+    '''
+    if not hasLHAPDF :
+        raise SystemExit("""You do not have LHAPDF installed! You cannot use this function.""")
+    key = (pdfset, int(member), float(ECM))
+    if key not in _handlers :
+        import lhapdfwrap as pdfwrap
+        _handlers[key] = pdfwrap.IntegrandHandler(pdfset, int(member), float(ECM))
+    return _handlers[key]
+
+def loaded_handlers() :
+    '''The (pdfset, member, ECM) of every handler loaded so far in this process.'''
+    return list(_handlers.keys())
@@ -0,0 +1,144 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import time
+
+# Opt-in instrumentation of the slow parts of a reinterpretation:
+# wall time and call counts for the decorated functions, plus counters
+# (integrand evaluations, integrals that hit their subdivision limit, ...)
+# recorded by the integration code.
+# Nothing is recorded unless a Profile is active, and when none is,
+# each decorated call costs one extra check.
+#
+# Use as
+#   with profiling.profile() as report :
+#       rescaler.rescale_by_hadronic_xsec_monox(...)
+#   print(report.summary())
+#   report.save("profile.json")
+# or set COUPLINGSCAN_PROFILE=1 (summary printed at exit) or
+# COUPLINGSCAN_PROFILE=profile.json (report written there at exit)
+# to profile a whole script without changing it.
+
+# Profiles currently recording. More than one can be active when nested.
+_active = []
+
+class Profile :
+    '''
+    Timings and counters gathered while active.
+    timers holds {name : {"calls" : n, "seconds" : total wall time}}, where the
+    time is inclusive of anything called inside; counters holds {name : count}.
+    '''
+
+    def __init__(self) :
+        self.timers = {}
+        self.counters = {}
+        self.started = None
+        self.wall_time = 0.
+
+    def start(self) :
+        self.started = time.perf_counter()
+        _active.append(self)
+        return self
+
+    def stop(self) :
+        if self in _active :
+            _active.remove(self)
+            self.wall_time += time.perf_counter() - self.started
+        return self
+
+    def __enter__(self) :
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) :
+        self.stop()
+
+    def add_time(self, name, seconds) :
+        timer = self.timers.setdefault(name, {"calls" : 0, "seconds" : 0.})
+        timer["calls"] += 1
+        timer["seconds"] += seconds
+
+    def add_count(self, name, n) :
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) :
+        '''Everything recorded, as a JSON-serialisable dict.'''
+        return {"wall_time" : self.wall_time, "timers" : self.timers, "counters" : self.counters}
+
+    def save(self, path) :
+        with open(path, "w") as output_file :
+            json.dump(self.report(), output_file, indent=2)
+
+    def summary(self) :
+        '''Human-readable table of the timers, slowest first, then the counters.'''
+        lines = ["{0:<60} {1:>8} {2:>12}".format("Function", "calls", "seconds")]
+        for name, timer in sorted(self.timers.items(), key=lambda item : -item[1]["seconds"]) :
+            lines.append("{0:<60} {1:>8} {2:>12.4g}".format(name, timer["calls"], timer["seconds"]))
+        if self.counters :
+            lines.append("")
+            lines.append("{0:<60} {1:>8}".format("Counter", "count"))
+            for name, count in sorted(self.counters.items()) :
+                lines.append("{0:<60} {1:>8}".format(name, count))
+        lines.append("Total profiled wall time: {0:.4g} s".format(self.wall_time))
+        return "\n".join(lines)
+
+def profile() :
+    '''A new Profile, to be used as a context manager.'''
+    return Profile()
+
+def is_active() :
+    return bool(_active)
+
+def count(name, n=1) :
+    '''Adds n to the named counter of every active profile.'''
+    for active in _active :
+        active.add_count(name, n)
+
+def profiled(function=None, name=None) :
+    '''
+    Decorator recording the wall time and number of calls of a function
+    while a profile is active. The name defaults to the function's qualified
+    name, e.g. DMVectorModelScan.hadron_level_xsec_monox_relative.
+    '''
+    if function is None :
+        return functools.partial(profiled, name=name)
+    timer_name = name if name else function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs) :
+        if not _active :
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try :
+            return function(*args, **kwargs)
+        finally :
+            elapsed = time.perf_counter() - start
+            for active in _active :
+                active.add_time(timer_name, elapsed)
+    return wrapper
+
+def counting(function, name) :
+    '''
+    Wraps function (e.g. an integrand) so that every call adds one
+    to the named counter. Only worth doing while a profile is active.
+    '''
+    def wrapper(*args) :
+        count(name)
+        return function(*args)
+    return wrapper
+
+def _start_from_environment() :
+    setting = os.environ.get("COUPLINGSCAN_PROFILE", "")
+    if setting in ("", "0") : return
+    environment_profile = Profile().start()
+
+    def finish() :
+        environment_profile.stop()
+        if setting.endswith(".json") :
+            environment_profile.save(setting)
+        else :
+            print(environment_profile.summary(), file=sys.stderr)
+    atexit.register(finish)
+
+_start_from_environment()
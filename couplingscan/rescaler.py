@@ -1,6 +1,9 @@
 import numpy as np
 from couplingscan.scan import *
-import math
+from couplingscan.results import RescaleResult, unique_in_order
+from couplingscan.interpolation import interpolate_in_width
+from couplingscan import profiling
+from couplingscan.profiling import profiled
 
 # Each rescaler has a reference scan against which the others are scaled.
 @dataclass
@@ -13,6 +16,13 @@ class Rescaler(abc.ABC):
 
     def __post_init__(self) :
         self.check_ref_scan()
+        # Target model scans on the reference mass points, one per model.
+        self._target_prototypes = {}
+        # The reference scan is fixed for the lifetime of the rescaler, so its
+        # factors are only computed once per method (and options that change them),
+        # and its hadron-level integrals are kept, by engine, for reuse by targets.
+        self._reference_factors = {}
+        self._reference_integrals = {}
 
         if type(self.reference_exclusion_depths) is dict :
             print("""You've supplied a dictionary for the limits. The appropriate limit to use
@@ -32,9 +42,9 @@ class Rescaler(abc.ABC):
     def check_ref_scan(self) :
         '''Need to confirm the reference scan makes sense.
         Key items: only one value of each coupling.'''
-        if (self.reference_scan.gq == np.ndarray and len(self.reference_scan.gq) > 1) or \
-            (self.reference_scan.gdm == np.ndarray and len(self.reference_scan.gdm) > 1) or \
-            (self.reference_scan.gl == np.ndarray and len(self.reference_scan.gl) > 1) :
+        if len(np.unique(self.reference_scan.gq)) > 1 or \
+            len(np.unique(self.reference_scan.gdm)) > 1 or \
+            len(np.unique(self.reference_scan.gl)) > 1 :
             print("You can only have one unique value of each coupling in your reference scan!")
             exit(1)
     
@@ -78,12 +88,25 @@ class Rescaler(abc.ABC):
 
         return
 
+    # Which group of models in check_models_methods each rescaling method belongs to.
+    # Keys are the rescale_by_ method names without the prefix.
+    _method_groups = {
+        'br_quarks' : 'BR',
+        'br_leptons' : 'BR',
+        'propagator' : 'propagator',
+        'hadronic_xsec_monox' : 'hadron-level',
+        'hadronic_table' : 'hadron-level',
+        'parton_level_xsec_monox' : 'parton-level',
+    }
+
     def create_target_arrays(self,target_gq, target_gdm, target_gl) :
         '''Creates target arrays with full grid of requested couplings'''
 
-        # Gets all combinations in 3 rows of values
-        # And sets everything to floats.
-        target_grid = np.array(np.meshgrid(target_gq,target_gdm,target_gl),dtype=float).reshape(3,-1)
+        # Gets all combinations in 3 rows of values, with gq varying slowest
+        # and gl fastest, matching the axes of RescaleResult.
+        # Repeated values would only give duplicate results, so drop them.
+        target_axes = [unique_in_order(target) for target in (target_gq, target_gdm, target_gl)]
+        target_grid = np.array(np.meshgrid(*target_axes, indexing='ij'),dtype=float).reshape(3,-1)
 
         return target_grid
 
@@ -103,40 +126,161 @@ class Rescaler(abc.ABC):
         target_couplings = np.repeat(target_arrays,n_masspoints,axis=1)
 
         # Now create the appropriate scan.
-        if target_ID == 'axial' : 
-            target_scan = DMAxialModelScan(mmed=target_mmed, mdm=target_mdm, gq=target_couplings[0],
-                gdm=target_couplings[1], gl=target_couplings[2])
-        elif target_ID == 'vector' :
-            target_scan = DMVectorModelScan(mmed=target_mmed, mdm=target_mdm, gq=target_couplings[0],
-                gdm=target_couplings[1], gl=target_couplings[2])
-        elif target_ID == 'scalar' :
-            target_scan = DMScalarModelScan(mmed=target_mmed, mdm=target_mdm, gq=target_couplings[0],
-                gdm=target_couplings[1], gl=target_couplings[2])
-        elif target_ID == 'pseudoscalar' :
-            target_scan = DMPseudoModelScan(mmed=target_mmed, mdm=target_mdm, gq=target_couplings[0],
-                gdm=target_couplings[1], gl=target_couplings[2])
-        else :
+        if target_ID not in model_scans :
             print("Unrecognized target model!")
             exit(1)
+        target_scan = model_scans[target_ID](mmed=target_mmed, mdm=target_mdm, gq=target_couplings[0],
+            gdm=target_couplings[1], gl=target_couplings[2], **self.reference_scan.pdf_settings())
 
         return target_scan
 
+    def target_prototype(self, target_ID) :
+        '''
+        Scan of the target model on the reference mass points with unit couplings,
+        made once per model. Its WidthBasis gives the widths for any target couplings
+        without building a scan per coupling combination (as create_target_scan does).
+        '''
+        if target_ID not in self._target_prototypes :
+            if target_ID not in model_scans :
+                print("Unrecognized target model!")
+                exit(1)
+            self._target_prototypes[target_ID] = model_scans[target_ID](mmed=self.reference_scan.mmed,
+                mdm=self.reference_scan.mdm, gq=1.0, gdm=1.0, gl=1.0, **self.reference_scan.pdf_settings())
+        return self._target_prototypes[target_ID]
+
+    @profiled
+    def cross_section_factors(self, scan, method, gq, gdm, gl, n_workers=1, chunk_size=None, cache=None, engine='nquad', table=None, vectorised=False) :
+        '''
+        Quantity proportional to the signal cross section under the given rescaling
+        method, for the model of scan at its mass points with couplings gq, gdm, gl.
+        The couplings broadcast against the mass points, so columns of shape
+        (n_couplings, 1) give one row per coupling combination.
+        Returns the factors and the matching total widths.
+        '''
+        partial_widths = scan.width_basis().partial_widths(gq, gdm, gl)
+        gamma = sum(partial_widths.values())
+        gq, gdm = np.asarray(gq, dtype=float), np.asarray(gdm, dtype=float)
+
+        if method == 'br_quarks' :
+            factors = partial_widths["quarks"]**2 / gamma
+        elif method == 'br_leptons' :
+            factors = partial_widths["quarks"] * partial_widths["leptons"] / gamma
+        elif method == 'propagator' :
+            factors = gq**2 * gdm**2 * propagator_integral(scan.mmed, scan.mdm, gamma)
+        elif method == 'hadronic_xsec_monox' :
+            factors = gq**2 * gdm**2 * self.hadronic_integrals(scan, gamma,
+                n_workers=n_workers, chunk_size=chunk_size, cache=cache, engine=engine)
+        elif method == 'hadronic_table' :
+            table.check_compatible(scan)
+            factors = gq**2 * gdm**2 * table.integrals(scan._coupling, scan.mmed, scan.mdm, gamma)
+        elif method == 'parton_level_xsec_monox' :
+            factors = gq**2 * gdm**2 * scan.parton_level_integrals(scan.mmed, scan.mdm, gamma, vectorised=vectorised)
+        else :
+            print("Unrecognized rescaling method",method,"!")
+            print("Choose from:",list(self._method_groups.keys()))
+            exit(1)
+
+        return factors, gamma
+
+    @profiled
+    def hadronic_integrals(self, scan, gamma, engine='nquad', **options) :
+        '''
+        Hadron-level integrals (without couplings) for the model of scan at its
+        mass points and the widths gamma; options go to DMModelScan.hadron_level_integrals.
+        Those of the reference scan are kept. Targets of the reference model on
+        its mass points share its masses and differ only in width, so wherever a
+        target width is exactly the reference one, the kept integral is used,
+        and only the other points are integrated.
+        '''
+        reference = self.reference_scan
+        if scan is reference :
+            integrals = scan.hadron_level_integrals(scan._hadronic_integrand, scan.mmed, scan.mdm, gamma, engine=engine, **options)
+            self._reference_integrals[engine] = (np.asarray(gamma, dtype=float), integrals)
+            return integrals
+
+        known = self._reference_integrals.get(engine)
+        if known is None or scan._coupling != reference._coupling or scan.pdf_settings() != reference.pdf_settings() \
+            or not (np.array_equal(scan.mmed, reference.mmed) and np.array_equal(scan.mdm, reference.mdm)) :
+            return scan.hadron_level_integrals(scan._hadronic_integrand, scan.mmed, scan.mdm, gamma, engine=engine, **options)
+
+        mmed, mdm, gamma, reference_gamma, reference_integrals = np.broadcast_arrays(scan.mmed, scan.mdm, gamma, *known)
+        new = gamma != reference_gamma
+        integrals = np.array(reference_integrals, dtype=float)
+        profiling.count("rescaler.reused_reference_integrals", int(np.count_nonzero(~new)))
+        if new.any() :
+            integrals[new] = scan.hadron_level_integrals(scan._hadronic_integrand, mmed[new], mdm[new], gamma[new], engine=engine, **options)
+        return integrals
+
+    # Options that change how factors are computed, but not their values.
+    _execution_options = ("n_workers", "chunk_size", "cache")
+
+    def reference_factors(self, method, **options) :
+        '''
+        cross_section_factors for the reference scan and its own couplings.
+        Computed on first use for each method and set of options, and kept.
+        '''
+        # Tables are told apart by identity; each entry holds on to its table,
+        # so that id cannot be reused by another.
+        key = (method,) + tuple(sorted((name, id(value) if name == "table" else value)
+            for name, value in options.items() if name not in self._execution_options))
+        if key not in self._reference_factors :
+            factors, _ = self.cross_section_factors(self.reference_scan, method,
+                self.reference_scan.gq, self.reference_scan.gdm, self.reference_scan.gl, **options)
+            factors = np.asarray(factors)
+            factors.flags.writeable = False
+            self._reference_factors[key] = (options.get("table"), factors)
+        return self._reference_factors[key][1]
+
+    @profiled
+    def target_exclusion_depths(self, method, model, target_gq, target_gdm, target_gl, reference_factor=None, **options) :
+        '''
+        Exclusion depths at the reference mass points for each coupling combination
+        (target_gq[i], target_gdm[i], target_gl[i]), one row per combination.
+        method is a rescale_by_ method name without the prefix; options are passed
+        to cross_section_factors. Memory scales with n_couplings x n_masses only
+        through the output and the per-point widths: the kinematic factors are
+        computed once per model.
+        reference_factor (from reference_factors) can be passed in, but is
+        otherwise only computed once anyway.
+        '''
+        self.check_models_methods(self._method_groups[method],model)
+
+        # The reference first, so that targets can reuse its integrals.
+        if reference_factor is None :
+            reference_factor = self.reference_factors(method, **options)
+        # Couplings as columns, to broadcast against the mass points.
+        columns = [np.asarray(g, dtype=float).reshape(-1,1) for g in (target_gq, target_gdm, target_gl)]
+        target_factors, target_gamma = self.cross_section_factors(self.target_prototype(model), method, *columns, **options)
+        scale_factors = target_factors / reference_factor
+
+        # Go to actual limits, selecting for widths
+        widths_scan = target_gamma/self.reference_scan.mmed
+
+        # And actually turn this into exclusion depths - fewer ways for user to be confused.
+        # When multiple exclusion depth planes supplied, the one to scale is the one corresponding
+        # to the width of the point being tested (or interpolated from them).
+        observed_limits = self.pick_appropriate_limit(widths_scan)
+        return observed_limits/scale_factors
+
+    @profiled
     def pick_appropriate_limit(self, test_widths) :
         # Linear interpolate between observed limits at points of interest.
         # If smaller width than smallest provided, use smallest provided.
         # If larger than largest provided, no limit can be set.
-        appropriate_limits = []
-        for width, limits in zip(test_widths,self.exclusion_depths.transpose()) :
-            #print("Width is",width,"compared to given values",self.widths)
-            appropriate_observed = np.interp([width], self.widths, limits,left=limits[0],right=math.nan)
-            #print("Selected limit",appropriate_observed[0])
-            appropriate_limits.append(appropriate_observed[0])
-        return np.array(appropriate_limits)
+        # Works on one row of widths per coupling combination at once.
+        return interpolate_in_width(test_widths, self.widths, self.exclusion_depths)
 
     def format_output(self, scale_factors, target_arrays) :
 
-        # Squish output down to a manageable format.
-        # Return: {tuple of couplings : [scale factor per mass point]}
+        # Squish output down to a manageable format: a RescaleResult,
+        # which holds everything in one array but can still be used
+        # as {tuple of couplings : [scale factor per mass point]}.
+        result = RescaleResult.from_target_arrays(scale_factors, target_arrays,
+            mmed=self.reference_scan.mmed, mdm=self.reference_scan.mdm)
+        if result is not None : return result
+
+        # Couplings that are not a full grid (e.g. one block from iter_rescale)
+        # go into a plain dict of that form instead.
         output_dict = {}
         for i in range(np.shape(target_arrays)[1]) :
             gq, gdm, gl = target_arrays[:,i]
@@ -144,179 +288,159 @@ class Rescaler(abc.ABC):
 
         return output_dict
 
+    def iter_rescale(self, method, target_gq, target_gdm, target_gl, model=None, chunk_size=None, sink=None, **options) :
+        '''
+        Generator version of the rescale_by_ methods, for coupling grids too large
+        to hold in memory at once. method is the rescale_by_ method name without the
+        prefix (e.g. 'propagator'); options are that method's extra arguments,
+        such as table for 'hadronic_table'.
+        The same combinations of couplings as in create_target_arrays are taken
+        chunk_size at a time (default: enough to make about a million exclusion depths),
+        and for each chunk this yields (couplings, depths): couplings has the layout of
+        create_target_arrays, shape (3, n), and depths has one row of exclusion depths
+        per combination. format_output(depths, couplings) turns a block
+        into a dict of the form returned by the rescale_by_ methods.
+        If sink is given, each block is also passed to sink(couplings, depths)
+        as soon as it is made; see rescale_to_sink.
+        '''
+        if not model : model = self.reference_scan._coupling
+        if method not in self._method_groups :
+            print("Unrecognized rescaling method",method,"!")
+            print("Choose from:",list(self._method_groups.keys()))
+            exit(1)
+        self.check_models_methods(self._method_groups[method],model)
+
+        target_gq, target_gdm, target_gl = [unique_in_order(g) for g in (target_gq, target_gdm, target_gl)]
+        n_masspoints = np.size(self.reference_scan.mmed)
+        if not chunk_size : chunk_size = max(1, 1000000 // n_masspoints)
+
+        # Same ordering as the meshgrid in create_target_arrays,
+        # but only ever unpacking one chunk of the flattened grid.
+        grid_shape = (len(target_gq), len(target_gdm), len(target_gl))
+        n_couplings = int(np.prod(grid_shape))
+
+        # Only needs doing once for all chunks.
+        reference_factor = self.reference_factors(method, **options)
+
+        for start in range(0, n_couplings, chunk_size) :
+            i_gq, i_gdm, i_gl = np.unravel_index(np.arange(start, min(start+chunk_size, n_couplings)), grid_shape)
+            couplings = np.array([target_gq[i_gq], target_gdm[i_gdm], target_gl[i_gl]])
+            depths = self.target_exclusion_depths(method, model, *couplings, reference_factor=reference_factor, **options)
+            if sink is not None : sink(couplings, depths)
+            yield couplings, depths
+
+    def rescale_to_sink(self, sink, method, target_gq, target_gdm, target_gl, model=None, chunk_size=None, **options) :
+        '''
+        Runs iter_rescale to completion, handing each block to sink(couplings, depths)
+        and keeping nothing: e.g. a function writing to disk.
+        Returns the number of coupling combinations processed.
+        '''
+        n_couplings = 0
+        for couplings, depths in self.iter_rescale(method, target_gq, target_gdm, target_gl,
+            model=model, chunk_size=chunk_size, sink=sink, **options) :
+            n_couplings += np.size(couplings,1)
+        return n_couplings
+
+    @profiled
     def rescale_by_br_quarks(self,target_gq, target_gdm, target_gl, model=None) :
         '''Rescale according to gq^2 * BR(med->DM DM). All possible
         combinations of specified couplings will be tested and
         results will be returned along with the coupling values they correspond to.'''
         
-        # Check that this method of rescaling makes sense for the
-        # target and reference scan types:
+        # Checks that this method of rescaling makes sense for the
+        # target and reference scan types are done in target_exclusion_depths.
         if not model : model = self.reference_scan._coupling
-        self.check_models_methods("BR",model)
 
-        # Create a target scan that has the enormous dimensionality required
-        # to broadcast across the full set of scanned values
+        # One row per combination of target couplings, and one column per mass point.
         target_arrays = self.create_target_arrays(target_gq, target_gdm, target_gl)
-        target_scan = self.create_target_scan(model, target_arrays)
-
-        # Calculate scale factor at each point.
-        reference_factor = self.reference_scan.mediator_partial_width_quarks() ** 2 / self.reference_scan.mediator_total_width()
-        target_factors_1d = target_scan.mediator_partial_width_quarks() ** 2 / target_scan.mediator_total_width()
-
-        # Reshape to have one row per coupling
-        target_factors = np.reshape(target_factors_1d,(np.size(target_arrays,1),-1))       
-        # Now this is also broadcastable
-        scale_factors = target_factors / reference_factor
-
-        # Go to actual limits, selecting for widths
-        widths_scan = target_scan.mediator_total_width()/target_scan.mmed
-
-        # And actually turn this into exclusion depths - fewer ways for user to be confused.
-        # When multiple exclusion depth planes supplied, the one to scale is the one corresponding
-        # to the width of the point being tested (or interpolated from them).
-        observed_limits = self.pick_appropriate_limit(widths_scan)
-        exclusion_depth = observed_limits/scale_factors
+        exclusion_depth = self.target_exclusion_depths('br_quarks', model, *target_arrays)
 
         return self.format_output(exclusion_depth,target_arrays)
 
+    @profiled
     def rescale_by_br_leptons(self, target_gq, target_gdm, target_gl,model=None):
         '''Rescale according to gq^2 * BR(med->DM DM). All possible
         combinations of specified couplings will be tested and
         results will be returned along with the coupling values they correspond to.'''
         
-        # Check that this method of rescaling makes sense for the
-        # target and reference scan types:
+        # Checks that this method of rescaling makes sense for the
+        # target and reference scan types are done in target_exclusion_depths.
         if not model : model = self.reference_scan._coupling
-        self.check_models_methods("BR",model)
 
-        # Create a target scan that has the enormous dimensionality required
-        # to broadcast across the full set of scanned values
         target_arrays = self.create_target_arrays(target_gq, target_gdm, target_gl)
-        target_scan = self.create_target_scan(model, target_arrays)
-
-        # Calculate scale factor at each point.
-        reference_factor = self.reference_scan.mediator_partial_width_quarks() * self.reference_scan.mediator_partial_width_leptons() / self.reference_scan.mediator_total_width()
-        target_factors_1d = target_scan.mediator_partial_width_quarks() * target_scan.mediator_partial_width_leptons() / target_scan.mediator_total_width()
+        exclusion_depth = self.target_exclusion_depths('br_leptons', model, *target_arrays)
 
-        # Reshape to have one row per coupling
-        target_factors = np.reshape(target_factors_1d,(np.size(target_arrays,1),-1))       
-        # Now this is also broadcastable        
-        scale_factors = target_factors / reference_factor
+        return self.format_output(exclusion_depth,target_arrays)
 
-        # Go to actual limits, selecting for widths
-        widths_scan = target_scan.mediator_total_width()/target_scan.mmed
+    @profiled
+    def rescale_by_propagator(self,target_gq, target_gdm, target_gl, model=None):
+        # Checks that this method of rescaling makes sense for the
+        # target and reference scan types are done in target_exclusion_depths.
+        if not model : model = self.reference_scan._coupling
 
-        # And actually turn this into exclusion depths - fewer ways for user to be confused.
-        # When multiple exclusion depth planes supplied, the one to scale is the one corresponding
-        # to the width of the point being tested (or interpolated from them).
-        observed_limits = self.pick_appropriate_limit(widths_scan)
-        exclusion_depth = observed_limits/scale_factors
+        target_arrays = self.create_target_arrays(target_gq, target_gdm, target_gl)
+        exclusion_depth = self.target_exclusion_depths('propagator', model, *target_arrays)
 
         return self.format_output(exclusion_depth,target_arrays)
 
-    def rescale_by_propagator(self,target_gq, target_gdm, target_gl, model=None):
-        # Check that this method of rescaling makes sense for the
-        # target and reference scan types:
+    @profiled
+    def rescale_by_hadronic_xsec_monox(self,target_gq, target_gdm, target_gl, model=None, n_workers=1, chunk_size=None, cache=None, engine='nquad'):
+        '''Rescale using hadronic-level cross sections.
+        The integrals can be spread over a pool of n_workers processes
+        (None for one per core), each handed chunk_size mass points at a time.
+        Passing an IntegralCache reuses integrals computed in earlier calls or sessions,
+        including those of the reference scan.
+        engine='batch' runs the integration in compiled code instead of scipy nquad,
+        much faster, and engine='luminosity' integrates against a tabulated parton
+        luminosity, faster still; see DMModelScan.hadron_level_integrals.'''
+
+        # Checks that this method of rescaling makes sense for the
+        # target and reference scan types are done in target_exclusion_depths.
         if not model : model = self.reference_scan._coupling
-        self.check_models_methods("propagator",model)
 
-        # Create a target scan that has the dimensionality required
-        # to broadcast across the full set of scanned values
         target_arrays = self.create_target_arrays(target_gq, target_gdm, target_gl)
-        target_scan = self.create_target_scan(model, target_arrays)        
-        
-        # Calculate scale factor at each point
-        reference_factor = self.reference_scan.propagator_relative()
-        target_factors_1d = target_scan.propagator_relative()
-
-        # Reshape to have one row per coupling
-        target_factors = np.reshape(target_factors_1d,(np.size(target_arrays,1),-1))       
-        # Now this is also broadcastable        
-        scale_factors = target_factors / reference_factor        
         
-        # Go to actual limits, selecting for widths
-        widths_scan = target_scan.mediator_total_width()/target_scan.mmed
+        if np.size(target_arrays,1) > 1 and engine == 'nquad' :
+            print("""Warning: the hadronic rescaling method takes a long time!
+            We don't recommend that you use it for more than one target coupling scenario.
+            Instead, try rescaling to a single target and then using the propagator scaling method
+            to arrive at additional scenarios.""")
 
-        # And actually turn this into exclusion depths - fewer ways for user to be confused.
-        # When multiple exclusion depth planes supplied, the one to scale is the one corresponding
-        # to the width of the point being tested (or interpolated from them).
-        observed_limits = self.pick_appropriate_limit(widths_scan)
-        exclusion_depth = observed_limits/scale_factors
+        exclusion_depth = self.target_exclusion_depths('hadronic_xsec_monox', model, *target_arrays,
+            n_workers=n_workers, chunk_size=chunk_size, cache=cache, engine=engine)
 
         return self.format_output(exclusion_depth,target_arrays)
 
-    def rescale_by_hadronic_xsec_monox(self,target_gq, target_gdm, target_gl, model=None):
-        '''Rescale using hadronic-level cross sections.'''
+    @profiled
+    def rescale_by_hadronic_table(self, table, target_gq, target_gdm, target_gl, model=None):
+        '''Rescale using hadronic-level cross sections interpolated from a HadronicTable
+        (see couplingscan.tables), which must hold both the reference and target models.
+        Much faster than rescale_by_hadronic_xsec_monox, at the price of the
+        table's interpolation error.'''
 
-        # Check that this method of rescaling makes sense for the
-        # target and reference scan types:
+        # Checks that this method of rescaling makes sense for the
+        # target and reference scan types are done in target_exclusion_depths.
         if not model : model = self.reference_scan._coupling
-        self.check_models_methods("hadron-level",model)
 
-        # Create a target scan that has the dimensionality required
-        # to broadcast across the full set of scanned values
         target_arrays = self.create_target_arrays(target_gq, target_gdm, target_gl)
-        target_scan = self.create_target_scan(model, target_arrays)        
-        
-        for this_array in target_arrays :
-            if (this_array == np.ndarray and len(this_array) > 1) :
-                print("""Warning: the hadronic rescaling method takes a long time!
-                We don't recommend that you use it for more than one target coupling scenario.
-                Instead, try rescaling to a single target and then using the propagator scaling method
-                to arrive at additional scenarios.""")
-
-        # Calculate scale factor at each point
-        reference_factor = self.reference_scan.hadron_level_xsec_monox_relative()
-        target_factors_1d = target_scan.hadron_level_xsec_monox_relative()
-
-        # Reshape to have one row per coupling
-        target_factors = np.reshape(target_factors_1d,(np.size(target_arrays,1),-1))       
-        # Now this is also broadcastable        
-        scale_factors = target_factors / reference_factor        
-        
-        # Go to actual limits, selecting for widths
-        widths_scan = target_scan.mediator_total_width()/target_scan.mmed
-
-        # And actually turn this into exclusion depths - fewer ways for user to be confused.
-        # When multiple exclusion depth planes supplied, the one to scale is the one corresponding
-        # to the width of the point being tested (or interpolated from them).
-        observed_limits = self.pick_appropriate_limit(widths_scan)
-        exclusion_depth = observed_limits/scale_factors
+        exclusion_depth = self.target_exclusion_depths('hadronic_table', model, *target_arrays, table=table)
 
         return self.format_output(exclusion_depth,target_arrays)
 
-    def rescale_by_parton_level_xsec_monox(self,target_gq, target_gdm, target_gl, model=None):
-        '''Rescale using parton-level cross sections.'''
+    @profiled
+    def rescale_by_parton_level_xsec_monox(self,target_gq, target_gdm, target_gl, model=None, vectorised=False):
+        '''Rescale using parton-level cross sections.
+        vectorised=True integrates all points at once with a fixed quadrature rule,
+        which is much faster and does not need LHAPDF.'''
 
         print('''Warning: the parton-level cross section is not the best-performing rescaling method
         in any hadron collider scenario. Consider using something else!''')
 
-        # Check that this method of rescaling makes sense for the
-        # target and reference scan types:
+        # Checks that this method of rescaling makes sense for the
+        # target and reference scan types are done in target_exclusion_depths.
         if not model : model = self.reference_scan._coupling
-        self.check_models_methods("parton-level",model)
 
-        # Create a target scan that has the dimensionality required
-        # to broadcast across the full set of scanned values
         target_arrays = self.create_target_arrays(target_gq, target_gdm, target_gl)
-        target_scan = self.create_target_scan(model, target_arrays)        
-        
-        # Calculate scale factor at each point
-        reference_factor = self.reference_scan.parton_level_xsec_monox_relative()
-        target_factors_1d = target_scan.parton_level_xsec_monox_relative()
-
-        # Reshape to have one row per coupling
-        target_factors = np.reshape(target_factors_1d,(np.size(target_arrays,1),-1))       
-        # Now this is also broadcastable        
-        scale_factors = target_factors / reference_factor        
-        
-        # Go to actual limits, selecting for widths
-        widths_scan = target_scan.mediator_total_width()/target_scan.mmed
-
-        # And actually turn this into exclusion depths - fewer ways for user to be confused.
-        # When multiple exclusion depth planes supplied, the one to scale is the one corresponding
-        # to the width of the point being tested (or interpolated from them).
-        observed_limits = self.pick_appropriate_limit(widths_scan)
-        exclusion_depth = observed_limits/scale_factors
+        exclusion_depth = self.target_exclusion_depths('parton_level_xsec_monox', model, *target_arrays, vectorised=vectorised)
 
-        return self.format_output(exclusion_depth,target_arrays)
\ No newline at end of file
+        return self.format_output(exclusion_depth,target_arrays)
@@ -0,0 +1,164 @@
+from collections.abc import Mapping
+from dataclasses import dataclass
+import itertools
+
+import numpy as np
+
+from couplingscan.contours import contours
+
+# Results of rescaling to a grid of target couplings.
+# Exclusion depths for every (gq, gdm, gl) combination live in one array,
+# so selections across couplings are plain array indexing rather than
+# loops over a dict.
+
+def unique_in_order(values) :
+    '''
+    Distinct values of a coupling in the order they first appear, as a float array.
+    '''
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    return np.array(list(dict.fromkeys(values.tolist())), dtype=float)
+
+@dataclass(eq=False)
+class RescaleResult(Mapping) :
+    '''
+    Exclusion depths on a grid of target couplings, as one array of shape
+    (n_gq, n_gdm, n_gl, n_mass) with coordinate axes gq, gdm and gl,
+    and the mass points mmed and mdm the last axis runs over.
+    Also behaves as the dict {(gq, gdm, gl) : depths} that the Rescaler used to
+    return, except that lookups only need the couplings to match to within
+    floating point tolerance. Values returned are views into the array.
+    '''
+    gq: np.ndarray
+    gdm: np.ndarray
+    gl: np.ndarray
+    depths: np.ndarray
+    mmed: np.ndarray = None
+    mdm: np.ndarray = None
+
+    # Tolerance for matching requested couplings to the axes.
+    rtol = 1e-9
+    atol = 1e-12
+
+    @classmethod
+    def from_target_arrays(cls, depths, target_arrays, mmed=None, mdm=None) :
+        '''
+        Builds a result from the flat layout used inside the Rescaler:
+        target_arrays of shape (3, n_couplings) as made by create_target_arrays,
+        and depths with one row per coupling combination.
+        Returns None if the couplings do not form a full grid in that order.
+        '''
+        axes = [unique_in_order(row) for row in target_arrays]
+        shape = tuple(len(axis) for axis in axes)
+        if int(np.prod(shape)) != np.size(target_arrays,1) : return None
+        grid = np.array(np.meshgrid(*axes, indexing='ij')).reshape(3,-1)
+        if not np.array_equal(grid, np.asarray(target_arrays, dtype=float)) : return None
+        depths = np.asarray(depths)
+        return cls(*axes, depths=depths.reshape(shape + depths.shape[1:]), mmed=mmed, mdm=mdm)
+
+    def axes(self) :
+        return (self.gq, self.gdm, self.gl)
+
+    def _index(self, axis, value) :
+        # Position of value on one coupling axis, within tolerance.
+        matches = np.flatnonzero(np.isclose(axis, value, rtol=self.rtol, atol=self.atol))
+        if not len(matches) :
+            raise KeyError(value)
+        return matches[0]
+
+    def _indices(self, axis, value) :
+        # None keeps the whole axis, a scalar picks out (and drops) one entry,
+        # and a list or array of values picks out several.
+        if value is None : return slice(None)
+        if np.ndim(value) == 0 : return self._index(axis, value)
+        return np.array([self._index(axis, v) for v in value])
+
+    def sel(self, gq=None, gdm=None, gl=None) :
+        '''
+        Exclusion depths for the given coupling values; each can be a single
+        value, a list of values, or None for all of them.
+        Selecting only single values or whole axes returns a view.
+        '''
+        index = [self._indices(axis, value) for axis, value in zip(self.axes(), (gq, gdm, gl))]
+        # Lists on more than one axis should select their outer product,
+        # not pair up elementwise as numpy fancy indexing would.
+        arrays = [i for i, entry in enumerate(index) if isinstance(entry, np.ndarray)]
+        if len(arrays) > 1 :
+            result = self.depths
+            for axis in reversed(range(3)) :
+                if isinstance(index[axis], np.ndarray) :
+                    result = np.take(result, index[axis], axis=axis)
+                    index[axis] = slice(None)
+            return result[tuple(index)]
+        return self.depths[tuple(index)]
+
+    def nearest(self, gq, gdm, gl) :
+        '''
+        Exclusion depths for the grid point closest to the given couplings,
+        taking the closest value on each axis separately.
+        '''
+        index = tuple(int(np.argmin(np.abs(axis - value))) for axis, value in zip(self.axes(), (gq, gdm, gl)))
+        return self.depths[index]
+
+    def interp(self, gq, gdm, gl) :
+        '''
+        Exclusion depths interpolated multilinearly in the couplings.
+        Couplings on a grid value, to within the lookup tolerance, give that
+        grid point's depths. Axes with a single value only accept that value.
+        Anything outside the grid gives NaN.
+        '''
+        corners = []
+        for axis, value in zip(self.axes(), (gq, gdm, gl)) :
+            # On a grid value (within the lookup tolerance), use that node alone,
+            # so that a NaN at the next one (e.g. beyond the largest width)
+            # does not leak in with zero weight.
+            matches = np.flatnonzero(np.isclose(axis, value, rtol=self.rtol, atol=self.atol))
+            if len(matches) :
+                corners.append([(matches[0], 1.)])
+                continue
+            order = np.argsort(axis)
+            sorted_axis = axis[order]
+            if len(axis) == 1 or value < sorted_axis[0] or value > sorted_axis[-1] :
+                return np.full(self.depths.shape[3:], np.nan)
+            upper = int(np.searchsorted(sorted_axis, value, side='right'))
+            t = (value - sorted_axis[upper-1])/(sorted_axis[upper] - sorted_axis[upper-1])
+            corners.append([(order[upper-1], 1. - t), (order[upper], t)])
+
+        result = np.zeros(self.depths.shape[3:])
+        for (i, wi), (j, wj), (k, wk) in itertools.product(*corners) :
+            result = result + wi*wj*wk*self.depths[i,j,k]
+        return result
+
+    def contours(self, level=1.) :
+        '''
+        Exclusion contours (depth = level) in the (mmed, mdm) plane for every
+        coupling combination, as {(gq, gdm, gl) : list of (n, 2) vertex arrays}.
+        See couplingscan.contours.contours.
+        '''
+        if self.mmed is None or self.mdm is None :
+            print("Error: this result does not hold the mass points, so it has no contours!")
+            exit(1)
+        lines = contours(self.mmed, self.mdm, self.depths, level)
+        return dict(zip(self, lines))
+
+    def to_dict(self) :
+        '''
+        The old {(gq, gdm, gl) : depths} output as a plain dict.
+        '''
+        return dict(self.items())
+
+    def __getitem__(self, key) :
+        gq, gdm, gl = key
+        return self.depths[self._index(self.gq, gq), self._index(self.gdm, gdm), self._index(self.gl, gl)]
+
+    def __iter__(self) :
+        return itertools.product(self.gq, self.gdm, self.gl)
+
+    def __len__(self) :
+        return len(self.gq) * len(self.gdm) * len(self.gl)
+
+    def __contains__(self, key) :
+        try :
+            self[key]
+        except (KeyError, TypeError, ValueError) :
+            return False
+        return True
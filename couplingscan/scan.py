@@ -2,15 +2,15 @@ from dataclasses import dataclass
 from enum import Enum
 import numpy as np
 import abc
-import imp
-import scipy.integrate as integrate
+import warnings
 
-# Check if lhapdf was available at compile time. 
-try:
-    imp.find_module('lhapdfwrap')
-    hasLHAPDF = True
-except:
-    hasLHAPDF = False
+from couplingscan import pdf, profiling, luminosity
+from couplingscan.profiling import profiled
+from couplingscan.pdf import hasLHAPDF
+from couplingscan.luminosity import get_luminosity_table
+
+from couplingscan.integration import hadronic_opts_x1, hadronic_opts_x2, hadronic_limit_x1, hadronic_limit_x2, \
+    hadronic_integrals, hadronic_integrals_parallel, parton_integrals_vectorised, parton_integrands
 
 PI = np.pi
 
@@ -48,6 +48,73 @@ def beta(x, y):
     yc = y.astype(complex)
     return np.real(np.sqrt(1 - 4 * xc**2 / yc**2))
 
+def threshold(mmed, mass, width):
+    """
+    Partial width for a mediator decaying to a pair of particles of the given mass:
+    zero below threshold, width above it, NaN where mmed is undefined.
+    mass may be a column of several final states, in which case
+    the result has one row per final state.
+    """
+    return np.select([mmed < 2*mass, mmed >= 2*mass], [0, width], default=np.nan)
+
+# Final state masses as columns, so that all of them
+# broadcast against the mass points in one go.
+quark_masses = np.array([mq.value for mq in Quarks])[:,None]
+lepton_masses = np.array([ml.value for ml in Leptons])[:,None]
+
+def propagator_integral(mmed, mdm, gamma):
+    """
+    Integral of the full vector or axial-vector propagator expression
+    above the DM pair threshold, without couplings.
+    """
+    arctan_factor = PI/2.0 + np.arctan((mmed**2 - 4.*mdm**2)/(mmed*gamma))
+    return arctan_factor/(mmed*gamma)
+
+def on_distinct_values(function, values):
+    """
+    function(values) for an elementwise function, evaluated only once per
+    distinct value and broadcast back: on an (mmed, mdm) product grid,
+    something depending on mmed alone costs sqrt(N) rather than N evaluations.
+    function may return an array or a dict of arrays, with the values along
+    the last axis (any leading axes, e.g. one row per width, are kept).
+    """
+    values = np.asarray(values, dtype=float)
+    distinct, inverse = np.unique(values.ravel(), return_inverse=True)
+    if len(distinct) == values.size : return function(values)
+    result = function(distinct)
+    expand = lambda x : np.asarray(x)[..., inverse.ravel()].reshape(np.shape(x)[:-1] + values.shape)
+    if isinstance(result, dict) :
+        return {key : expand(value) for key, value in result.items()}
+    return expand(result)
+
+@dataclass
+class WidthBasis:
+    '''
+    Coupling-independent kinematic factors of a model's partial widths,
+    computed once for a set of mass points. Each partial width is one factor
+    times the square of its coupling, so widths for any couplings are just
+    a rescaling of these.
+    Couplings broadcast against the mass points: pass columns of shape
+    (n_couplings, 1) to get one row of widths per coupling combination
+    without repeating the mass grid.
+    '''
+    factors: dict
+    channel_couplings: dict
+
+    def partial_widths(self, gq, gdm, gl):
+        '''
+        Partial widths for each decay channel, as a dict.
+        '''
+        couplings = {"gq" : gq, "gdm" : gdm, "gl" : gl}
+        return {channel : np.asarray(couplings[self.channel_couplings[channel]], dtype=float)**2 * factor
+            for channel, factor in self.factors.items()}
+
+    def total_width(self, gq, gdm, gl):
+        '''
+        Sum of the partial widths.
+        '''
+        return sum(self.partial_widths(gq, gdm, gl).values())
+
 @dataclass
 class DMModelScan(abc.ABC):
     '''
@@ -64,18 +131,37 @@ class DMModelScan(abc.ABC):
 
     ECM: float = 13000.**2
 
-    # Note: only doing up and down PDFs because I tested
-    # with all 4 light quarks and saw no discernable difference.
-    # If needed, increase here.
-    _nquarks_pdf: int = 2
-
-    # Initialise handler for lhapdfwrap if compiled
-    # with lhapdf available.
-    # To determine reliably from here, check for generated file.
-    _wrapper = None
-    if (hasLHAPDF) :
-        import lhapdfwrap as pdfwrap
-        _wrapper = pdfwrap.IntegrandHandler("NNPDF30_nlo_as_0118", ECM)
+    # PDF set (LHAPDF name) and member for the hadron-level integrals.
+    # None takes the process-wide default (see couplingscan.pdf.set_default_pdf)
+    # when the scan is created.
+    pdfset: str = None
+    pdf_member: int = None
+
+    # Quark flavours (PDG ids, 1 to 6) whose q qbar luminosity enters the
+    # hadron-level integrals. Only down quarks by default, which is all
+    # the integrals have ever included: the cross sections are only used as
+    # ratios between scenarios, and including all 4 light quarks made
+    # no discernable difference to those. Pass e.g. flavours=(1,2,3,4) to add more.
+    flavours: tuple = (1,)
+
+    @property
+    def _pdf_label(self) :
+        return pdf.pdf_label(self.pdfset, self.pdf_member)
+
+    # Handler for lhapdfwrap if compiled with lhapdf available, else None.
+    # The PDF is only loaded on first use, then shared by every scan
+    # in the process with the same set, member and ECM.
+    @property
+    def _wrapper(self) :
+        if not hasLHAPDF : return None
+        return pdf.get_handler(self.pdfset, self.pdf_member, self.ECM)
+
+    def pdf_settings(self) :
+        '''
+        ECM, PDF set, member and flavours of this scan, as keyword arguments
+        for making other scans that should be integrated the same way.
+        '''
+        return {"ECM" : self.ECM, "pdfset" : self.pdfset, "pdf_member" : self.pdf_member, "flavours" : self.flavours}
 
     def __post_init__(self):
 
@@ -86,7 +172,7 @@ class DMModelScan(abc.ABC):
             attrval = getattr(self,attr)
             if isinstance(attrval,list) :
                 setattr(self,attr,np.array(attrval,dtype=float))
-            elif type(attrval) is not np.ndarray :
+            elif not isinstance(attrval,np.ndarray) :
                 setattr(self,attr,np.array([attrval],dtype=float))
             else :
                 setattr(self,attr,attrval.astype(float))
@@ -105,17 +191,119 @@ class DMModelScan(abc.ABC):
             print("Couplings arrays must either be the same length as mass arrays or hold exactly 1 value")
             exit(1)
 
+        # Fix the PDF now, so that changing the default later
+        # does not change what this scan integrates.
+        if self.pdfset is None : self.pdfset = pdf.default_pdfset()
+        if self.pdf_member is None : self.pdf_member = pdf.default_member()
+        self.pdf_member = int(self.pdf_member)
+        self.ECM = float(self.ECM)
+        flavours = sorted(set(int(pid) for pid in np.atleast_1d(self.flavours)))
+        if not flavours or not all(1 <= pid <= 6 for pid in flavours) :
+            print("Error: flavours must be quark PDG ids from 1 to 6, not",self.flavours)
+            exit(1)
+        self.flavours = tuple(flavours)
+
+        # Widths are cached, so the inputs can only be changed by
+        # assigning new arrays (which clears the cache), not in place.
+        for attr in ["mmed", "mdm", "gq", "gdm", "gl"] :
+            getattr(self,attr).flags.writeable = False
+
+    def __setattr__(self, name, value):
+        # Drop cached widths whenever something they depend on is replaced.
+        # Kinematic factors only depend on the masses.
+        if name in ["mmed", "mdm"] :
+            self.__dict__.pop("_kinematics_cache", None)
+            self.__dict__.pop("_width_cache", None)
+        elif name in ["gq", "gdm", "gl"] :
+            self.__dict__.pop("_width_cache", None)
+        object.__setattr__(self, name, value)
+
+    # Which coupling multiplies each decay channel.
+    _channel_couplings = {"quarks" : "gq", "dm" : "gdm", "leptons" : "gl", "gluon" : "gq"}
+
     @abc.abstractmethod
-    def mediator_total_width(self):
+    def mediator_factors(self, mmed):
+        '''
+        Coupling-independent parts of the partial widths to SM particles
+        at mediator masses mmed, as a dict keyed by decay channel.
+        '''
         pass
 
     @abc.abstractmethod
-    def mediator_partial_width_quarks(self):
+    def dm_factor(self, mmed, mdm):
+        '''
+        Coupling-independent part of the partial width to DM DM.
+        '''
         pass
 
-    @abc.abstractmethod
+    def kinematic_factors(self):
+        '''
+        Coupling-independent parts of the partial widths, as a dict
+        keyed by decay channel. Each partial width is one of these
+        times the square of the coupling in _channel_couplings.
+        '''
+        # Only the DM DM width depends on mdm. Mass grids usually repeat each
+        # mmed value once per mdm value, so the rest, which is most of the
+        # work, is done once per distinct mmed. DM DM depends on mdm/mmed,
+        # which is rarely repeated, so it is done point by point.
+        mediator = on_distinct_values(self.mediator_factors, self.mmed)
+        # Same channel order as ever, so total widths are summed the same way.
+        return {"quarks" : mediator.pop("quarks"), "dm" : self.dm_factor(self.mmed, self.mdm), **mediator}
+
+    @profiled
+    def width_basis(self):
+        '''
+        WidthBasis for this scan's mass points, computed on first use
+        and kept until the masses change.
+        '''
+        if "_kinematics_cache" not in self.__dict__ :
+            factors = self.kinematic_factors()
+            for value in factors.values() :
+                value.flags.writeable = False
+            self.__dict__["_kinematics_cache"] = WidthBasis(factors, self._channel_couplings)
+        return self._kinematics_cache
+
+    def _widths(self):
+        '''
+        Partial widths, total width and branching ratios, computed together
+        on first use and kept until the masses or couplings change.
+        '''
+        if "_width_cache" not in self.__dict__ :
+            widths = self.width_basis().partial_widths(self.gq, self.gdm, self.gl)
+            total = sum(widths.values())
+            with np.errstate(divide='ignore', invalid='ignore') :
+                branching_ratios = {channel : width/total for channel, width in widths.items()}
+            widths["total"] = total
+            for value in list(widths.values()) + list(branching_ratios.values()) :
+                value.flags.writeable = False
+            widths["branching_ratios"] = branching_ratios
+            self.__dict__["_width_cache"] = widths
+        return self._width_cache
+
+    @profiled
+    def mediator_total_width(self):
+        return self._widths()["total"]
+
+    @profiled
+    def mediator_partial_width_quarks(self):
+        '''
+        On-shell width for mediator -> q q.
+        '''
+        return self._widths()["quarks"]
+
+    @profiled
     def mediator_partial_width_dm(self):
-        pass
+        '''
+        On-shell width for mediator -> DM DM.
+        '''
+        return self._widths()["dm"]
+
+    @profiled
+    def mediator_branching_ratios(self):
+        '''
+        Branching ratios for each decay channel, as a dict.
+        '''
+        return self._widths()["branching_ratios"]
 
     # "Relative" in function names from here on
     # indicates that these are not full cross sections
@@ -143,34 +331,181 @@ class DMModelScan(abc.ABC):
     # Add the point at which the integrand goes to zero
     # since that's a discontinuity now.
     def opts_x1(self,x2,pid,gamma,M,mDM) :
-        points_list = [M**2/(x2 * self.ECM)]  
-        # Don't both returning ridge location if we're off-shell
-        if (M < 2.*mDM) :
-            return {}
-        else :
-            return {'points' : points_list}
+        return hadronic_opts_x1(self.ECM,x2,pid,gamma,M,mDM)
 
     # Nothing special.
     def opts_x2(self,pid,gamma,M,mDM) :
-        return {}
+        return hadronic_opts_x2(self.ECM,pid,gamma,M,mDM)
 
     def limit_x1(self,x2,pid,gamma,M,mDM) :
         """
         Integration limits for x1, x2 space
         """
-        # Lower limit is actually a curve
-        # Upper limit is 1
-        lower_lim = (4.*mDM**2)/(x2 * self.ECM)
-        return [lower_lim, 1]
+        return hadronic_limit_x1(self.ECM,x2,pid,gamma,M,mDM)
 
     def limit_x2(self,pid,gamma,M,mDM) :
         """
         Integration limits for x1, x2 space
         """    
-        # This is from its smallest value when x1 is largest
-        # and goes up to 1.
-        lower_lim = (4.*mDM**2)/self.ECM
-        return [lower_lim, 1]        
+        return hadronic_limit_x2(self.ECM,pid,gamma,M,mDM)
+
+    @profiled
+    def hadron_level_integrals(self, integrand_name, mmed, mdm, gamma, n_workers=1, chunk_size=None, cache=None, engine='nquad') :
+        '''
+        Hadron-level integrals (without couplings) at the given mass points and widths,
+        using the named IntegrandHandler integrand.
+        With n_workers=1 the points are integrated one at a time in this process.
+        Otherwise they are split into chunks of chunk_size points and farmed out
+        to a pool of n_workers processes (None: one per available core),
+        each of which sets up its own LHAPDF handler.
+        Repeated points are only integrated once.
+        If an IntegralCache is given, only points it does not already hold are integrated,
+        and those results are added to it.
+        engine='batch' instead runs the whole integration inside lhapdfwrap,
+        using n_workers threads (None: one per core) rather than processes.
+        This is far faster than the default scipy nquad, and agrees with it
+        to within the integration tolerance. Points that did not reach it
+        give an IntegrationWarning, as they do with quad.
+        engine='luminosity' integrates the parton-level cross section against
+        a tabulated parton luminosity (see couplingscan.luminosity), for all
+        points at once and without any PDF calls once the table exists.
+        It warns (an IntegrationWarning) about points whose estimated relative
+        error is above couplingscan.luminosity.luminosity_tolerance.
+        '''
+        if engine not in ('nquad', 'batch', 'luminosity') :
+            print("Error: unknown engine",engine,"! Choose from nquad, batch or luminosity.")
+            exit(1)
+        # A luminosity table already on disk needs no LHAPDF.
+        if engine != 'luminosity' and not self._wrapper :
+            raise SystemExit("""You do not have LHAPDF installed! You cannot use this function.""")
+
+        pids = list(self.flavours)
+        # Several flavours are summed inside one integrand, sharing the PDF
+        # evaluations at each (x, Q^2), rather than integrated one at a time.
+        # The batch integrals always do this.
+        pid_args = pids
+        if len(pids) > 1 and engine == 'nquad' :
+            integrand_name = integrand_name + '_flavours'
+            pid_args = [pids]
+        # Points may come in any (broadcastable) shape; integrate them flat.
+        mmed, mdm, gamma = np.broadcast_arrays(mmed, mdm, gamma)
+        shape = mmed.shape
+        # Different couplings often give exactly the same width (gdm wherever
+        # the DM is off shell, gl for models without leptons), so each
+        # distinct (mmed, mdm, gamma) is only integrated once.
+        points, inverse = np.unique(np.stack([mmed.ravel(), mdm.ravel(), gamma.ravel()]), axis=1, return_inverse=True)
+        inverse = inverse.ravel()
+        profiling.count("hadronic.repeated_points", len(inverse) - points.shape[1])
+        mmed, mdm, gamma = points
+        pdf_key = "{0}:{1}".format(self._pdf_label, pids)
+        # Keep results from different integrators apart in the cache
+        # so that ratios are never taken between them.
+        model = self._coupling if engine == 'nquad' else "{0}/{1}".format(self._coupling, engine)
+        if cache is not None :
+            integrals = cache.lookup(model, pdf_key, self.ECM, mmed, mdm, gamma)
+            todo = np.isnan(integrals)
+        else :
+            integrals = np.full(mmed.shape, np.nan)
+            todo = np.ones(mmed.shape, dtype=bool)
+        if not todo.any() : return integrals[inverse].reshape(shape)
+
+        if engine == 'batch' :
+            batch_integral = getattr(self._wrapper,integrand_name.replace('integrand_','integral_'))
+            integrals[todo], converged = batch_integral(mmed[todo],mdm[todo],gamma[todo],pids,nthreads=n_workers if n_workers else 0)
+            profiling.count("hadronic_batch.points", int(np.count_nonzero(todo)))
+            # As for the luminosity engine below: say where the integrals fell short.
+            if not converged.all() :
+                import scipy.integrate as integrate
+                profiling.count("hadronic_batch.points_hit_limit", int(np.count_nonzero(~converged)))
+                warnings.warn("The batch integrals at {0} of {1} points ran out of subdivisions before reaching their tolerance.".format(
+                    np.count_nonzero(~converged), len(converged)), integrate.IntegrationWarning)
+        elif engine == 'luminosity' :
+            table = get_luminosity_table(self.pdfset,self.pdf_member,self.ECM,self.flavours)
+            parton_integrand = parton_integrands[integrand_name.replace('hadronic','parton')]
+            integrals[todo], errors = table.hadronic_integrals(parton_integrand,mmed[todo],mdm[todo],gamma[todo])
+            # Rescaled depths are only as good as these integrals, so say so
+            # (as quad does) where the error estimate is too large to ignore.
+            with np.errstate(divide='ignore', invalid='ignore') :
+                relative_errors = errors/np.abs(integrals[todo])
+            inaccurate = relative_errors > luminosity.luminosity_tolerance
+            if inaccurate.any() :
+                import scipy.integrate as integrate
+                profiling.count("luminosity.points_above_tolerance", int(np.count_nonzero(inaccurate)))
+                warnings.warn("The luminosity integrals at {0} of {1} points have estimated relative errors above {2:g} (largest {3:.2g}).".format(
+                    np.count_nonzero(inaccurate), len(errors), luminosity.luminosity_tolerance, np.max(relative_errors[inaccurate])),
+                    integrate.IntegrationWarning)
+        elif n_workers == 1 :
+            integrals[todo] = hadronic_integrals(getattr(self._wrapper,integrand_name),mmed[todo],mdm[todo],gamma[todo],self.ECM,pid_args)
+        else :
+            integrals[todo] = hadronic_integrals_parallel(integrand_name,mmed[todo],mdm[todo],gamma[todo],self.ECM,pid_args,self.pdfset,self.pdf_member,
+                n_workers=n_workers,chunk_size=chunk_size)
+
+        if cache is not None :
+            cache.store(model, pdf_key, self.ECM, mmed[todo], mdm[todo], gamma[todo], integrals[todo])
+        return integrals[inverse].reshape(shape)
+
+    @profiled
+    def parton_level_integrals(self, mmed, mdm, gamma, vectorised=False, n_nodes=64, return_error=False) :
+        '''
+        Parton-level integrals (without couplings) at the given mass points and widths,
+        using the model's parton-level integrand.
+        By default each point is integrated adaptively by scipy quad through lhapdfwrap.
+        With vectorised=True, all points are integrated at once with a fixed
+        Gauss-Legendre rule (see parton_integrals_vectorised), which needs no LHAPDF.
+        return_error also returns a per-point error estimate.
+        '''
+        mmed, mdm, gamma = np.broadcast_arrays(mmed, mdm, gamma)
+
+        if vectorised :
+            xsecs, errors = parton_integrals_vectorised(parton_integrands[self._parton_integrand],mmed,mdm,gamma,self.ECM,n_nodes=n_nodes)
+            if return_error : return xsecs.reshape(mmed.shape), errors.reshape(mmed.shape)
+            return xsecs.reshape(mmed.shape)
+
+        if not self._wrapper :
+            raise SystemExit("""You do not have LHAPDF installed! You cannot use this function.""")
+
+        import scipy.integrate as integrate
+
+        # Integrate is adaptive and fundamentally
+        # doesn't work with broadcasting.
+        # So for this function we are going to have to 
+        # actually do the values one at a time.
+        integrand = getattr(self._wrapper,self._parton_integrand)
+        # When profiling, ask quad for its evaluation count and any warning
+        # (such as hitting the subdivision limit) instead of printing it.
+        full_output = 1 if profiling.is_active() else 0
+        xsecs = []
+        errors = []
+        for mmed_i, mdm_i, gamma_i in zip(mmed.ravel(), mdm.ravel(), gamma.ravel()) :
+            intpoints = [mmed_i,mmed_i**2-gamma_i,mmed_i**2,mmed_i**2+gamma_i]
+            integral = integrate.quad(integrand,4.*mdm_i**2,self.ECM,args=(gamma_i,mmed_i,mdm_i),points=intpoints,limit=500,
+                full_output=full_output)
+            if full_output :
+                profiling.count("parton.points")
+                profiling.count("parton.integrand_evaluations", integral[2]["neval"])
+                if len(integral) > 3 :
+                    profiling.count("parton.points_hit_limit")
+                    warnings.warn(integral[3], integrate.IntegrationWarning)
+            xsecs.append(integral[0])
+            errors.append(integral[1])
+        xsecs = np.array(xsecs).reshape(mmed.shape)
+        if return_error : return xsecs, np.array(errors).reshape(mmed.shape)
+        return xsecs
+
+
+    @profiled
+    def hadron_level_xsec_monox_from_table(self, table, return_error=False) :
+        '''
+        (Relative) hadron-level cross section interpolated from a HadronicTable
+        (see couplingscan.tables) instead of integrated point by point.
+        With return_error=True, also returns the estimated relative interpolation error.
+        '''
+        table.check_compatible(self)
+        gamma = self.mediator_total_width()
+        integrals = table.integrals(self._coupling,self.mmed,self.mdm,gamma,return_error=return_error)
+        if return_error :
+            return self.gq**2 * self.gdm**2 * integrals[0], integrals[1]
+        return self.gq**2 * self.gdm**2 * integrals
 
 
 @dataclass
@@ -181,34 +516,28 @@ class DMScalarModelScan(DMModelScan):
     '''
     _coupling: str = 'scalar'
 
-    def mediator_total_width(self):
-        return self.mediator_partial_width_quarks() + self.mediator_partial_width_dm() + self.mediator_partial_width_gluon()
-    
-    def mediator_partial_width_quarks(self):
-        width = 0
+    def mediator_factors(self, mmed):
+        '''
+        Coupling-independent parts of the widths for mediator -> q q and g g.
+        '''
         v = 246
-        for mq in Quarks:
-            yq = np.sqrt(2) * mq.value / v
-            iwidth = np.select([self.mmed < 2*mq.value, self.mmed >= 2*mq.value],
-                [0, 3 * self.gq**2 * yq**2 * self.mmed / (16 * PI) * beta(mq.value, self.mmed)**3],
-                default=np.nan)            
-
-            width += iwidth      
-
-        return width      
+        alphas = 0.130
+        yq = np.sqrt(2) * quark_masses / v
+        quarks = np.sum(threshold(mmed, quark_masses,
+            3 * yq**2 * mmed / (16 * PI) * beta(quark_masses, mmed)**3), axis=0)
+        gluon = alphas ** 2 * mmed**3 / (32 * PI**3 * v**2)
+        gluon = gluon * np.abs(self.fs(4 * (Quarks.top.value / mmed)**2))**2
+        return {"quarks" : quarks, "gluon" : gluon}
+
+    def dm_factor(self, mmed, mdm):
+        '''
+        Coupling-independent part of the width for mediator -> DM DM.
+        '''
+        return threshold(mmed, mdm, mmed / (8 * PI) * beta(mdm, mmed) ** 3)
 
-    def mediator_partial_width_dm(self):
-        width = np.select([self.mmed < 2*self.mdm, self.mmed >= 2*self.mdm],
-            [0, self.gdm**2 * self.mmed / (8 * PI) * beta(self.mdm, self.mmed) ** 3],
-            default=np.nan)  
-        return width      
-    
+    @profiled
     def mediator_partial_width_gluon(self):
-        alphas = 0.130
-        v = 246
-        width = alphas ** 2 * self.gq**2 * self.mmed**3 / (32 * PI**3 * v**2)
-        width = width * np.abs(self.fs(4 * (Quarks.top.value / self.mmed)**2))**2
-        return width
+        return self._widths()["gluon"]
 
     def fs(self,simple):
         tau = simple.astype(complex)
@@ -222,33 +551,28 @@ class DMPseudoModelScan(DMModelScan):
     '''
     _coupling: str = 'pseudo'
 
-    def mediator_total_width(self):
-        return self.mediator_partial_width_quarks() + self.mediator_partial_width_dm() + self.mediator_partial_width_gluon()
-    
-    def mediator_partial_width_quarks(self):
-        width = 0
+    def mediator_factors(self, mmed):
+        '''
+        Coupling-independent parts of the widths for mediator -> q q and g g.
+        '''
         v = 246
-        for mq in Quarks:
-            yq = np.sqrt(2) * mq.value / v
-            iwidth = np.select([self.mmed < 2*mq.value, self.mmed >= 2*mq.value],
-                [0, 3 * self.gq**2 * yq**2 * self.mmed / (16 * PI) * beta(mq.value, self.mmed)],
-                default=np.nan)            
-            width += iwidth
-
-        return width
+        alphas = 0.130
+        yq = np.sqrt(2) * quark_masses / v
+        quarks = np.sum(threshold(mmed, quark_masses,
+            3 * yq**2 * mmed / (16 * PI) * beta(quark_masses, mmed)), axis=0)
+        gluon = alphas ** 2 * mmed**3 / (32 * PI**3 * v**2)
+        gluon = gluon * np.abs(self.fps(4 * (Quarks.top.value / mmed)**2))**2
+        return {"quarks" : quarks, "gluon" : gluon}
+
+    def dm_factor(self, mmed, mdm):
+        '''
+        Coupling-independent part of the width for mediator -> DM DM.
+        '''
+        return threshold(mmed, mdm, mmed / (8 * PI) * beta(mdm, mmed))
 
-    def mediator_partial_width_dm(self):
-        width = np.select([self.mmed < 2*self.mdm, self.mmed >= 2*self.mdm],
-            [0, self.gdm **2 * self.mmed / (8 * PI) * beta(self.mdm, self.mmed)],
-            default=np.nan)
-        return width
-    
+    @profiled
     def mediator_partial_width_gluon(self):
-        alphas = 0.130
-        v = 246
-        width = alphas ** 2 * self.gq**2 * self.mmed**3 / (32 * PI**3 * v**2)
-        width = width * np.abs(self.fps(4 * (Quarks.top.value / self.mmed)**2))**2
-        return width
+        return self._widths()["gluon"]
 
     # These need to be complex valued
     def fps(self,simple):
@@ -263,104 +587,77 @@ class DMVectorModelScan(DMModelScan):
     '''
     _coupling: str = 'vector'
 
-    def mediator_total_width(self):
-        return self.mediator_partial_width_quarks() + self.mediator_partial_width_dm() + self.mediator_partial_width_leptons()
+    # Integrands used for the monojet cross sections
+    _hadronic_integrand = 'integrand_hadronic_vector'
+    _parton_integrand = 'integrand_parton_vector'
 
-    def mediator_partial_width_quarks(self):
+    def mediator_factors(self, mmed):
         '''
-        On-shell width for mediator -> q q.
+        Coupling-independent parts of the on-shell widths for mediator -> q q
+        and l l, where l is a charged or neutral lepton.
         '''
-
-        width = 0
-        for mq in Quarks:
-            # Only calculate when mq < 0.5 mmed, or we get errors.
-            iwidth = np.select([self.mmed < 2*mq.value, self.mmed >= 2*mq.value],
-                [0, 3 * self.gq**2 * self.mmed / (12 * PI) * alpha(mq.value, self.mmed) * beta(mq.value, self.mmed)],
-                default=np.nan)
-            width += iwidth
-
-        return width
-
-    def mediator_partial_width_dm(self):
+        # Only nonzero when m < 0.5 mmed.
+        quarks = np.sum(threshold(mmed, quark_masses,
+            3 * mmed / (12 * PI) * alpha(quark_masses, mmed) * beta(quark_masses, mmed)), axis=0)
+        # Neutrinos, then charged leptons
+        leptons = mmed / (24*PI) + np.sum(threshold(mmed, lepton_masses,
+            mmed / (12*PI) * alpha(lepton_masses, mmed) * beta(lepton_masses, mmed)), axis=0)
+        return {"quarks" : quarks, "leptons" : leptons}
+
+    def dm_factor(self, mmed, mdm):
         '''
-        On-shell width for mediator -> DM DM.
+        Coupling-independent part of the on-shell width for mediator -> DM DM.
         '''
-        width = np.select([self.mmed < 2*self.mdm, self.mmed >= 2*self.mdm],
-                [0, self.gdm**2 * self.mmed / (12 * PI) * alpha(self.mdm, self.mmed) * beta(self.mdm, self.mmed)],
-                default=np.nan)
-        return width
+        return threshold(mmed, mdm,
+            mmed / (12 * PI) * alpha(mdm, mmed) * beta(mdm, mmed))
 
+    @profiled
     def mediator_partial_width_leptons(self):
         '''
         On-shell width for mediator -> l l, where l is a charged or neutral lepton.
         '''
-        # Neutrinos
-        width = self.gl**2 / (24*PI) * self.mmed
-
-        # Charged leptons
-        for ml in Leptons:
-            # Only add width for ml < mmed
-            iwidth = np.select([self.mmed < 2*ml.value, self.mmed >= 2*ml.value],
-                [0, self.gl**2 * self.mmed / (12*PI) * alpha(ml.value, self.mmed) * beta(ml.value, self.mmed)],
-                default=np.nan)            
-            width += iwidth
-
-        return width
+        return self._widths()["leptons"]
 
+    @profiled
     def propagator_relative(self) :
         '''
         Integral of full propagator expression for vector mediator
         '''        
         gamma = self.mediator_total_width()
-        arctan_factor = PI/2.0 + np.arctan((self.mmed**2 - 4.*self.mdm**2)/(self.mmed*gamma))
-        sigma = self.gq**2 * self.gdm**2 * arctan_factor/(self.mmed*gamma)
+        sigma = self.gq**2 * self.gdm**2 * propagator_integral(self.mmed,self.mdm,gamma)
         return sigma
 
-    def hadron_level_xsec_monox_relative(self) :
+    @profiled
+    def hadron_level_xsec_monox_relative(self, n_workers=1, chunk_size=None, cache=None, engine='nquad') :
         '''
         (Relative) hadron-level cross section for vector mediator to DM.
         You can only use this function if you have LHAPDF installed.
+        Set n_workers to spread the integrals over several processes,
+        and pass an IntegralCache to reuse integrals from earlier calls.
+        See hadron_level_integrals for the choice of engine.
         '''
-        if not self._wrapper :
-            raise SystemExit("""You do not have LHAPDF installed! You cannot use this function.""")
-
         gamma = self.mediator_total_width()
-        xsecs = []
-        for mmed_i, mdm_i, gamma_i in zip(self.mmed, self.mdm, gamma) :
-            xsec = 0
-            for q_pid in range(1,self._nquarks_pdf) :  
-                integral = integrate.nquad(self._wrapper.integrand_hadronic_vector,[self.limit_x1,self.limit_x2],args=(q_pid,gamma_i,mmed_i,mdm_i),opts=[self.opts_x1,self.opts_x2])
-                xsec = xsec + integral[0]
-            xsecs.append(xsec)
+        xsecs = self.hadron_level_integrals(self._hadronic_integrand,self.mmed,self.mdm,gamma,
+            n_workers=n_workers,chunk_size=chunk_size,cache=cache,engine=engine)
         # For properly broadcasting gq and gdm dependence
         xsecs = self.gq**2 * self.gdm**2 * xsecs
         return xsecs
 
     # In case of future relevance: parton level relative xsec
-    def parton_level_xsec_monox_relative(self) :
+    @profiled
+    def parton_level_xsec_monox_relative(self, vectorised=False, n_nodes=64, return_error=False) :
         '''
         (Relative) parton-level cross section for vector mediator to DM.
-        You can only use this function if you have LHAPDF installed.
-        True, it does not depend on LHAPDF, but it does depend on compiled
-        C++ code which was not created without LHAPDF in your install.
-        ''' 
-        if not self._wrapper :
-            raise SystemExit("""You do not have LHAPDF installed! You cannot use this function.""")
-
+        See parton_level_integrals for the options. The default adaptive
+        integration needs LHAPDF: it does not use the PDFs, but it does use
+        compiled C++ code which is only built when LHAPDF is available.
+        '''
         gamma = self.mediator_total_width()
-
-        # Integrate is adaptive and fundamentally
-        # doesn't work with broadcasting.
-        # So for this function we are going to have to 
-        # actually do the values one at a time.
-        # if type(self.mmed) is np.ndarray or type(self.mdm) is np.ndarray :
-        xsecs = []
-        for mmed_i, mdm_i, gamma_i in zip(self.mmed, self.mdm, gamma) :
-            intpoints = [mmed_i,mmed_i**2-gamma_i,mmed_i**2,mmed_i**2+gamma_i]
-            integral = integrate.quad(self._wrapper.integrand_parton_vector,4.*mdm_i**2,self.ECM,args=(gamma_i,mmed_i,mdm_i),points=intpoints,limit=500)
-            xsecs.append(integral[0])
-        xsecs = self.gq**2 * self.gdm**2 * xsecs
-        return xsecs 
+        integrals = self.parton_level_integrals(self.mmed,self.mdm,gamma,vectorised=vectorised,n_nodes=n_nodes,return_error=return_error)
+        if return_error :
+            return self.gq**2 * self.gdm**2 * integrals[0], self.gq**2 * self.gdm**2 * integrals[1]
+        xsecs = self.gq**2 * self.gdm**2 * integrals
+        return xsecs
 
             
 @dataclass
@@ -371,97 +668,79 @@ class DMAxialModelScan(DMModelScan):
     '''
     _coupling: str = 'axial'
 
-    def mediator_total_width(self):
-        return self.mediator_partial_width_quarks() + self.mediator_partial_width_dm() + self.mediator_partial_width_leptons()
+    # Integrands used for the monojet cross sections
+    _hadronic_integrand = 'integrand_hadronic_axialvector'
+    _parton_integrand = 'integrand_parton_axialvector'
 
-    def mediator_partial_width_quarks(self):
+    def mediator_factors(self, mmed):
         '''
-        On-shell width for mediator -> q q.
+        Coupling-independent parts of the on-shell widths for mediator -> q q
+        and l l, where l is a charged or neutral lepton.
         '''
-        width = 0
-
-        for mq in Quarks:
-            # Only add width for mq < mmed
-            iwidth = np.select([self.mmed < 2*mq.value, self.mmed >= 2*mq.value],
-                [0, 3 * self.gq**2 * self.mmed / (12 * PI) * beta(mq.value, self.mmed)**3],
-                default=np.nan)
-            width += iwidth
-
-        return width
-
-    def mediator_partial_width_dm(self):
+        # Only nonzero when m < 0.5 mmed.
+        quarks = np.sum(threshold(mmed, quark_masses,
+            3 * mmed / (12 * PI) * beta(quark_masses, mmed)**3), axis=0)
+        # Neutrinos, then charged leptons
+        leptons = mmed / (24*PI) + np.sum(threshold(mmed, lepton_masses,
+            mmed / (12*PI) * beta(lepton_masses, mmed)**3), axis=0)
+        return {"quarks" : quarks, "leptons" : leptons}
+
+    def dm_factor(self, mmed, mdm):
         '''
-        On-shell width for mediator -> DM DM.
+        Coupling-independent part of the on-shell width for mediator -> DM DM.
         '''
-        width = np.select([self.mmed < 2*self.mdm, self.mmed >= 2*self.mdm],
-            [0,self.gdm**2 * self.mmed / (12 * PI) * beta(self.mdm, self.mmed)**3],
-            default=np.nan)
-
-        return width
+        return threshold(mmed, mdm, mmed / (12 * PI) * beta(mdm, mmed)**3)
 
+    @profiled
     def mediator_partial_width_leptons(self):
         '''
         On-shell width for mediator -> l l, where l is a charged or neutral lepton.
         '''
-        # Neutrinos
-        width = self.gl**2 / (24*PI) * self.mmed
-
-        # Charged leptons
-        for ml in Leptons:
-           # Only add width for ml < mmed
-            iwidth = np.select([self.mmed < 2*ml.value, self.mmed >= 2*ml.value],
-                [0,self.gl**2 * self.mmed / (12*PI) * beta(ml.value, self.mmed)**3],
-                default=np.nan)
-            
-            width += iwidth
-
-        return width
+        return self._widths()["leptons"]
 
+    @profiled
     def propagator_relative(self) :
         '''
         Integral of full propagator expression for axial-vector mediator
         '''        
         gamma = self.mediator_total_width()
-        arctan_factor = PI/2.0 + np.arctan((self.mmed**2 - 4.*self.mdm**2)/(self.mmed*gamma))
-        sigma = self.gq**2 * self.gdm**2 * arctan_factor/(self.mmed*gamma)
+        sigma = self.gq**2 * self.gdm**2 * propagator_integral(self.mmed,self.mdm,gamma)
         return sigma       
 
-    def hadron_level_xsec_monox_relative(self) :
+    @profiled
+    def hadron_level_xsec_monox_relative(self, n_workers=1, chunk_size=None, cache=None, engine='nquad') :
         '''
-        (Relative) hadron-level cross section for axial-vector mediator to DM
+        (Relative) hadron-level cross section for axial-vector mediator to DM.
+        Set n_workers to spread the integrals over several processes,
+        and pass an IntegralCache to reuse integrals from earlier calls.
+        See hadron_level_integrals for the choice of engine.
         '''        
-        if not self._wrapper :
-            raise SystemExit("""You do not have LHAPDF installed! You cannot use this function.""")
-
         gamma = self.mediator_total_width()
-        xsecs = []
-        for mmed_i, mdm_i, gamma_i in zip(self.mmed, self.mdm, gamma) :
-            xsec = 0
-            for q_pid in range(1,self._nquarks_pdf) :  
-                integral = integrate.nquad(self._wrapper.integrand_hadronic_axialvector,[self.limit_x1,self.limit_x2],args=(q_pid,gamma_i,mmed_i,mdm_i),opts=[self.opts_x1,self.opts_x2],full_output=True) 
-                xsec = xsec + integral[0]
-            xsecs.append(xsec)
+        xsecs = self.hadron_level_integrals(self._hadronic_integrand,self.mmed,self.mdm,gamma,
+            n_workers=n_workers,chunk_size=chunk_size,cache=cache,engine=engine)
         xsecs = self.gq**2 * self.gdm**2 * xsecs
         return xsecs
 
     # In case of future relevance: parton level relative xsec
-    def parton_level_xsec_monox_relative(self) :
+    @profiled
+    def parton_level_xsec_monox_relative(self, vectorised=False, n_nodes=64, return_error=False) :
+        '''
+        (Relative) parton-level cross section for axial-vector mediator to DM.
+        See parton_level_integrals for the options. The default adaptive
+        integration needs LHAPDF: it does not use the PDFs, but it does use
+        compiled C++ code which is only built when LHAPDF is available.
         '''
-        (Relative) parton-level cross section for axial-vector mediator to DM
-        ''' 
-        if not self._wrapper :
-            raise SystemExit("""You do not have LHAPDF installed! You cannot use this function.""")
-
         gamma = self.mediator_total_width()
+        integrals = self.parton_level_integrals(self.mmed,self.mdm,gamma,vectorised=vectorised,n_nodes=n_nodes,return_error=return_error)
+        if return_error :
+            return self.gq**2 * self.gdm**2 * integrals[0], self.gq**2 * self.gdm**2 * integrals[1]
+        xsecs = self.gq**2 * self.gdm**2 * integrals
+        return xsecs
 
-        # Integrate is adaptive and fundamentally
-        # doesn't work with broadcasting.
-        # So for this function we are going to have to 
-        # actually do the values one at a time.
-        xsecs = []
-        for mmed_i, mdm_i, gamma_i in zip(self.mmed, self.mdm, gamma) :
-            intpoints = [mmed_i,mmed_i**2-gamma_i,mmed_i**2,mmed_i**2+gamma_i]
-            integral = integrate.quad(self._wrapper.integrand_parton_axialvector,4.*mdm_i**2,self.ECM,args=(gamma_i,mmed_i,mdm_i),points=intpoints,limit=500)
-            xsecs.append(integral[0])
-        xsecs = self.gq**2 * self.gdm**2 * xsecs
-        return xsecs 
\ No newline at end of file
+# Scan class for each model name accepted as a rescaling target.
+model_scans = {
+    'vector' : DMVectorModelScan,
+    'axial' : DMAxialModelScan,
+    'scalar' : DMScalarModelScan,
+    'pseudoscalar' : DMPseudoModelScan,
+}
@@ -0,0 +1,156 @@
+import numpy as np
+
+from couplingscan.scan import model_scans
+from couplingscan.interpolation import interpolate_in_width
+from couplingscan.profiling import profiled
+
+# Coupling limits as a function of mass, solved for directly.
+# Rather than rescaling to a long list of couplings and looking for where
+# the depth crosses 1, the depth at each mass point is treated as a function
+# of one free coupling and its root is found: first bracketed on a coarse
+# log-spaced scan, then refined by the Illinois variant of regula falsi in
+# log(coupling). Every step works on all unconverged mass points at once.
+
+_couplings = ('gq', 'gdm', 'gl')
+
+def illinois(function, a, b, fa, fb, tolerance=1e-8, max_iterations=100) :
+    '''
+    Roots of function within the brackets [a, b], one per entry, where fa and fb
+    (the function at a and b) have opposite signs. function(x, active) takes
+    trial points for the entries selected by the boolean mask active and returns
+    the function there, so only unconverged entries are evaluated.
+    Stops when the bracket is narrower than tolerance or the function is zero.
+    A NaN inside a bracket falls back to bisection for that step.
+    Returns the roots, NaN where a bracket is not valid.
+    '''
+    a, b, fa, fb = [np.array(x, dtype=float) for x in (a, b, fa, fb)]
+    valid = np.isfinite(fa) & np.isfinite(fb) & (np.sign(fa) != np.sign(fb))
+    root = np.where(fa == 0, a, np.where(fb == 0, b, np.nan))
+    active = valid & np.isnan(root)
+
+    for iteration in range(max_iterations) :
+        if not active.any() : break
+        ia, ib, ifa, ifb = a[active], b[active], fa[active], fb[active]
+        c = ib - ifb*(ib - ia)/(ifb - ifa)
+        fc = np.asarray(function(c, active), dtype=float)
+        # Step to the middle instead where the secant lands on a NaN.
+        lost = np.isnan(fc)
+        if lost.any() :
+            c[lost] = 0.5*(ia[lost] + ib[lost])
+            retry = np.zeros(active.shape, dtype=bool)
+            retry[np.nonzero(active)[0][lost]] = True
+            fc[lost] = function(c[lost], retry)
+
+        # Keep the bracket: the new point replaces whichever end has the same sign.
+        # When the same end is kept twice in a row, halve its value (Illinois),
+        # which stops regula falsi stalling on one side.
+        swap = np.sign(fc) != np.sign(ifb)
+        new_a = np.where(swap, ib, ia)
+        new_fa = np.where(swap, ifb, 0.5*ifa)
+        a[active], fa[active], b[active], fb[active] = new_a, new_fa, c, fc
+
+        done = (fc == 0) | (np.abs(c - new_a) < tolerance) | np.isnan(fc)
+        indices = np.nonzero(active)[0]
+        root[indices[done]] = np.where(np.isnan(fc[done]), np.nan, c[done])
+        active[indices[done]] = False
+
+    # Anything left when out of iterations: best estimate so far.
+    root[active] = b[active]
+    return root
+
+class _DepthFunction :
+    # Exclusion depth at each reference mass point as a function of the free coupling,
+    # with the other two fixed, for the given rescaling method and target model.
+
+    def __init__(self, rescaler, method, model, free, fixed, options) :
+        self.rescaler = rescaler
+        self.method = method
+        self.model = model
+        self.free = free
+        self.fixed = fixed
+        self.options = options
+        self.reference_factor = np.broadcast_to(rescaler.reference_factors(method, **options),
+            np.shape(rescaler.reference_scan.mmed))
+        self._scans = {}
+
+    def _scan(self, active) :
+        # Unit-coupling scan of the target model at the active mass points.
+        # The active set only shrinks, so the same one often comes back.
+        key = active.tobytes()
+        if key not in self._scans :
+            reference = self.rescaler.reference_scan
+            self._scans = {key : model_scans[self.model](mmed=reference.mmed[active], mdm=reference.mdm[active],
+                gq=1.0, gdm=1.0, gl=1.0, **reference.pdf_settings())}
+        return self._scans[key]
+
+    def __call__(self, couplings, active) :
+        couplings = np.asarray(couplings, dtype=float)
+        values = dict(self.fixed)
+        values[self.free] = couplings
+        values = {name : np.broadcast_to(value, couplings.shape) for name, value in values.items()}
+        scan = self._scan(active)
+        factors, gamma = self.rescaler.cross_section_factors(scan, self.method,
+            values['gq'], values['gdm'], values['gl'], **self.options)
+        widths = gamma/scan.mmed
+        observed = interpolate_in_width(widths, self.rescaler.widths, self.rescaler.exclusion_depths[:, active])
+        return observed/(factors/self.reference_factor[active])
+
+@profiled
+def solve_coupling_limit(rescaler, method, free, gq=None, gdm=None, gl=None, model=None,
+    coupling_range=(1e-3, 10.), n_bracket=40, tolerance=1e-6, max_iterations=100, **options) :
+    '''
+    The value of the free coupling ('gq', 'gdm' or 'gl') at which the exclusion
+    depth equals 1, at each mass point of the rescaler's reference scan,
+    with the other two couplings fixed at the values given.
+    method is a Rescaler.rescale_by_ method without the prefix, model the
+    target model (default: the reference model), and options are that method's
+    extra arguments (e.g. engine, cache or table).
+
+    The depth is first evaluated at n_bracket couplings spaced logarithmically
+    across coupling_range, and the first crossing from above 1 to below 1 is
+    refined to a relative precision of tolerance. This is the smallest coupling
+    excluded, and is NaN where the depth does not cross 1 within the range
+    (or only does so where the limits no longer apply, e.g. beyond the largest width).
+    Each step evaluates all mass points at once, and only those not yet converged.
+    '''
+    if free not in _couplings :
+        print("Error: the free coupling must be one of",_couplings,"not",free,"!")
+        exit(1)
+    fixed = {name : value for name, value in zip(_couplings, (gq, gdm, gl)) if name != free}
+    if any(value is None for value in fixed.values()) :
+        print("Error: give values for the couplings other than",free,"!")
+        exit(1)
+    if method not in rescaler._method_groups :
+        print("Unrecognized rescaling method",method,"!")
+        print("Choose from:",list(rescaler._method_groups.keys()))
+        exit(1)
+    if not model : model = rescaler.reference_scan._coupling
+    rescaler.check_models_methods(rescaler._method_groups[method], model)
+    if method == 'hadronic_xsec_monox' and options.get("engine", 'nquad') == 'nquad' :
+        print("""Warning: solving with hadron-level cross sections integrates every mass point
+        at each of the n_bracket couplings and again at each refinement step.
+        Consider engine='batch' or engine='luminosity', or a smaller n_bracket.""")
+
+    depth = _DepthFunction(rescaler, method, model, free, fixed, options)
+    n_mass = np.size(rescaler.reference_scan.mmed)
+    everything = np.ones(n_mass, dtype=bool)
+
+    # Bracket: the depth on a log grid of couplings, all mass points at once.
+    log_grid = np.linspace(np.log(coupling_range[0]), np.log(coupling_range[1]), n_bracket)
+    with np.errstate(divide='ignore', invalid='ignore') :
+        log_depths = np.log(np.array([depth(np.full(n_mass, np.exp(u)), everything) for u in log_grid]))
+
+    # First step where the depth goes from at or above 1 to below it.
+    crossing = (log_depths[:-1] >= 0) & (log_depths[1:] < 0)
+    has_crossing = crossing.any(axis=0)
+    first = np.argmax(crossing, axis=0)
+    points = np.arange(n_mass)
+    a, b = log_grid[first], log_grid[first + 1]
+    fa, fb = log_depths[first, points], log_depths[first + 1, points]
+    fa = np.where(has_crossing, fa, np.nan)
+
+    def log_depth(log_coupling, active) :
+        with np.errstate(divide='ignore', invalid='ignore') :
+            return np.log(depth(np.exp(log_coupling), active))
+
+    return np.exp(illinois(log_depth, a, b, fa, fb, tolerance=tolerance, max_iterations=max_iterations))
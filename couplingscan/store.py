@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from couplingscan.results import RescaleResult, unique_in_order
+
+# Exclusion depths on disk, for results too expensive to recompute
+# (e.g. hadron-level rescaling) or too large to hold in memory.
+# A store is a directory holding:
+#   metadata.json  model, method, width assumptions, coupling axes and anything else given
+#   mmed.npy, mdm.npy  the mass points
+#   depths.npy  exclusion depths, shape (n_gq, n_gdm, n_gl, n_mass), NaN until written
+#   filled.npy  which coupling combinations have been written, shape (n_gq, n_gdm, n_gl)
+# The arrays are plain .npy files opened as memory maps, so writing a block
+# only touches the pages it covers and reading a slice only loads that slice.
+# Each coupling combination is one contiguous row of mass points, so slabs
+# of couplings are the cheap unit for both. Processes on the same machine can
+# fill different coupling slabs of one store at the same time.
+
+_version = 1
+
+class DepthStore :
+    '''
+    Exclusion depths for a grid of target couplings at a fixed set of mass
+    points, kept in a directory of memory-mapped arrays (see the top of this file).
+    Make one with create or for_rescaler and open an existing one with open.
+    Blocks of results are added with write, whose signature is that of a
+    Rescaler.iter_rescale sink, so a store can be passed straight to
+    rescale_to_sink.
+    '''
+
+    def __init__(self, path, mode='r') :
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, "metadata.json")) as metadata_file :
+            self.metadata = json.load(metadata_file)
+        if self.metadata.get("version", 0) > _version :
+            print("Error: the store in",path,"was written by a newer version of couplingscan!")
+            exit(1)
+        self.gq, self.gdm, self.gl = [np.array(self.metadata[name], dtype=float) for name in ("gq", "gdm", "gl")]
+        self.mmed = np.load(os.path.join(path, "mmed.npy"))
+        self.mdm = np.load(os.path.join(path, "mdm.npy"))
+        self.depths = np.load(os.path.join(path, "depths.npy"), mmap_mode=mode)
+        self.filled = np.load(os.path.join(path, "filled.npy"), mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, mmed, mdm, gq, gdm, gl, model=None, method=None, widths=None, exist_ok=False, **attributes) :
+        '''
+        Makes an empty store in the directory path for depths at the mass points
+        (mmed, mdm) and every combination of the coupling values gq, gdm, gl,
+        and returns it open for writing.
+        model, method and widths (the intrinsic width to mass ratios of the input
+        limits) describe the results; any other keyword arguments are saved in
+        the metadata too, and must be JSON-serialisable.
+        With exist_ok=True, an existing store with the same mass points and
+        couplings is opened for writing instead, so that several jobs filling
+        different slabs can all call this.
+        '''
+        mmed, mdm = [np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(mmed, mdm)]
+        gq, gdm, gl = [unique_in_order(g) for g in (gq, gdm, gl)]
+        metadata = dict(attributes, version=_version, model=model, method=method,
+            widths=None if widths is None else [float(w) for w in np.atleast_1d(widths)],
+            gq=gq.tolist(), gdm=gdm.tolist(), gl=gl.tolist(), n_mass=len(mmed))
+
+        if not os.path.exists(path) :
+            # Built next to its final place and moved there in one step, so other
+            # processes either see a complete store or none. If one of them got
+            # there first, the rename fails and theirs is used.
+            temporary = "{0}.{1}.tmp".format(path.rstrip(os.sep), os.getpid())
+            os.makedirs(temporary)
+            try :
+                with open(os.path.join(temporary, "metadata.json"), "w") as metadata_file :
+                    json.dump(metadata, metadata_file, indent=2)
+                np.save(os.path.join(temporary, "mmed.npy"), mmed)
+                np.save(os.path.join(temporary, "mdm.npy"), mdm)
+                depths = np.lib.format.open_memmap(os.path.join(temporary, "depths.npy"), mode='w+',
+                    dtype=float, shape=(len(gq), len(gdm), len(gl), len(mmed)))
+                depths[...] = np.nan
+                depths.flush()
+                del depths
+                np.save(os.path.join(temporary, "filled.npy"), np.zeros((len(gq), len(gdm), len(gl)), dtype=bool))
+                os.rename(temporary, path)
+            except OSError :
+                if not os.path.exists(path) : raise
+            finally :
+                if os.path.exists(temporary) : shutil.rmtree(temporary)
+        elif not exist_ok :
+            print("Error: there is already a store in",path,"! Pass exist_ok=True to add to it.")
+            exit(1)
+
+        store = cls(path, mode='r+')
+        if not store.matches(mmed, mdm, gq, gdm, gl) :
+            print("Error: the store in",path,"has different mass points or couplings!")
+            exit(1)
+        return store
+
+    @classmethod
+    def for_rescaler(cls, path, rescaler, method, target_gq, target_gdm, target_gl, model=None, exist_ok=False, **attributes) :
+        '''
+        A store for rescaling with rescaler to these target couplings with
+        method (a rescale_by_ method name without the prefix): its mass points
+        are those of the reference scan, and the metadata records the reference
+        model, couplings and PDF settings as well.
+        '''
+        reference = rescaler.reference_scan
+        if not model : model = reference._coupling
+        described = reference.pdf_settings()
+        described["flavours"] = list(described["flavours"])
+        described["reference_model"] = reference._coupling
+        described["reference_couplings"] = [float(np.unique(g)[0]) for g in (reference.gq, reference.gdm, reference.gl)]
+        described.update(attributes)
+        return cls.create(path, reference.mmed, reference.mdm, target_gq, target_gdm, target_gl,
+            model=model, method=method, widths=rescaler.widths, exist_ok=exist_ok, **described)
+
+    @classmethod
+    def open(cls, path, mode='r') :
+        '''
+        Opens an existing store, read-only unless mode is 'r+'.
+        '''
+        if mode not in ('r', 'r+') :
+            print("Error: open a store with mode 'r' or 'r+', not",mode,"!")
+            exit(1)
+        return cls(path, mode=mode)
+
+    def matches(self, mmed, mdm, gq, gdm, gl) :
+        '''Whether the store is for these mass points and coupling axes.'''
+        same = lambda a, b : np.shape(a) == np.shape(b) and np.allclose(a, b, rtol=RescaleResult.rtol, atol=RescaleResult.atol)
+        return all(same(a, np.asarray(b, dtype=float).ravel()) for a, b in
+            [(self.mmed, mmed), (self.mdm, mdm), (self.gq, gq), (self.gdm, gdm), (self.gl, gl)])
+
+    def _positions(self, axis, values) :
+        # Index of each value on a coupling axis, within the RescaleResult tolerance.
+        order = np.argsort(axis)
+        sorted_axis = axis[order]
+        upper = np.clip(np.searchsorted(sorted_axis, values), 0, len(axis)-1)
+        lower = np.clip(upper - 1, 0, len(axis)-1)
+        closest = np.where(np.abs(sorted_axis[lower] - values) < np.abs(sorted_axis[upper] - values), lower, upper)
+        found = np.isclose(sorted_axis[closest], values, rtol=RescaleResult.rtol, atol=RescaleResult.atol)
+        if not found.all() :
+            raise KeyError(np.asarray(values)[~found][0])
+        return order[closest]
+
+    def write(self, couplings, depths) :
+        '''
+        Saves depths for the coupling combinations couplings, of shape (3, n) as
+        made by Rescaler.create_target_arrays, with one row of depths per
+        combination: the layout of the blocks from Rescaler.iter_rescale.
+        Every combination must be on the store's axes.
+        '''
+        if self.mode == 'r' :
+            print("Error: the store in",self.path,"is open read-only!")
+            exit(1)
+        couplings = np.asarray(couplings, dtype=float).reshape(3, -1)
+        depths = np.asarray(depths, dtype=float).reshape(np.size(couplings,1), -1)
+        index = tuple(self._positions(axis, values) for axis, values in zip((self.gq, self.gdm, self.gl), couplings))
+        self.depths[index] = depths
+        # Depths reach the file before they are marked as written,
+        # so a store killed in between only loses this block.
+        self.depths.flush()
+        self.filled[index] = True
+        self.filled.flush()
+
+    # Lets a store be used directly as a sink.
+    __call__ = write
+
+    def missing(self) :
+        '''
+        The coupling combinations not yet written, in the layout of
+        Rescaler.create_target_arrays: shape (3, n).
+        '''
+        i, j, k = np.nonzero(~np.asarray(self.filled))
+        return np.array([self.gq[i], self.gdm[j], self.gl[k]])
+
+    @property
+    def complete(self) :
+        return bool(np.all(self.filled))
+
+    def result(self) :
+        '''
+        The depths as a RescaleResult, backed by the memory map: selections
+        only read what they need from disk. Combinations not yet written are NaN.
+        '''
+        return RescaleResult(self.gq, self.gdm, self.gl, depths=self.depths, mmed=self.mmed, mdm=self.mdm)
+
+def store_limit_depths(path, limit, scan, exist_ok=False, **attributes) :
+    '''
+    Stores the exclusion depths a limit parser (e.g. CouplingLimit_Dijet or
+    CrossSectionLimit_Dilepton) gives for scan, which must have one value of
+    each coupling. Where the limit has one curve per width, the one for each
+    point's width is stored, and the widths are recorded.
+    Returns the store.
+    '''
+    couplings = [np.unique(g) for g in (scan.gq, scan.gdm, scan.gl)]
+    if any(len(g) > 1 for g in couplings) :
+        print("Error: store the depths of a scan with one value of each coupling at a time!")
+        exit(1)
+    depths = limit.extract_exclusion_depths(scan)
+    widths = getattr(limit, "widths", None)
+    if type(depths) is dict :
+        depths = limit.select_depths(scan, depths)
+    store = DepthStore.create(path, scan.mmed, scan.mdm, *couplings, model=scan._coupling,
+        method=type(limit).__name__, widths=widths, exist_ok=exist_ok, **attributes)
+    store.write(np.array(couplings).reshape(3, 1), np.asarray(depths).reshape(1, -1))
+    return store
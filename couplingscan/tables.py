@@ -0,0 +1,172 @@
+import argparse
+from dataclasses import dataclass, field
+
+import numpy as np
+from scipy.interpolate import RegularGridInterpolator
+
+from couplingscan.scan import DMVectorModelScan, DMAxialModelScan
+
+# Interpolation tables for the hadron-level monojet integrals.
+# Once the couplings are factored out, the integral depends only on
+# (mmed, mdm, gamma/mmed), so it can be computed once on a grid in those
+# variables and then looked up for any scan.
+
+_table_models = {
+    'vector' : (DMVectorModelScan, 'integrand_hadronic_vector'),
+    'axial' : (DMAxialModelScan, 'integrand_hadronic_axialvector'),
+}
+
+@dataclass
+class HadronicTable :
+    '''
+    Hadron-level integrals (without couplings) tabulated on a regular grid
+    in log(mmed), log(mdm) and log(gamma/mmed), for one or more models.
+    Values are stored and interpolated as logs, since the integrals span
+    many orders of magnitude.
+    '''
+    mmed: np.ndarray
+    mdm: np.ndarray
+    width_ratio: np.ndarray
+    log_integrals: dict
+    pdfset: str
+    ECM: float
+    flavours: tuple = (1,)
+    # Largest relative error seen when the table was checked against
+    # itself at build time (see validation_error).
+    validation_error: float = np.nan
+    _interpolators: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def _axes(self) :
+        return (np.log(self.mmed), np.log(self.mdm), np.log(self.width_ratio))
+
+    def _interpolator(self, model, log_space=True) :
+        key = (model, log_space)
+        if key not in self._interpolators :
+            if model not in self.log_integrals :
+                print("Error: this table holds no integrals for the",model,"model!")
+                print("It has:",list(self.log_integrals.keys()))
+                exit(1)
+            values = self.log_integrals[model] if log_space else np.exp(self.log_integrals[model])
+            self._interpolators[key] = RegularGridInterpolator(self._axes(), values, bounds_error=False, fill_value=np.nan)
+        return self._interpolators[key]
+
+    def _query_points(self, mmed, mdm, gamma) :
+        mmed, mdm, gamma = np.broadcast_arrays(np.asarray(mmed, dtype=float), np.asarray(mdm, dtype=float), np.asarray(gamma, dtype=float))
+        # Below the lightest tabulated DM mass the integral no longer changes
+        # noticeably, so clamp there. This also covers mdm = 0.
+        # Everything else outside the table returns NaN.
+        mdm = np.maximum(mdm, self.mdm[0])
+        with np.errstate(divide='ignore', invalid='ignore') :
+            return np.stack([np.log(mmed), np.log(mdm), np.log(gamma/mmed)], axis=-1)
+
+    def integrals(self, model, mmed, mdm, gamma, return_error=False) :
+        '''
+        Interpolated integrals for the given mass points and total widths.
+        With return_error=True, also returns a per-point estimate of the relative
+        interpolation error: the difference between multilinear interpolation
+        in log and in linear space, which have different curvature errors
+        but agree wherever the grid is fine enough.
+        '''
+        points = self._query_points(mmed, mdm, gamma)
+        values = np.exp(self._interpolator(model)(points))
+        if not return_error : return values
+        linear = self._interpolator(model, log_space=False)(points)
+        with np.errstate(divide='ignore', invalid='ignore') :
+            error = np.abs(linear - values)/values
+        return values, error
+
+    def check_compatible(self, scan) :
+        '''The table is only valid for scans using the same PDF set, ECM and flavours.'''
+        if scan._pdf_label != self.pdfset or scan.ECM != self.ECM or tuple(scan.flavours) != tuple(self.flavours) :
+            print("Error: this table was built with PDF set",self.pdfset,", ECM",self.ECM,"and flavours",tuple(self.flavours))
+            print("but the scan uses",scan._pdf_label,",",scan.ECM,"and",tuple(scan.flavours),". Please build a matching table.")
+            exit(1)
+
+    def save(self, path) :
+        '''Writes the table to a single compressed .npz file.'''
+        arrays = {"log_integrals_{0}".format(model) : values for model, values in self.log_integrals.items()}
+        np.savez_compressed(path, mmed=self.mmed, mdm=self.mdm, width_ratio=self.width_ratio,
+            pdfset=np.array(self.pdfset), ECM=np.array(self.ECM), flavours=np.array(self.flavours),
+            validation_error=np.array(self.validation_error), **arrays)
+
+    @classmethod
+    def load(cls, path) :
+        with np.load(path) as data :
+            log_integrals = {key.replace("log_integrals_","") : data[key] for key in data.files if key.startswith("log_integrals_")}
+            return cls(mmed=data["mmed"], mdm=data["mdm"], width_ratio=data["width_ratio"],
+                log_integrals=log_integrals, pdfset=str(data["pdfset"]), ECM=float(data["ECM"]),
+                # Tables from before flavours were configurable are d quarks only.
+                flavours=tuple(int(pid) for pid in data["flavours"]) if "flavours" in data.files else (1,),
+                validation_error=float(data["validation_error"]))
+
+def validation_error(table, model) :
+    '''
+    Rebuilds the table from every other grid node and compares its interpolation
+    against the nodes left out. Linear interpolation error scales with the
+    square of the grid spacing, so the result is divided by four to estimate
+    the error of the full table.
+    '''
+    axes = table._axes()
+    coarse = tuple(axis[::2] for axis in axes)
+    values = table.log_integrals[model]
+    interpolator = RegularGridInterpolator(coarse, values[::2,::2,::2], bounds_error=False, fill_value=np.nan)
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+    left_out = np.ones(values.shape, dtype=bool)
+    left_out[::2,::2,::2] = False
+    estimate = np.exp(interpolator(grid[left_out]))
+    truth = np.exp(values[left_out])
+    with np.errstate(divide='ignore', invalid='ignore') :
+        return np.nanmax(np.abs(estimate - truth)/truth)/4.
+
+def build_hadronic_table(mmed, mdm, width_ratio, models=('vector','axial'), n_workers=None, chunk_size=None, cache=None, engine='nquad',
+    ECM=13000.**2, pdfset=None, pdf_member=None, flavours=(1,)) :
+    '''
+    Evaluates the hadron-level integrals on the full grid of the given
+    mmed, mdm and gamma/mmed values (each increasing and positive; log-spaced
+    grids work best) for each model, with the given ECM, PDF and flavours
+    (as for DMModelScan).
+    The integrals are run through hadron_level_integrals, so they can use
+    a process pool, an IntegralCache, the compiled batch engine or a luminosity table.
+    '''
+    mmed, mdm, width_ratio = [np.asarray(axis, dtype=float) for axis in (mmed, mdm, width_ratio)]
+    grid_mmed, grid_mdm, grid_ratio = np.meshgrid(mmed, mdm, width_ratio, indexing='ij')
+    gamma = grid_mmed * grid_ratio
+
+    log_integrals = {}
+    for model in models :
+        scan_class, integrand_name = _table_models[model]
+        scan = scan_class(mmed=grid_mmed.flatten(), mdm=grid_mdm.flatten(), gq=1.0, gdm=1.0, gl=0.0,
+            ECM=ECM, pdfset=pdfset, pdf_member=pdf_member, flavours=flavours)
+        integrals = scan.hadron_level_integrals(integrand_name, scan.mmed, scan.mdm, gamma.flatten(),
+            n_workers=n_workers, chunk_size=chunk_size, cache=cache, engine=engine)
+        with np.errstate(divide='ignore') :
+            log_integrals[model] = np.log(integrals).reshape(grid_mmed.shape)
+
+    table = HadronicTable(mmed=mmed, mdm=mdm, width_ratio=width_ratio, log_integrals=log_integrals,
+        pdfset=scan._pdf_label, ECM=scan.ECM, flavours=scan.flavours)
+    table.validation_error = max(validation_error(table, model) for model in models)
+    return table
+
+def main() :
+    parser = argparse.ArgumentParser(description="Build an interpolation table of hadron-level monojet integrals.")
+    parser.add_argument("output", help="Output .npz file")
+    parser.add_argument("--mmed", nargs=3, type=float, default=[10., 5000., 60], metavar=("MIN","MAX","N"))
+    parser.add_argument("--mdm", nargs=3, type=float, default=[1., 2500., 50], metavar=("MIN","MAX","N"))
+    parser.add_argument("--width-ratio", nargs=3, type=float, default=[1e-3, 1.0, 20], metavar=("MIN","MAX","N"))
+    parser.add_argument("--models", nargs="+", default=['vector','axial'], choices=list(_table_models.keys()))
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument("--engine", default='nquad', choices=['nquad','batch','luminosity'], help="Integrator (see DMModelScan.hadron_level_integrals)")
+    parser.add_argument("--sqrt-s", type=float, default=13000., help="Collision energy in GeV")
+    parser.add_argument("--pdfset", default=None, help="LHAPDF set name (default: couplingscan.pdf default)")
+    parser.add_argument("--pdf-member", type=int, default=None, help="Member of the PDF set")
+    parser.add_argument("--flavours", nargs="+", type=int, default=[1], help="Quark PDG ids to include")
+    args = parser.parse_args()
+
+    axes = [np.geomspace(low, high, int(n)) for low, high, n in (args.mmed, args.mdm, args.width_ratio)]
+    table = build_hadronic_table(*axes, models=args.models, n_workers=args.workers, engine=args.engine,
+        ECM=args.sqrt_s**2, pdfset=args.pdfset, pdf_member=args.pdf_member, flavours=args.flavours)
+    table.save(args.output)
+    print("Wrote",args.output,"with estimated interpolation error",table.validation_error)
+
+if __name__ == "__main__" :
+    main()
@@ -41,6 +41,9 @@ def get_extmodules() :
                 library_dirs = [lhapdf_dirs[0]],
                 libraries = ['LHAPDF'],
                 include_dirs = [lhapdf_dirs[1]],
+                # The batch integrators run on std::thread.
+                extra_compile_args = ['-pthread'],
+                extra_link_args = ['-pthread'],
                 ),
         ]
     return ext_modules
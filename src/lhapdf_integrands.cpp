@@ -1,12 +1,22 @@
 #include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+#include <pybind11/stl.h>
 //#include "LHAPDF/LHAPDF.h"
 #include <math.h>
+#include <algorithm>
+#include <thread>
+#include <functional>
 
 #include "lhapdf_integrands.hpp"
 
-IntegrandHandler::IntegrandHandler(const std::string& setname, double ECM) {
+IntegrandHandler::IntegrandHandler(const std::string& setname, double ECM)
+  : IntegrandHandler(setname, 0, ECM) {}
 
-  m_PDFSet = LHAPDF::mkPDF(setname,0);
+IntegrandHandler::IntegrandHandler(const std::string& setname, int member, double ECM) {
+
+  m_PDFSet = LHAPDF::mkPDF(setname,member);
+  m_setname = setname;
+  m_member = member;
   m_ECM = ECM;
 
 }
@@ -51,6 +61,258 @@ double IntegrandHandler::integrand_hadronic_axialvector(double x1, double x2, do
      return 1e8*total_integrand;
 }
 
+// Hadron-level integrands summed over several quark flavours.
+// All flavours come from one PDF call per x, so the cost barely
+// grows with the number of flavours.
+double IntegrandHandler::luminosity_flavours(double x1, double x2, double Q2, const std::vector<int>& pids) {
+
+     m_PDFSet->xfxQ2(x1, Q2, m_xf1);
+     m_PDFSet->xfxQ2(x2, Q2, m_xf2);
+     double lumi = 0;
+     for (int pid : pids) lumi += m_xf1[pid+6]*m_xf2[-pid+6];
+     return lumi;
+}
+
+double IntegrandHandler::integrand_hadronic_vector_flavours(double x1, double x2, const std::vector<int>& pids, double Gamma, double M, double mDM) {
+
+     double sHat = m_ECM*x1*x2;
+     double integrand_basic = integrand_parton_vector(sHat, Gamma, M, mDM);
+     if (integrand_basic == 0) return 0;
+     return 1e8*luminosity_flavours(x1, x2, sHat, pids)*integrand_basic;
+}
+
+double IntegrandHandler::integrand_hadronic_axialvector_flavours(double x1, double x2, const std::vector<int>& pids, double Gamma, double M, double mDM) {
+
+     double sHat = m_ECM*x1*x2;
+     double integrand_basic = integrand_parton_axialvector(sHat, Gamma, M, mDM);
+     if (integrand_basic == 0) return 0;
+     return 1e8*luminosity_flavours(x1, x2, sHat, pids)*integrand_basic;
+}
+
+// ---------------------------------------------------------------------------
+// Batch integration.
+// Instead of handing every integrand evaluation back to scipy, integrate the
+// whole hadronic cross section here. Changing variables from (x1, x2) to
+// (tau = x1 x2, y = log(x1/x2)/2) has unit Jacobian, so
+//   sigma = 1e8 * int dtau sigmahat(tau S) L(tau),
+//   L(tau) = sum_q int dy x1 f_q(x1) x2 f_qbar(x2),  |y| < -log(tau)/2,
+// matching the nquad integral of integrand_hadronic_* above.
+// Both integrals use adaptive 21-point Gauss-Kronrod.
+
+namespace {
+
+const double xgk[11] = {
+    0.995657163025808080735527280689003, 0.973906528517171720077964012084452,
+    0.930157491355708226001207180059508, 0.865063366688984510732096688423493,
+    0.780817726586416897063717578345042, 0.679409568299024406234327365114874,
+    0.562757134668604683339000099272694, 0.433395394129247190799265943165784,
+    0.294392862701460198131126603103866, 0.148874338981631210884826001129720,
+    0.000000000000000000000000000000000};
+const double wgk[11] = {
+    0.011694638867371874278064396062192, 0.032558162307964727478818972459390,
+    0.054755896574351996031381300244580, 0.075039674810919952767043140916190,
+    0.093125454583697605535065465083366, 0.109387158802297641899210590325805,
+    0.123491976262065851077600525520203, 0.134709217311473325928054001771707,
+    0.142775938577060080797094273138717, 0.147739104901338491374841515972068,
+    0.149445554002916905664936468389821};
+// 10-point Gauss weights, at the odd-indexed Kronrod nodes.
+const double wg[5] = {
+    0.066671344308688137593568809893332, 0.149451349150580593145776339657697,
+    0.219086362515982043995534934228163, 0.269266719309996355091226921569469,
+    0.295524224714752870173892994651338};
+
+struct Interval {
+    double a, b, result, error;
+};
+
+template <typename F>
+Interval gk21(F& f, double a, double b) {
+    double centre = 0.5*(a+b);
+    double half = 0.5*(b-a);
+    double fc = f(centre);
+    double kronrod = wgk[10]*fc;
+    double gauss = 0;
+    for (int i = 0; i < 10; i++) {
+        double dx = half*xgk[i];
+        double fsum = f(centre-dx) + f(centre+dx);
+        kronrod += wgk[i]*fsum;
+        if (i % 2 == 1) gauss += wg[i/2]*fsum;
+    }
+    return {a, b, kronrod*half, fabs((kronrod-gauss)*half)};
+}
+
+// Globally adaptive: keep bisecting the interval with the largest error
+// until the total error is within tolerance. If max_intervals is reached
+// first, converged is set to false (it is never set to true, so one flag
+// can collect several integrals).
+template <typename F>
+double adaptive_gk21(F f, double a, double b, double rel_tol, bool& converged, int max_intervals = 200) {
+    if (!(b > a)) return 0;
+    std::vector<Interval> intervals(1, gk21(f, a, b));
+    double result = intervals[0].result;
+    double error = intervals[0].error;
+    while (error > rel_tol*fabs(result) && (int)intervals.size() < max_intervals) {
+        auto worst = std::max_element(intervals.begin(), intervals.end(),
+            [](const Interval& l, const Interval& r) { return l.error < r.error; });
+        Interval old = *worst;
+        double mid = 0.5*(old.a+old.b);
+        *worst = gk21(f, old.a, mid);
+        intervals.push_back(gk21(f, mid, old.b));
+        const Interval& added = intervals.back();
+        result += worst->result + added.result - old.result;
+        error += worst->error + added.error - old.error;
+    }
+    if (error > rel_tol*fabs(result)) converged = false;
+    return result;
+}
+
+}
+
+double IntegrandHandler::luminosity_point(const LHAPDF::PDF* pdf, double tau, const std::vector<int>& pids, double rel_tol,
+    std::vector<double>& xf1, std::vector<double>& xf2, bool& converged) {
+
+    // PDFs for all flavours come from one call per x,
+    // shared between the requested quark flavours.
+    double Q2 = m_ECM*tau;
+    double ymax = -0.5*log(tau);
+    auto integrand_y = [&](double y) {
+        pdf->xfxQ2(sqrt(tau)*exp(y), Q2, xf1);
+        pdf->xfxQ2(sqrt(tau)*exp(-y), Q2, xf2);
+        double lumi = 0;
+        for (int pid : pids) lumi += xf1[pid+6]*xf2[-pid+6];
+        return lumi;
+    };
+    return adaptive_gk21(integrand_y, -ymax, ymax, rel_tol, converged);
+}
+
+double IntegrandHandler::integral_hadronic_point(const LHAPDF::PDF* pdf, bool axial, double M, double mDM, double Gamma,
+    const std::vector<int>& pids, double rel_tol, bool& converged) {
+
+    // converged collects both the outer integrals in s and every inner one in y.
+    std::vector<double> xf1, xf2;
+    auto luminosity = [&](double tau) {
+        return luminosity_point(pdf, tau, pids, rel_tol, xf1, xf2, converged);
+    };
+    auto sigmahat = [&](double s) {
+        return axial ? integrand_parton_axialvector(s, Gamma, M, mDM) : integrand_parton_vector(s, Gamma, M, mDM);
+    };
+
+    // PDFs are not defined down to x = 0, and the integrand vanishes there anyway.
+    double smin = std::max(4.*pow(mDM,2), 1e-10*m_ECM);
+    double smax = m_ECM;
+    if (!(smin < smax)) return 0;
+
+    // Split s into the resonance region, integrated in theta = atan((s - M^2)/(M Gamma))
+    // which flattens the Breit-Wigner, and the tails either side, integrated in log(s).
+    double peak_lo = smin, peak_hi = smin;
+    if (Gamma > 0 && M > 0) {
+        peak_lo = std::min(std::max(pow(M,2) - 10.*M*Gamma, smin), smax);
+        peak_hi = std::min(std::max(pow(M,2) + 10.*M*Gamma, smin), smax);
+    }
+    auto integrand_logs = [&](double logs) {
+        double s = exp(logs);
+        return sigmahat(s)*luminosity(s/m_ECM)*s/m_ECM;
+    };
+    auto integrand_theta = [&](double theta) {
+        double t = tan(theta);
+        double s = pow(M,2) + M*Gamma*t;
+        return sigmahat(s)*luminosity(s/m_ECM)*M*Gamma*(1.+t*t)/m_ECM;
+    };
+
+    double total = 0;
+    if (peak_lo > smin) total += adaptive_gk21(integrand_logs, log(smin), log(peak_lo), rel_tol, converged);
+    if (peak_hi > peak_lo) total += adaptive_gk21(integrand_theta, atan((peak_lo-pow(M,2))/(M*Gamma)), atan((peak_hi-pow(M,2))/(M*Gamma)), rel_tol, converged);
+    if (smax > peak_hi) total += adaptive_gk21(integrand_logs, log(std::max(peak_hi, smin)), log(smax), rel_tol, converged);
+
+    // Same overall scale as integrand_hadronic_*.
+    return 1e8*total;
+}
+
+pybind11::tuple IntegrandHandler::integral_hadronic_batch(bool axial, pybind11::array_t<double> M, pybind11::array_t<double> mDM,
+    pybind11::array_t<double> Gamma, const std::vector<int>& pids, int nthreads, double rel_tol) {
+
+    auto M_in = M.unchecked<1>();
+    auto mDM_in = mDM.unchecked<1>();
+    auto Gamma_in = Gamma.unchecked<1>();
+    ssize_t npoints = M_in.shape(0);
+    if (mDM_in.shape(0) != npoints || Gamma_in.shape(0) != npoints)
+        throw std::invalid_argument("M, mDM and Gamma must have the same length");
+
+    std::vector<double> Ms(npoints), mDMs(npoints), Gammas(npoints), results(npoints);
+    // One flag per point, in chars since std::vector<bool> packs bits
+    // that threads cannot write independently.
+    std::vector<char> converged(npoints, 1);
+    for (ssize_t i = 0; i < npoints; i++) {
+        Ms[i] = M_in(i);
+        mDMs[i] = mDM_in(i);
+        Gammas[i] = Gamma_in(i);
+    }
+
+    for_each_point(npoints, nthreads, [&](const LHAPDF::PDF* pdf, ssize_t i) {
+        bool point_converged = true;
+        results[i] = integral_hadronic_point(pdf, axial, Ms[i], mDMs[i], Gammas[i], pids, rel_tol, point_converged);
+        converged[i] = point_converged;
+    });
+
+    pybind11::array_t<bool> flags(npoints);
+    auto flags_out = flags.mutable_unchecked<1>();
+    for (ssize_t i = 0; i < npoints; i++) flags_out(i) = converged[i];
+    return pybind11::make_tuple(pybind11::array_t<double>(npoints, results.data()), flags);
+}
+
+void IntegrandHandler::for_each_point(ssize_t npoints, int nthreads, const std::function<void(const LHAPDF::PDF*, ssize_t)>& point) {
+
+    if (nthreads < 1) nthreads = std::max(1u, std::thread::hardware_concurrency());
+    nthreads = std::max(1, (int)std::min<ssize_t>(nthreads, npoints));
+    while ((int)m_threadPDFs.size() < nthreads-1)
+        m_threadPDFs.emplace_back(LHAPDF::mkPDF(m_setname, m_member));
+
+    // Nothing below touches Python objects.
+    pybind11::gil_scoped_release release;
+
+    auto work = [&](const LHAPDF::PDF* pdf, int first) {
+        for (ssize_t i = first; i < npoints; i += nthreads) point(pdf, i);
+    };
+    std::vector<std::thread> threads;
+    for (int t = 1; t < nthreads; t++)
+        threads.emplace_back(work, m_threadPDFs[t-1].get(), t);
+    work(m_PDFSet, 0);
+    for (auto& thread : threads) thread.join();
+}
+
+// q qbar luminosity L(tau) = sum_q int dy x1 f_q(x1) x2 f_qbar(x2) at Q^2 = tau S,
+// the part of the hadronic integral that does not depend on the model.
+pybind11::tuple IntegrandHandler::parton_luminosity(pybind11::array_t<double> tau, const std::vector<int>& pids,
+    int nthreads, double rel_tol) {
+
+    auto tau_in = tau.unchecked<1>();
+    ssize_t npoints = tau_in.shape(0);
+    std::vector<double> taus(npoints), results(npoints);
+    std::vector<char> converged(npoints, 1);
+    for (ssize_t i = 0; i < npoints; i++) taus[i] = tau_in(i);
+
+    for_each_point(npoints, nthreads, [&](const LHAPDF::PDF* pdf, ssize_t i) {
+        std::vector<double> xf1, xf2;
+        bool point_converged = true;
+        results[i] = (taus[i] > 0 && taus[i] < 1) ? luminosity_point(pdf, taus[i], pids, rel_tol, xf1, xf2, point_converged) : 0.;
+        converged[i] = point_converged;
+    });
+
+    pybind11::array_t<bool> flags(npoints);
+    auto flags_out = flags.mutable_unchecked<1>();
+    for (ssize_t i = 0; i < npoints; i++) flags_out(i) = converged[i];
+    return pybind11::make_tuple(pybind11::array_t<double>(npoints, results.data()), flags);
+}
+
+pybind11::tuple IntegrandHandler::integral_hadronic_vector(pybind11::array_t<double> M, pybind11::array_t<double> mDM,
+    pybind11::array_t<double> Gamma, const std::vector<int>& pids, int nthreads, double rel_tol) {
+    return integral_hadronic_batch(false, M, mDM, Gamma, pids, nthreads, rel_tol);
+}
+
+pybind11::tuple IntegrandHandler::integral_hadronic_axialvector(pybind11::array_t<double> M, pybind11::array_t<double> mDM,
+    pybind11::array_t<double> Gamma, const std::vector<int>& pids, int nthreads, double rel_tol) {
+    return integral_hadronic_batch(true, M, mDM, Gamma, pids, nthreads, rel_tol);
+}
 
 #define STRINGIFY(x) #x
 #define MACRO_STRINGIFY(x) STRINGIFY(x)
@@ -69,7 +331,8 @@ PYBIND11_MODULE(lhapdfwrap, m) {
     )pbdoc";
 
     py::class_<IntegrandHandler>(m, "IntegrandHandler")
-        .def(py::init<std::string,double>())
+        .def(py::init<std::string,double>(), py::arg("setname"), py::arg("ECM"))
+        .def(py::init<std::string,int,double>(), py::arg("setname"), py::arg("member"), py::arg("ECM"))
         .def("integrand_parton_vector", &IntegrandHandler::integrand_parton_vector, R"pbdoc(
         Parton-level cross section integrand for vector mediators.)pbdoc")
        .def("integrand_hadronic_vector", &IntegrandHandler::integrand_hadronic_vector, R"pbdoc(
@@ -77,7 +340,23 @@ PYBIND11_MODULE(lhapdfwrap, m) {
        .def("integrand_parton_axialvector", &IntegrandHandler::integrand_parton_axialvector, R"pbdoc(
         Parton-level cross section integrand for axial-vector mediators.)pbdoc")
        .def("integrand_hadronic_axialvector", &IntegrandHandler::integrand_hadronic_axialvector, R"pbdoc(
-        Hadron-level cross section integrand for axial-vector mediators.)pbdoc");
+        Hadron-level cross section integrand for axial-vector mediators.)pbdoc")
+       .def("integrand_hadronic_vector_flavours", &IntegrandHandler::integrand_hadronic_vector_flavours, R"pbdoc(
+        Hadron-level cross section integrand for vector mediators, summed over a list of quark flavours.)pbdoc")
+       .def("integrand_hadronic_axialvector_flavours", &IntegrandHandler::integrand_hadronic_axialvector_flavours, R"pbdoc(
+        Hadron-level cross section integrand for axial-vector mediators, summed over a list of quark flavours.)pbdoc")
+       .def("integral_hadronic_vector", &IntegrandHandler::integral_hadronic_vector,
+        py::arg("M"), py::arg("mDM"), py::arg("Gamma"), py::arg("pids"), py::arg("nthreads") = 1, py::arg("rel_tol") = 1e-6, R"pbdoc(
+        Full hadron-level integrals for arrays of vector mediator points, computed without the GIL.
+        Returns the integrals and, per point, whether every adaptive integral reached rel_tol.)pbdoc")
+       .def("integral_hadronic_axialvector", &IntegrandHandler::integral_hadronic_axialvector,
+        py::arg("M"), py::arg("mDM"), py::arg("Gamma"), py::arg("pids"), py::arg("nthreads") = 1, py::arg("rel_tol") = 1e-6, R"pbdoc(
+        Full hadron-level integrals for arrays of axial-vector mediator points, computed without the GIL.
+        Returns the integrals and, per point, whether every adaptive integral reached rel_tol.)pbdoc")
+       .def("parton_luminosity", &IntegrandHandler::parton_luminosity,
+        py::arg("tau"), py::arg("pids"), py::arg("nthreads") = 1, py::arg("rel_tol") = 1e-6, R"pbdoc(
+        q qbar parton luminosity summed over the given flavours, for an array of tau = shat/S.
+        Returns the luminosities and, per point, whether the integral reached rel_tol.)pbdoc");
 
 #ifdef VERSION_INFO
     m.attr("__version__") = MACRO_STRINGIFY(VERSION_INFO);
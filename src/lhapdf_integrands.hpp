@@ -1,6 +1,10 @@
 #include "LHAPDF/LHAPDF.h"
 #include <math.h>
 #include <iostream>
+#include <memory>
+#include <vector>
+#include <functional>
+#include <pybind11/numpy.h>
 
 class IntegrandHandler {
 
@@ -8,6 +12,8 @@ class IntegrandHandler {
 
         IntegrandHandler(const std::string& setname, double ECM);
 
+        IntegrandHandler(const std::string& setname, int member, double ECM);
+
         double integrand_parton_vector(double S, double Gamma, double M, double mDM);
 
         double integrand_hadronic_vector(double x1, double x2, double pid, double Gamma, double M, double mDM);
@@ -16,9 +22,53 @@ class IntegrandHandler {
 
         double integrand_hadronic_axialvector(double x1, double x2, double pid, double Gamma, double M, double mDM);
 
+        // As above, summed over several quark flavours.
+        double integrand_hadronic_vector_flavours(double x1, double x2, const std::vector<int>& pids, double Gamma, double M, double mDM);
+
+        double integrand_hadronic_axialvector_flavours(double x1, double x2, const std::vector<int>& pids, double Gamma, double M, double mDM);
+
+        // Full hadronic integrals for arrays of mass points, integrated entirely in C++.
+        // Each returns (integrals, converged): converged is false for points where
+        // an adaptive integral ran out of intervals before reaching rel_tol.
+        pybind11::tuple integral_hadronic_vector(pybind11::array_t<double> M, pybind11::array_t<double> mDM, pybind11::array_t<double> Gamma,
+            const std::vector<int>& pids, int nthreads, double rel_tol);
+
+        pybind11::tuple integral_hadronic_axialvector(pybind11::array_t<double> M, pybind11::array_t<double> mDM, pybind11::array_t<double> Gamma,
+            const std::vector<int>& pids, int nthreads, double rel_tol);
+
+        // q qbar luminosity at an array of tau = shat/S, integrated in C++,
+        // as (luminosities, converged).
+        pybind11::tuple parton_luminosity(pybind11::array_t<double> tau, const std::vector<int>& pids, int nthreads, double rel_tol);
+
     private :
 
+        // Runs point(pdf, i) for i from 0 to npoints-1 over nthreads threads,
+        // each with its own PDF object.
+        void for_each_point(ssize_t npoints, int nthreads, const std::function<void(const LHAPDF::PDF*, ssize_t)>& point);
+
+        double luminosity_point(const LHAPDF::PDF* pdf, double tau, const std::vector<int>& pids, double rel_tol,
+            std::vector<double>& xf1, std::vector<double>& xf2, bool& converged);
+
+        double luminosity_flavours(double x1, double x2, double Q2, const std::vector<int>& pids);
+
+        // Reused for every flavours integrand call rather than reallocated.
+        std::vector<double> m_xf1, m_xf2;
+
+        pybind11::tuple integral_hadronic_batch(bool axial, pybind11::array_t<double> M, pybind11::array_t<double> mDM, pybind11::array_t<double> Gamma,
+            const std::vector<int>& pids, int nthreads, double rel_tol);
+
+        double integral_hadronic_point(const LHAPDF::PDF* pdf, bool axial, double M, double mDM, double Gamma,
+            const std::vector<int>& pids, double rel_tol, bool& converged);
+
         LHAPDF::PDF * m_PDFSet;
 
+        // One PDF object per extra thread: LHAPDF grids are not guaranteed
+        // to be safe to evaluate from several threads at once.
+        std::vector<std::unique_ptr<LHAPDF::PDF>> m_threadPDFs;
+
+        std::string m_setname;
+
+        int m_member;
+
         double m_ECM;
-};
\ No newline at end of file
+};
@@ -8,6 +8,7 @@ import time
 
 from couplingscan.scan import *
 from couplingscan.rescaler import *
+from couplingscan.cache import IntegralCache
 from common_functions import *
 
 # Analysing results from 
@@ -81,7 +82,8 @@ print("Finished A2 limits")
 
 # Second: scale to a vector model.
 # Here we need to use the hadron level cross section.
-limits_V1_full = rescaler_fromA1.rescale_by_hadronic_xsec_monox(new_scenarios["V_gq0p25_gchi1p0"]["gq"],new_scenarios["V_gq0p25_gchi1p0"]["gdm"],new_scenarios["V_gq0p25_gchi1p0"]["gl"],'vector')
+# The integrals are slow, so keep them on disk: repeat runs only integrate new points.
+limits_V1_full = rescaler_fromA1.rescale_by_hadronic_xsec_monox(new_scenarios["V_gq0p25_gchi1p0"]["gq"],new_scenarios["V_gq0p25_gchi1p0"]["gdm"],new_scenarios["V_gq0p25_gchi1p0"]["gl"],'vector',cache=IntegralCache())
 limits_V1 = limits_V1_full[(new_scenarios["V_gq0p25_gchi1p0"]["gq"],new_scenarios["V_gq0p25_gchi1p0"]["gdm"],new_scenarios["V_gq0p25_gchi1p0"]["gl"])]
 new_scenarios["V_gq0p25_gchi1p0"]["limits"] = limits_V1
 print("Finished V1 limits")
@@ -0,0 +1,47 @@
+import numpy as np
+
+from couplingscan.cache import IntegralCache
+
+# Round trips through the on-disk cache of hadron-level integrals.
+
+def points() :
+    mmed = np.array([500., 1000., 1500., 2000.])
+    mdm = np.array([1., 100., 400., 1200.])
+    gamma = 0.03*mmed
+    return mmed, mdm, gamma
+
+def test_round_trip(tmp_path) :
+    cache = IntegralCache(str(tmp_path))
+    mmed, mdm, gamma = points()
+    values = np.array([1.5, 2.5e-3, np.nan, 7.25e4])
+    assert np.isnan(cache.lookup("vector", "NNPDF30_nlo_as_0118/0:[1]", 13000.**2, mmed, mdm, gamma)).all()
+    cache.store("vector", "NNPDF30_nlo_as_0118/0:[1]", 13000.**2, mmed, mdm, gamma, values)
+
+    # NaN results are not stored, so they are looked up as missing again.
+    assert len(cache) == 3
+    found = cache.lookup("vector", "NNPDF30_nlo_as_0118/0:[1]", 13000.**2, mmed, mdm, gamma)
+    assert np.array_equal(found, values, equal_nan=True)
+    # A new cache on the same directory (e.g. the next session) sees them too.
+    reopened = IntegralCache(str(tmp_path))
+    assert np.array_equal(reopened.lookup("vector", "NNPDF30_nlo_as_0118/0:[1]", 13000.**2, mmed, mdm, gamma), values, equal_nan=True)
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 5
+
+def test_keys(tmp_path) :
+    cache = IntegralCache(str(tmp_path))
+    mmed, mdm, gamma = points()
+    values = np.arange(1., 5.)
+    cache.store("vector", "pdf", 13000.**2, mmed, mdm, gamma, values)
+    # Widths that differ in the last bits, as from a different summation order, still match.
+    assert np.array_equal(cache.lookup("vector", "pdf", 13000.**2, mmed, mdm, gamma*(1. + 1e-15)), values)
+    # Anything else the integral depends on does not.
+    for model, pdf, ECM, widths in [("axial", "pdf", 13000.**2, gamma), ("vector", "other", 13000.**2, gamma),
+            ("vector", "pdf", 13600.**2, gamma), ("vector", "pdf", 13000.**2, 1.01*gamma)] :
+        assert np.isnan(cache.lookup(model, pdf, ECM, mmed, mdm, widths)).all()
+
+def test_eviction(tmp_path) :
+    cache = IntegralCache(str(tmp_path), max_entries=3)
+    mmed, mdm, gamma = points()
+    cache.store("vector", "pdf", 13000.**2, mmed, mdm, gamma, np.arange(1., 5.))
+    assert len(cache) == 3
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,43 @@
+import numpy as np
+
+from couplingscan.contours import contours, grid_contours, scattered_contours
+
+# Contours of a cone, whose level sets are circles of known radius.
+
+axis = np.linspace(-2., 2., 41)
+
+def cone() :
+    x, y = np.meshgrid(axis, axis, indexing='ij')
+    return x, y, np.hypot(x, y)
+
+def test_grid_circle() :
+    x, y, z = cone()
+    lines = grid_contours(axis, axis, z, 1.)
+    assert len(lines) == 1
+    line = lines[0]
+    # Closed, and on the circle to within linear interpolation across a cell.
+    assert np.array_equal(line[0], line[-1])
+    assert np.allclose(np.hypot(line[:,0], line[:,1]), 1., atol=5e-3)
+
+def test_several_sets_and_nan() :
+    x, y, z = cone()
+    holed = z.copy()
+    holed[x > 0.5] = np.nan
+    lines = grid_contours(axis, axis, np.array([z, 2.*z, holed]), 1.)
+    assert len(lines) == 3
+    assert np.allclose(np.hypot(*lines[1][0].T), 0.5, atol=5e-3)
+    # The NaN region cuts the circle open, and nothing is drawn inside it.
+    assert len(lines[2]) == 1 and not np.array_equal(lines[2][0][0], lines[2][0][-1])
+    assert (lines[2][0][:,0] <= 0.5).all()
+
+def test_scattered_points_match_grid() :
+    x, y, z = cone()
+    # Shuffled grid points are recognised as a grid; with one point missing
+    # they are triangulated instead. Both find the same circle.
+    order = np.random.default_rng(0).permutation(z.size)
+    for keep in [order, order[1:]] :
+        lines = contours(x.ravel()[keep], y.ravel()[keep], z.ravel()[keep], 1.)
+        assert len(lines) == 1
+        assert np.allclose(np.hypot(*lines[0].T), 1., atol=1e-2)
+    lines = scattered_contours(x.ravel(), y.ravel(), z.ravel(), 1.)
+    assert len(lines) == 1 and np.allclose(np.hypot(*lines[0].T), 1., atol=1e-2)
@@ -0,0 +1,29 @@
+import os
+import shutil
+
+import numpy as np
+
+from couplingscan.hepdata import load_hepdata
+
+# The cached load of a HEPData table has to give the same scans and limits
+# as parsing its JSON.
+
+source = os.path.join(os.path.dirname(__file__), "dijet_hepdata", "hepdata_gqplot_cms36ifb.json")
+
+def built_from(table) :
+    scan = table.model_scan('axial', gq=0.25, gdm=1.0, gl=0.0, mdm="x0")
+    scan.mdm = np.full_like(scan.mmed, 1.0)
+    limit = table.dijet_coupling_limit(mdm=1.0, gdm=1.0, gl=0.0, coupling='axial')
+    return scan, limit
+
+def test_cached_load_matches_json(tmp_path) :
+    path = str(tmp_path/os.path.basename(source))
+    shutil.copy(source, path)
+    parsed = built_from(load_hepdata(path, cache=False))
+    first = built_from(load_hepdata(path))
+    cached = built_from(load_hepdata(path))
+    for other in [first, cached] :
+        assert np.array_equal(parsed[0].mmed, other[0].mmed)
+        assert np.array_equal(parsed[1].gq_limits, other[1].gq_limits)
+        assert np.array_equal(parsed[1].extract_exclusion_depths(parsed[0]), other[1].extract_exclusion_depths(other[0]), equal_nan=True)
+    assert len(parsed[0].mmed) == 43
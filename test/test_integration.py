@@ -0,0 +1,33 @@
+import numpy as np
+import scipy.integrate as integrate
+
+from couplingscan.integration import parton_integrals_vectorised, parton_integrands
+
+# The vectorised parton-level integrals against adaptive quad, for a wide
+# and a narrow resonance. benchmarks/bench_resonance_quadrature.py covers
+# many more points.
+
+ECM = 13000.**2
+
+def reference(integrand, M, mDM, gamma) :
+    # Split at the peak and 100 widths either side of it (within the range),
+    # integrating near the peak in arctan((s - M**2)/(M gamma)) and elsewhere in log(s).
+    smin = 4.*mDM**2
+    low, high = max(M**2 - 100.*M*gamma, smin), min(M**2 + 100.*M*gamma, ECM)
+    in_log = lambda u : integrand(np.exp(u), gamma, M, mDM)*np.exp(u)
+    in_theta = lambda theta : integrand(M**2 + M*gamma*np.tan(theta), gamma, M, mDM)*M*gamma/np.cos(theta)**2
+    total = 0.
+    for a, b in [(low, M**2), (M**2, high)] :
+        total += integrate.quad(in_theta, *np.arctan((np.array([a, b]) - M**2)/(M*gamma)), epsabs=0, epsrel=1e-12, limit=1000)[0]
+    for a, b in [(smin, low), (high, ECM)] :
+        if a < b :
+            total += integrate.quad(in_log, *np.log([a, b]), epsabs=0, epsrel=1e-12, limit=1000)[0]
+    return total
+
+def test_against_quad() :
+    for name, integrand in parton_integrands.items() :
+        for M, mDM, width in [(2000., 100., 0.03), (3000., 10., 1e-5)] :
+            expected = reference(integrand, M, mDM, width*M)
+            value, estimate = parton_integrals_vectorised(integrand, M, mDM, width*M, ECM)
+            assert abs(value[0]/expected - 1.) < 1e-8, (name, M, width)
+            assert estimate[0] >= 0.
@@ -0,0 +1,66 @@
+import math
+
+import numpy as np
+
+from couplingscan.interpolation import interpolate_in_width
+
+# Checks of the vectorised width interpolation against the per-point
+# np.interp loop that pick_appropriate_limit used before.
+
+def loop_interpolation(test_widths, limit_widths, limit_sets) :
+    # The previous implementation.
+    appropriate_limits = []
+    for width, limits in zip(test_widths,np.transpose(limit_sets)) :
+        appropriate_observed = np.interp([width], limit_widths, limits,left=limits[0],right=math.nan)
+        appropriate_limits.append(appropriate_observed[0])
+    return np.array(appropriate_limits)
+
+def test_nonfinite_neighbours_at_tabulated_widths() :
+    # Exactly on the first or last tabulated width, a NaN or infinite
+    # limit for the other width must not leak into the result.
+    limit_widths = [0.05, 0.1]
+    for test_widths, limit_sets in [
+        ([0.1, 0.1], [[np.nan, np.inf], [2., 3.]]),
+        ([0.05, 0.05], [[2., 3.], [np.nan, np.inf]]),
+        ([0.05, 0.1], [[2., np.nan], [-np.inf, 3.]]),
+    ] :
+        expected = loop_interpolation(test_widths, limit_widths, limit_sets)
+        assert np.array_equal(expected, [2., 3.])
+        assert np.array_equal(interpolate_in_width(test_widths, limit_widths, limit_sets), expected)
+
+def test_nonfinite_neighbours_at_interior_width() :
+    limit_widths = [0.0, 0.05, 0.1]
+    limit_sets = [[np.inf, np.nan], [2., 3.], [np.nan, -np.inf]]
+    result = interpolate_in_width([0.05, 0.05], limit_widths, limit_sets)
+    assert np.array_equal(result, [2., 3.])
+
+def test_matches_loop_on_random_inputs() :
+    rng = np.random.default_rng(0)
+    npoints = 2000
+    for nwidths in [1, 2, 6] :
+        limit_widths = np.sort(rng.uniform(0.0, 0.1, nwidths))
+        limit_sets = rng.uniform(0.1, 10., (nwidths, npoints))
+        # Some widths below the smallest curve, some beyond the largest,
+        # some NaN, and some exactly on a tabulated width.
+        test_widths = rng.uniform(-0.01, 0.12, npoints)
+        test_widths[::50] = np.nan
+        test_widths[1::50] = limit_widths[rng.integers(nwidths, size=len(test_widths[1::50]))]
+        expected = loop_interpolation(test_widths, limit_widths, limit_sets)
+        result = interpolate_in_width(test_widths, limit_widths, limit_sets)
+        # NaN widths give no limit. (With a single curve, np.interp
+        # returned that curve even for a NaN width.)
+        finite = np.isfinite(test_widths)
+        assert np.isnan(result[~finite]).all()
+        assert np.allclose(result[finite], expected[finite], rtol=1e-12, atol=0, equal_nan=True)
+
+def test_unsorted_widths_and_leading_axes() :
+    rng = np.random.default_rng(1)
+    limit_widths = np.array([0.1, 0.0, 0.05])
+    limit_sets = rng.uniform(0.1, 10., (3, 50))
+    test_widths = rng.uniform(0.0, 0.12, (4, 50))
+    order = np.argsort(limit_widths)
+    result = interpolate_in_width(test_widths, limit_widths, limit_sets)
+    assert result.shape == (4, 50)
+    for row, widths in zip(result, test_widths) :
+        expected = loop_interpolation(widths, limit_widths[order], limit_sets[order])
+        assert np.allclose(row, expected, rtol=1e-12, atol=0, equal_nan=True)
@@ -0,0 +1,74 @@
+import numpy as np
+
+from couplingscan.results import RescaleResult
+
+# Checks of the array-backed rescaling results.
+
+def make_result(depths) :
+    depths = np.asarray(depths, dtype=float)
+    return RescaleResult(np.array([0.1, 0.2, 0.3]), np.array([1.0]), np.array([0.0]),
+        depths=depths.reshape(3, 1, 1, -1))
+
+def test_interp_on_grid_values() :
+    # The largest coupling is often NaN (its width is above the largest
+    # limit), and must not spoil the depths at the grid values below it.
+    result = make_result([1., 2., np.nan])
+    for gq in [0.1, 0.2] :
+        assert np.array_equal(result.interp(gq, 1.0, 0.0), result[(gq, 1.0, 0.0)])
+    assert np.allclose(result.interp(0.15, 1.0, 0.0), [1.5])
+    assert np.isnan(result.interp(0.25, 1.0, 0.0)).all()
+
+def test_interp_tolerance_at_both_ends() :
+    result = make_result([1., 2., 3.])
+    assert np.array_equal(result.interp(0.1 - 1e-12, 1.0, 0.0), result[(0.1 - 1e-12, 1.0, 0.0)])
+    assert np.array_equal(result.interp(0.3 + 1e-12, 1.0, 0.0), result[(0.3 + 1e-12, 1.0, 0.0)])
+    assert np.isnan(result.interp(0.05, 1.0, 0.0)).all()
+    assert np.isnan(result.interp(0.35, 1.0, 0.0)).all()
+
+def make_rescaler() :
+    from couplingscan.scan import DMVectorModelScan
+    from couplingscan.rescaler import Rescaler
+    mmed, mdm = [a.ravel() for a in np.meshgrid(np.linspace(200., 2000., 6), np.linspace(10., 900., 5))]
+    reference = DMVectorModelScan(mmed=mmed, mdm=mdm, gq=0.25, gdm=1.0, gl=0.0)
+    # Two width curves, so that large couplings run past the largest width and give NaN.
+    depths = {0.01 : np.linspace(0.5, 2., mmed.size), 0.05 : np.linspace(0.8, 3., mmed.size)}
+    return Rescaler(reference, depths)
+
+def old_output(rescaler, method, target_gq, target_gdm, target_gl) :
+    # What the rescale_by_ methods returned before RescaleResult: a dict keyed
+    # by coupling tuples, over the grid in np.meshgrid's default order.
+    target_arrays = np.array(np.meshgrid(target_gq, target_gdm, target_gl), dtype=float).reshape(3, -1)
+    depths = rescaler.target_exclusion_depths(method, rescaler.reference_scan._coupling, *target_arrays)
+    output_dict = {}
+    for i in range(np.shape(target_arrays)[1]) :
+        gq, gdm, gl = target_arrays[:,i]
+        output_dict[(gq, gdm, gl)] = depths[i]
+    return output_dict
+
+def test_matches_old_dict_output() :
+    rescaler = make_rescaler()
+    target_gq, target_gdm, target_gl = [0.1, 0.25, 0.5, 1.5], [0.5, 1.0], [0.0, 0.01, 0.1]
+    for method in ['propagator', 'br_quarks'] :
+        result = getattr(rescaler, "rescale_by_" + method)(target_gq, target_gdm, target_gl)
+        expected = old_output(rescaler, method, target_gq, target_gdm, target_gl)
+        assert isinstance(result, RescaleResult)
+        assert len(result) == len(expected) and set(result.keys()) == set(expected.keys())
+        # Some depths are NaN, or the check would not cover the width cut-off.
+        assert any(np.isnan(depths).any() for depths in expected.values())
+        for key, depths in expected.items() :
+            assert key in result
+            assert np.array_equal(result[key], depths, equal_nan=True)
+        plain = result.to_dict()
+        assert type(plain) is dict and set(plain) == set(expected)
+        assert np.array_equal(result.sel(gq=0.25), np.array([[expected[(0.25, gdm, gl)] for gl in target_gl] for gdm in target_gdm]), equal_nan=True)
+
+def test_iter_rescale_blocks_match_full_result() :
+    rescaler = make_rescaler()
+    target_gq, target_gdm, target_gl = [0.1, 0.25, 0.5], [0.5, 1.0], [0.0, 0.01]
+    result = rescaler.rescale_by_propagator(target_gq, target_gdm, target_gl)
+    seen = 0
+    for couplings, depths in rescaler.iter_rescale('propagator', target_gq, target_gdm, target_gl, chunk_size=5) :
+        for key, row in zip(map(tuple, couplings.T), depths) :
+            assert np.array_equal(result[key], row, equal_nan=True)
+            seen += 1
+    assert seen == len(result)
@@ -0,0 +1,27 @@
+import numpy as np
+
+from couplingscan.solver import illinois, solve_coupling_limit
+
+from test_results import make_rescaler
+
+def test_illinois_roots() :
+    # One root per entry, all found together.
+    targets = np.array([0.5, 2., 3.7, 9.])
+    function = lambda x, active : x**3 - targets[active]**3
+    a, b = np.zeros(4), np.full(4, 10.)
+    roots = illinois(function, a, b, function(a, np.ones(4, dtype=bool)), function(b, np.ones(4, dtype=bool)), tolerance=1e-12)
+    assert np.allclose(roots, targets, rtol=1e-10)
+
+def test_illinois_invalid_brackets() :
+    function = lambda x, active : x - 1.
+    roots = illinois(function, [2., 0., 0.], [3., 2., np.nan], [1., -1., -1.], [2., 1., np.nan])
+    assert np.isnan(roots[0]) and np.isclose(roots[1], 1.) and np.isnan(roots[2])
+
+def test_solved_limit_has_unit_depth() :
+    rescaler = make_rescaler()
+    gq = solve_coupling_limit(rescaler, 'propagator', 'gq', gdm=1.0, gl=0.0, tolerance=1e-10)
+    assert np.isfinite(gq).any()
+    # Rescaling to each solved coupling gives a depth of 1 at that mass point.
+    for i in np.flatnonzero(np.isfinite(gq)) :
+        depth = rescaler.rescale_by_propagator([gq[i]], [1.0], [0.0])[(gq[i], 1.0, 0.0)][i]
+        assert np.isclose(depth, 1., rtol=1e-6)